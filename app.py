@@ -1,19 +1,35 @@
 from __future__ import annotations
 
 import asyncio
+import hmac
 import logging
+import signal
+from typing import Awaitable, Callable, List
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Request, Response
 
 from .config import settings
-from .db import init_db
-from .handlers import admin, auth, browse, dispute, payment, profile, rating, reserve, sell, start
+from .crypto import cipher
+from .db import init_db, session_scope
+from .fsm_storage import DatabaseStorage
+from .handlers import admin, auth, browse, dispute, payment, profile, rating, reserve, search, sell, start, watch
 from .middlewares.throttling import ThrottlingMiddleware
-from .scheduler.jobs import setup_scheduler
+from .middlewares.user_context import CurrentUserMiddleware
+from .ratelimit import rate_limiter
+from .scheduler.jobs import setup_worker_scheduler, start_reservation_deadlines
+from .scheduler.leader import LeaderDuties
+from .scheduler.outbox import stop_outbox_sender
+from .services.fsm_store import fsm_store
+from .services.leader_lease import LeaderElector
+from .services.listing_catalog import catalog
+from .services.reservation_deadlines import reservation_deadlines
+from .webhook import IngestOutcome, UpdateIngestor
+from .workers import WorkerPool, poll_updates
+
+WEBHOOK_PATH = "/webhook"
 
 
 def setup_logging() -> None:
@@ -23,15 +39,51 @@ def setup_logging() -> None:
     )
 
 
-def build_dispatcher() -> Dispatcher:
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.message.middleware(ThrottlingMiddleware())
+async def prepare_runtime() -> None:
+    await init_db()
+    async with session_scope() as session:
+        await catalog.load(session)
+    start_reservation_deadlines()
+
+
+async def start_background(bot: Bot) -> Callable[[], Awaitable[None]]:
+    """Starts this process's own jobs and joins the scheduler leader election; returns the matching stop."""
+    process_jobs = setup_worker_scheduler()
+    duties = LeaderDuties(bot)
+    elector = LeaderElector(on_elected=duties.start, on_demoted=duties.stop)
+    elector.start()
+
+    async def stop() -> None:
+        process_jobs.shutdown(wait=False)
+        await elector.stop()
 
+    return stop
+
+
+async def shutdown_runtime() -> None:
+    await stop_outbox_sender()
+    await reservation_deadlines.stop()
+    await fsm_store.close()
+    cipher.shutdown()
+    await rate_limiter.close()
+
+
+def build_dispatcher() -> Dispatcher:
+    storage = DatabaseStorage() if settings.fsm_storage == "database" else MemoryStorage()
+    dp = Dispatcher(storage=storage)
+    dp.update.outer_middleware(CurrentUserMiddleware())
+    throttling = ThrottlingMiddleware()
+    dp.message.middleware(throttling)
+    dp.callback_query.middleware(throttling)
+
+    # Before start: its deep-link /start must win over the plain welcome handler.
+    dp.include_router(search.router)
     dp.include_router(start.router)
     dp.include_router(auth.router)
     dp.include_router(profile.router)
     dp.include_router(sell.router)
     dp.include_router(browse.router)
+    dp.include_router(watch.router)
     dp.include_router(reserve.router)
     dp.include_router(payment.router)
     dp.include_router(rating.router)
@@ -42,42 +94,144 @@ def build_dispatcher() -> Dispatcher:
 
 
 async def _run_polling(bot: Bot, dp: Dispatcher) -> None:
-    scheduler = setup_scheduler(bot)
+    stop_background = await start_background(bot)
     try:
         await dp.start_polling(bot)
     finally:
-        scheduler.shutdown(wait=False)
+        await stop_background()
+        await shutdown_runtime()
 
 
-async def main() -> None:
-    setup_logging()
+async def _run_router() -> None:
+    """Polling with ``WORKERS`` > 1: this process only fetches updates and routes them to the workers."""
+    # Workers stop on SIGTERM themselves; the router must also get to its cleanup.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    # Once, here: workers creating missing tables concurrently would trip over each other.
     await init_db()
     bot = Bot(token=settings.bot_token, parse_mode=ParseMode.HTML)
-    dp = build_dispatcher()
+    pool = WorkerPool()
+    pool.start()
+    ingestor = UpdateIngestor(pool.submit, workers=settings.worker_concurrency, maxsize=settings.worker_queue_size)
+    ingestor.start()
+    try:
+        await poll_updates(bot, ingestor, build_dispatcher().resolve_used_update_types())
+    finally:
+        await ingestor.stop()
+        await pool.stop()
+        await bot.session.close()
+
 
+async def _run_webhook() -> None:
+    import uvicorn  # noqa: WPS433 - only the webhook mode needs the ASGI server
+
+    config = uvicorn.Config(create_webhook_app, factory=True, host=settings.webhook_host, port=settings.webhook_port)
+    await uvicorn.Server(config).serve()
+
+
+async def main() -> None:
+    setup_logging()
+    settings.require_encryption_key()
     if settings.webhook_url:
-        logging.info("حالت وبهوک فعال است. لطفاً با uvicorn برنامه FastAPI را اجرا کن.")
+        await _run_webhook()
+        return
+    if settings.workers > 1:
+        await _run_router()
         return
+    await prepare_runtime()
+    bot = Bot(token=settings.bot_token, parse_mode=ParseMode.HTML)
+    dp = build_dispatcher()
     await _run_polling(bot, dp)
 
 
+def _webhook_target() -> str:
+    url = settings.webhook_url.rstrip("/")
+    return url if url.endswith(WEBHOOK_PATH) else f"{url}{WEBHOOK_PATH}"
+
+
+async def _set_webhook(bot: Bot, allowed_updates: List[str]) -> None:
+    if settings.webhook_url:
+        await bot.set_webhook(
+            _webhook_target(),
+            secret_token=settings.webhook_secret,
+            allowed_updates=allowed_updates,
+        )
+
+
+def _mount_webhook(app: FastAPI, ingestor: UpdateIngestor) -> None:
+    # Otherwise anyone reaching /webhook could post updates in an admin's name.
+    settings.require_webhook_secret()
+    app.state.ingestor = ingestor
+
+    @app.post(WEBHOOK_PATH)
+    async def telegram_webhook(
+        request: Request,
+        x_telegram_bot_api_secret_token: str = Header(default=""),
+    ) -> Response:
+        if not hmac.compare_digest(x_telegram_bot_api_secret_token, settings.webhook_secret):
+            return Response(status_code=401)
+        outcome = ingestor.offer(await request.json())
+        # Only a retry answer is non-2xx: Telegram then redelivers the update once we have room.
+        return Response(status_code=503 if outcome is IngestOutcome.retry else 200)
+
+
 def create_fastapi_app(bot: Bot, dp: Dispatcher) -> FastAPI:
-    scheduler = setup_scheduler(bot)
+    ingestor = UpdateIngestor(lambda update: dp.feed_raw_update(bot, update))
+    app = FastAPI()
+    stop_background: Callable[[], Awaitable[None]] | None = None
+
+    @app.on_event("startup")
+    async def on_startup() -> None:
+        nonlocal stop_background
+        await prepare_runtime()
+        stop_background = await start_background(bot)
+        ingestor.start()
+        await _set_webhook(bot, dp.resolve_used_update_types())
+
+    @app.on_event("shutdown")
+    async def on_shutdown() -> None:
+        await ingestor.stop()
+        if stop_background is not None:
+            await stop_background()
+        await shutdown_runtime()
+        await bot.session.close()
+
+    _mount_webhook(app, ingestor)
+    return app
+
+
+def create_router_app(bot: Bot, allowed_updates: List[str]) -> FastAPI:
+    """Webhook front for ``WORKERS`` > 1: acknowledges updates and routes them to the worker processes."""
+    pool = WorkerPool()
+    ingestor = UpdateIngestor(pool.submit)
     app = FastAPI()
 
     @app.on_event("startup")
     async def on_startup() -> None:
         await init_db()
+        pool.start()
+        ingestor.start()
+        await _set_webhook(bot, allowed_updates)
 
     @app.on_event("shutdown")
     async def on_shutdown() -> None:
-        scheduler.shutdown(wait=False)
+        await ingestor.stop()
+        await pool.stop()
         await bot.session.close()
 
-    webhook_handler = SimpleRequestHandler(dispatcher=dp, bot=bot)
-    setup_application(app, webhook_handler, path="/webhook")
+    _mount_webhook(app, ingestor)
     return app
 
 
+def create_webhook_app() -> FastAPI:
+    """ASGI factory for ``uvicorn az_reza_bekhareh_bot.app:create_webhook_app --factory``."""
+    setup_logging()
+    settings.require_encryption_key()
+    bot = Bot(token=settings.bot_token, parse_mode=ParseMode.HTML)
+    dp = build_dispatcher()
+    if settings.workers > 1:
+        return create_router_app(bot, dp.resolve_used_update_types())
+    return create_fastapi_app(bot, dp)
+
+
 if __name__ == "__main__":
     asyncio.run(main())
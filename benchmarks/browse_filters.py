@@ -0,0 +1,162 @@
+"""Reports the query plan and latency of every browse filter shape over a large listings table.
+
+Run with ``python -m az_reza_bekhareh_bot.benchmarks.browse_filters --listings 500000 --repeat 50``.
+Seeds a file-backed SQLite database (codes are a fixed placeholder blob, not real Fernet tokens),
+then times the first and a later keyset page of ``listing_service.active_listings_query`` for
+each shape and prints SQLite's ``EXPLAIN QUERY PLAN``; a ``SCAN listings`` line means a full scan.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+from ..db import Base
+from ..models import Listing, ListingStatus, MealType, User
+from ..services.listing_service import BrowseFilters, ListingCursor, active_listings_query
+
+SEED_CHUNK = 20000
+UNIVERSITIES = 40
+DAYS = 30
+PAGE = 10
+
+
+def _shapes(today: date) -> Dict[str, BrowseFilters]:
+    return {
+        "default": BrowseFilters(),
+        "meal": BrowseFilters(meals=(MealType.dinner,)),
+        "date_range": BrowseFilters(date_from=today + timedelta(days=3), date_to=today + timedelta(days=5)),
+        "date_range+meal": BrowseFilters(
+            date_from=today + timedelta(days=3),
+            date_to=today + timedelta(days=5),
+            meals=(MealType.lunch,),
+        ),
+        "max_price": BrowseFilters(max_price=25000),
+        "sort_price": BrowseFilters(sort="price"),
+        "sort_price+max_price+meal": BrowseFilters(sort="price", max_price=60000, meals=(MealType.dinner,)),
+        "uni": BrowseFilters(uni="uni-7"),
+        "min_rating": BrowseFilters(min_rating=4.8),
+        "uni+min_rating+meal": BrowseFilters(uni="uni-7", min_rating=4.0, meals=(MealType.dinner,)),
+        "everything+sort_price": BrowseFilters(
+            date_from=today + timedelta(days=1),
+            date_to=today + timedelta(days=10),
+            meals=(MealType.lunch,),
+            max_price=70000,
+            uni="uni-3",
+            min_rating=3.5,
+            sort="price",
+        ),
+    }
+
+
+async def _seed(conn: AsyncConnection, listings: int, sellers: int) -> None:
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    await conn.execute(
+        insert(User),
+        [
+            {
+                "tg_id": index + 1,
+                "name": f"seller-{index}",
+                "uni": f"uni-{index % UNIVERSITIES}",
+                "rating_avg": round(rng.uniform(1, 5), 2),
+                "rating_cnt": rng.randint(0, 50),
+                "created_at": now,
+                "updated_at": now,
+            }
+            for index in range(sellers)
+        ],
+    )
+    statuses = [ListingStatus.active] * 6 + [ListingStatus.sold] * 3 + [ListingStatus.expired]
+    today = date.today()
+    for start in range(0, listings, SEED_CHUNK):
+        await conn.execute(
+            insert(Listing),
+            [
+                {
+                    "seller_id": rng.randint(1, sellers),
+                    "date": today + timedelta(days=rng.randrange(DAYS)),
+                    "meal_type": rng.choice((MealType.lunch, MealType.dinner)),
+                    "dish_name": f"bench dish {index % 500}",
+                    "masked_code": "BE***01",
+                    "full_code_enc": b"bench",
+                    "price": rng.randrange(5000, 150000, 500),
+                    "status": rng.choice(statuses),
+                    "created_at": now - timedelta(seconds=index),
+                    "updated_at": now,
+                }
+                for index in range(start, min(start + SEED_CHUNK, listings))
+            ],
+        )
+    await conn.exec_driver_sql("ANALYZE")
+
+
+async def _page(conn: AsyncConnection, filters: BrowseFilters, after: ListingCursor | None) -> List:
+    return (await conn.execute(active_listings_query(filters, limit=PAGE, after=after))).all()
+
+
+async def _time(conn: AsyncConnection, filters: BrowseFilters, after: ListingCursor | None, repeat: int) -> Tuple[float, float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await _page(conn, filters, after)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[max(int(len(samples) * 0.95) - 1, 0)]
+
+
+async def run(listings: int, sellers: int, repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}")
+        captured: List[Tuple[str, object]] = []
+
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def _capture(conn, cursor, statement, parameters, context, executemany):  # noqa: ANN001, ANN202
+            if statement.lstrip().upper().startswith("SELECT"):
+                captured[:] = [(statement, parameters)]
+
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                started = time.perf_counter()
+                await _seed(conn, listings, sellers)
+                print(f"listings={listings} sellers={sellers} seeded in {time.perf_counter() - started:.1f}s repeat={repeat}")
+
+            async with engine.connect() as conn:
+                for name, filters in _shapes(date.today()).items():
+                    first = await _page(conn, filters, None)
+                    statement, parameters = captured[0]
+                    plan = (await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)).all()
+                    median, p95 = await _time(conn, filters, None, repeat)
+                    line = f"{name:>28}: rows={len(first):<3} first_page median={median:.2f}ms p95={p95:.2f}ms"
+                    if len(first) == PAGE:
+                        cursor = ListingCursor.from_listing(first[-1])
+                        next_median, next_p95 = await _time(conn, filters, cursor, repeat)
+                        line += f" next_page median={next_median:.2f}ms p95={next_p95:.2f}ms"
+                    print(line)
+                    for row in plan:
+                        print(f"{'':>30}{row[-1]}")
+        finally:
+            await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--listings", type=int, default=500000)
+    parser.add_argument("--sellers", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.listings, args.sellers, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
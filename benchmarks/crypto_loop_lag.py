@@ -0,0 +1,81 @@
+"""Measures how much Fernet work on the event loop delays other coroutines.
+
+Run with ``python -m az_reza_bekhareh_bot.benchmarks.crypto_loop_lag --codes 20000 --batch 500``.
+A probe coroutine sleeps 1 ms in a loop and records how late it wakes up while a bulk
+encrypt + decrypt workload runs either inline (``encrypt_many``/``decrypt_many``) or on the
+cipher's thread pool (``encrypt_many_async``/``decrypt_many_async``).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from cryptography.fernet import Fernet
+
+from ..crypto import FoodCodeCipher
+
+PROBE_INTERVAL = 0.001
+
+
+async def _probe(lags: List[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+
+async def _workload(cipher: FoodCodeCipher, codes: List[str], batch: int, offload: bool) -> None:
+    for start in range(0, len(codes), batch):
+        chunk = codes[start:start + batch]
+        if offload:
+            await cipher.decrypt_many_async(await cipher.encrypt_many_async(chunk))
+        else:
+            cipher.decrypt_many(cipher.encrypt_many(chunk))
+            await asyncio.sleep(0)
+
+
+async def measure(cipher: FoodCodeCipher, codes: List[str], batch: int, offload: bool) -> None:
+    lags: List[float] = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe(lags, stop))
+    await asyncio.sleep(PROBE_INTERVAL * 5)
+    started = time.perf_counter()
+    await _workload(cipher, codes, batch, offload)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    p99 = lags_ms[int(len(lags_ms) * 0.99) - 1] if len(lags_ms) >= 100 else lags_ms[-1]
+    print(
+        f"{'offloaded' if offload else 'inline':>9}: elapsed={elapsed:.3f}s "
+        f"codes/s={len(codes) / elapsed:.0f} probe_wakeups={len(lags_ms)} "
+        f"lag_mean={statistics.fmean(lags_ms):.2f}ms lag_p99={p99:.2f}ms lag_max={lags_ms[-1]:.2f}ms",
+    )
+
+
+async def run(count: int, batch: int, workers: int) -> None:
+    cipher = FoodCodeCipher(Fernet.generate_key().decode("utf-8"), workers=workers)
+    codes = [f"CODE{index:08d}" for index in range(count)]
+    print(f"codes={count} batch={batch} workers={workers}")
+    try:
+        await measure(cipher, codes, batch, offload=False)
+        await measure(cipher, codes, batch, offload=True)
+    finally:
+        cipher.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--codes", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(run(args.codes, args.batch, args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Fires N simultaneous reservations at one listing and checks that exactly one wins.
+
+Run with ``python -m az_reza_bekhareh_bot.benchmarks.reservation_race --buyers 50 --rounds 20``.
+Each attempt goes through ``listing_claim_lock`` and ``reservation_service.create_reservation`` in
+its own session, the same path the reserve callback takes, against a file-backed SQLite database.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import List, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from ..config import settings
+from ..crypto import cipher
+from ..db import Base
+from ..models import Listing, MealType, User
+from ..services import reservation_service
+
+
+async def _seed(Session: async_sessionmaker, buyers: int, listings: int) -> Tuple[List[int], List[int]]:
+    async with Session() as session:
+        seller = User(tg_id=1, name="bench-seller", uni="bench")
+        session.add(seller)
+        session.add_all(User(tg_id=1000 + index, name=f"buyer-{index}", uni="bench") for index in range(buyers))
+        await session.flush()
+        await session.execute(
+            insert(Listing),
+            [
+                {
+                    "seller_id": seller.id,
+                    "date": date.today() + timedelta(days=1),
+                    "meal_type": MealType.lunch,
+                    "dish_name": f"bench dish {index}",
+                    "masked_code": "BE***01",
+                    "full_code_enc": cipher.encrypt(f"BENCH{index:04d}"),
+                    "price": 10000,
+                }
+                for index in range(listings)
+            ],
+        )
+        await session.commit()
+        buyer_ids = [user.id for user in (await session.execute(User.__table__.select().where(User.tg_id >= 1000))).all()]
+        listing_ids = [row.id for row in (await session.execute(Listing.__table__.select())).all()]
+    return buyer_ids, listing_ids
+
+
+async def _attempt(Session: async_sessionmaker, listing_id: int, buyer_id: int, queued: bool) -> str:
+    if queued:
+        async with reservation_service.listing_claim_lock(listing_id):
+            return await _attempt(Session, listing_id, buyer_id, queued=False)
+    async with Session() as session:
+        try:
+            await reservation_service.create_reservation(session, listing_id, buyer_id)
+            await session.commit()
+            return "won"
+        except (ValueError, PermissionError):
+            await session.rollback()
+            return "lost"
+        except OperationalError:
+            await session.rollback()
+            return "error"
+
+
+async def run(buyers: int, rounds: int, queued: bool) -> None:
+    original_limit = settings.reservation_limit_per_user
+    settings.reservation_limit_per_user = rounds
+    with tempfile.TemporaryDirectory() as workdir:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}")
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            Session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+            buyer_ids, listing_ids = await _seed(Session, buyers, rounds)
+
+            started = time.perf_counter()
+            totals = {"won": 0, "lost": 0, "error": 0}
+            for listing_id in listing_ids:
+                outcomes = await asyncio.gather(*(_attempt(Session, listing_id, buyer_id, queued) for buyer_id in buyer_ids))
+                winners = outcomes.count("won")
+                assert winners == 1, f"listing {listing_id} had {winners} winners"
+                for outcome in outcomes:
+                    totals[outcome] += 1
+            elapsed = time.perf_counter() - started
+        finally:
+            await engine.dispose()
+            settings.reservation_limit_per_user = original_limit
+
+    attempts = buyers * rounds
+    print(f"buyers={buyers} rounds={rounds} attempts={attempts} claim_lock={'on' if queued else 'off'}")
+    print(f"won={totals['won']} lost={totals['lost']} lock_errors={totals['error']}")
+    print(f"elapsed={elapsed:.3f}s throughput={attempts / elapsed:.0f} attempts/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--buyers", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument(
+        "--no-claim-lock",
+        action="store_true",
+        help="skip listing_claim_lock and let every attempt hit the database lock directly",
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args.buyers, args.rounds, queued=not args.no_claim_lock))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Measures the per-update cost of the throttling check on each limiter backend.
+
+Run with ``python -m az_reza_bekhareh_bot.benchmarks.throttle_backends --updates 20000 --concurrency 200``.
+Simulates bursts of ``--concurrency`` simultaneous updates from ``--users`` distinct users going
+through ``BatchingLimiter.acquire`` with a per-user and a global bucket, as the middleware does,
+and reports latency percentiles and how many checks each backend call carried. ``--redis-url``
+adds the Redis backend when the optional ``redis`` package and a server are available.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from typing import List, Optional
+
+from ..ratelimit import (
+    BatchingLimiter,
+    Limit,
+    LimiterBackend,
+    MemoryLimiterBackend,
+    RedisLimiterBackend,
+    SqliteLimiterBackend,
+)
+
+PER_USER = Limit(rate=2.0, capacity=5)
+OVERALL = Limit(rate=1_000_000.0, capacity=1_000_000.0)
+
+
+async def _check(limiter: BatchingLimiter, user_id: int, latencies: List[float]) -> None:
+    started = time.perf_counter()
+    await limiter.acquire(((f"user:{user_id}", PER_USER), ("global", OVERALL)))
+    latencies.append((time.perf_counter() - started) * 1000)
+
+
+async def measure(name: str, backend: LimiterBackend, updates: int, users: int, concurrency: int) -> None:
+    limiter = BatchingLimiter(backend)
+    batches: List[int] = []
+    original = backend.acquire_many
+
+    async def counting(claims):  # noqa: ANN001, ANN202 - records batch sizes only
+        batches.append(len(claims))
+        return await original(claims)
+
+    backend.acquire_many = counting  # type: ignore[method-assign]
+    latencies: List[float] = []
+    started = time.perf_counter()
+    try:
+        for start in range(0, updates, concurrency):
+            await asyncio.gather(
+                *(_check(limiter, index % users, latencies) for index in range(start, min(start + concurrency, updates))),
+            )
+    finally:
+        await limiter.close()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    per_call = f" checks/backend_call={statistics.fmean(batches):.1f}" if batches else " (inline)"
+    print(
+        f"{name:>7}: updates/s={updates / elapsed:.0f} p50={latencies[len(latencies) // 2]:.3f}ms "
+        f"p99={latencies[int(len(latencies) * 0.99) - 1]:.3f}ms amortised={elapsed * 1000 / updates:.3f}ms{per_call}",
+    )
+
+
+async def run(updates: int, users: int, concurrency: int, redis_url: Optional[str]) -> None:
+    print(f"updates={updates} users={users} concurrency={concurrency}")
+    await measure("memory", MemoryLimiterBackend(maxsize=users), updates, users, concurrency)
+    with tempfile.TemporaryDirectory() as workdir:
+        await measure("sqlite", SqliteLimiterBackend(os.path.join(workdir, "ratelimit.db")), updates, users, concurrency)
+    if redis_url:
+        await measure("redis", RedisLimiterBackend(redis_url), updates, users, concurrency)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.users, args.concurrency, args.redis_url))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import re
 from functools import lru_cache
 from typing import List
 
@@ -15,15 +16,67 @@ def _default_fernet_key() -> str:
 class Settings(BaseSettings):
     bot_token: str = Field("TEST_BOT_TOKEN", env="BOT_TOKEN")
     fernet_key: str = Field(default_factory=_default_fernet_key, env="FERNET_KEY")
+    # Comma-separated, newest first; takes precedence over FERNET_KEY when set.
+    fernet_keys: str = Field("", env="FERNET_KEYS")
+    # Keys the duplicate-code index; must stay fixed across key rotations. Required with FERNET_KEYS.
+    code_hash_key: str = Field("", env="CODE_HASH_KEY")
     database_url: str = Field("sqlite+aiosqlite:///./az_reza_bekhareh.db", env="DATABASE_URL")
     reserve_ttl_minutes: int = Field(15, env="RESERVE_TTL_MINUTES")
     admin_tg_ids: List[int] = Field(default_factory=list, env="ADMIN_TG_IDS")
     webhook_url: str | None = Field(default=None, env="WEBHOOK_URL")
+    webhook_secret: str = Field("", env="WEBHOOK_SECRET")
+    webhook_host: str = Field("0.0.0.0", env="WEBHOOK_HOST")
+    webhook_port: int = Field(8080, env="WEBHOOK_PORT")
+    webhook_workers: int = Field(8, env="WEBHOOK_WORKERS")
+    webhook_queue_size: int = Field(1000, env="WEBHOOK_QUEUE_SIZE")
+    # What to shed when the queue is full: retry (503, Telegram redelivers), drop_oldest or drop_newest.
+    webhook_overflow: str = Field("retry", env="WEBHOOK_OVERFLOW")
+    # Handler processes; above 1 this process only receives updates and routes them by user.
+    workers: int = Field(1, env="WORKERS")
+    worker_queue_size: int = Field(1000, env="WORKER_QUEUE_SIZE")
+    worker_concurrency: int = Field(8, env="WORKER_CONCURRENCY")
+    leader_lease_seconds: float = Field(30.0, env="LEADER_LEASE_SECONDS")
+    leader_heartbeat_seconds: float = Field(10.0, env="LEADER_HEARTBEAT_SECONDS")
+    catalog_sync_seconds: float = Field(5.0, env="CATALOG_SYNC_SECONDS")
     log_level: str = Field("INFO", env="LOG_LEVEL")
     reservation_limit_per_user: int = Field(2, env="RESERVATION_LIMIT_PER_USER")
     daily_listing_limit: int = Field(5, env="DAILY_LISTING_LIMIT")
     timezone: str = Field("Asia/Tehran", env="TIMEZONE")
     registration_enabled: bool = Field(True, env="REGISTRATION_ENABLED")
+    user_cache_size: int = Field(10000, env="USER_CACHE_SIZE")
+    # Also the longest a ban takes to reach other worker processes, which keep their own cache.
+    user_cache_ttl_seconds: int = Field(60, env="USER_CACHE_TTL_SECONDS")
+    fsm_storage: str = Field("database", env="FSM_STORAGE")
+    fsm_ttl_hours: int = Field(24, env="FSM_TTL_HOURS")
+    fsm_flush_interval: float = Field(0.5, env="FSM_FLUSH_INTERVAL")
+    fsm_cache_size: int = Field(10000, env="FSM_CACHE_SIZE")
+    fsm_cache_ttl_seconds: int = Field(60, env="FSM_CACHE_TTL_SECONDS")
+    listing_card_cache_size: int = Field(5000, env="LISTING_CARD_CACHE_SIZE")
+    listing_card_cache_ttl_seconds: int = Field(3600, env="LISTING_CARD_CACHE_TTL_SECONDS")
+    expiry_chunk_size: int = Field(500, env="EXPIRY_CHUNK_SIZE")
+    reservation_sweep_minutes: int = Field(10, env="RESERVATION_SWEEP_MINUTES")
+    telegram_send_rate: float = Field(30.0, env="TELEGRAM_SEND_RATE")
+    throttle_rate: float = Field(2.0, env="THROTTLE_RATE")
+    throttle_burst: float = Field(5.0, env="THROTTLE_BURST")
+    throttle_max_users: int = Field(50000, env="THROTTLE_MAX_USERS")
+    throttle_global_rate: float = Field(100.0, env="THROTTLE_GLOBAL_RATE")
+    throttle_global_burst: float = Field(200.0, env="THROTTLE_GLOBAL_BURST")
+    throttle_backend: str = Field("memory", env="THROTTLE_BACKEND")
+    throttle_sqlite_path: str = Field("ratelimit.db", env="THROTTLE_SQLITE_PATH")
+    throttle_redis_url: str = Field("redis://localhost:6379/0", env="THROTTLE_REDIS_URL")
+    crypto_workers: int = Field(2, env="CRYPTO_WORKERS")
+    waitlist_max_per_listing: int = Field(20, env="WAITLIST_MAX_PER_LISTING")
+    watch_limit_per_user: int = Field(5, env="WATCH_LIMIT_PER_USER")
+    watch_max_days: int = Field(30, env="WATCH_MAX_DAYS")
+    bulk_listing_max_rows: int = Field(100, env="BULK_LISTING_MAX_ROWS")
+    reencrypt_chunk_size: int = Field(200, env="REENCRYPT_CHUNK_SIZE")
+    reencrypt_pause_seconds: float = Field(0.5, env="REENCRYPT_PAUSE_SECONDS")
+    admin_queue_page_size: int = Field(10, env="ADMIN_QUEUE_PAGE_SIZE")
+    inline_search_page_size: int = Field(20, env="INLINE_SEARCH_PAGE_SIZE")
+    outbox_workers: int = Field(4, env="OUTBOX_WORKERS")
+    outbox_batch_size: int = Field(50, env="OUTBOX_BATCH_SIZE")
+    outbox_max_attempts: int = Field(8, env="OUTBOX_MAX_ATTEMPTS")
+    outbox_per_chat_interval: float = Field(1.0, env="OUTBOX_PER_CHAT_INTERVAL")
 
     class Config:
         case_sensitive = False
@@ -37,6 +90,45 @@ class Settings(BaseSettings):
             return []
         return [int(part.strip()) for part in value.split(",") if part.strip()]
 
+    @property
+    def encryption_keys(self) -> List[str]:
+        keys = [key.strip() for key in self.fernet_keys.split(",") if key.strip()]
+        return keys or [self.fernet_key]
+
+    @property
+    def encryption_key_configured(self) -> bool:
+        return "fernet_key" in self.__fields_set__ or bool(self.fernet_keys.strip())
+
+    def require_encryption_key(self) -> None:
+        """Refuses to run on the generated default key, for encryption or for the code index.
+
+        That key exists only in this process: codes, queued messages and conversations written
+        with it are unreadable by other workers and after a restart, and the code index stops
+        matching.
+        """
+        if not self.encryption_key_configured:
+            raise RuntimeError("کلید رمزنگاری تنظیم نشده است؛ FERNET_KEY یا FERNET_KEYS را در .env قرار بده.")
+        # Raises as well when only FERNET_KEYS is set and CODE_HASH_KEY is missing.
+        self.code_hash_secret
+
+    def require_webhook_secret(self) -> None:
+        """Refuses to serve the webhook unauthenticated; Telegram echoes this secret on every request."""
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", self.webhook_secret):
+            raise RuntimeError("WEBHOOK_SECRET باید ۱ تا ۲۵۶ نویسه از A-Z، a-z، 0-9، _ و - باشد.")
+
+    @property
+    def code_hash_secret(self) -> bytes:
+        """Keys the duplicate-code index, which only matches while it is the same in every process.
+
+        ``CODE_HASH_KEY`` when set, otherwise a configured ``FERNET_KEY`` as long as no key list
+        is in use; rotating keys through ``FERNET_KEYS`` must not change it.
+        """
+        if self.code_hash_key:
+            return self.code_hash_key.encode("utf-8")
+        if "fernet_key" in self.__fields_set__ and not self.fernet_keys.strip():
+            return self.fernet_key.encode("utf-8")
+        raise RuntimeError("کلید ایندکس کدها تنظیم نشده است؛ CODE_HASH_KEY را در .env قرار بده.")
+
     @validator("log_level")
     def normalize_level(cls, value: str) -> str:
         return value.upper()
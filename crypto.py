@@ -1,15 +1,37 @@
 from __future__ import annotations
 
-from cryptography.fernet import Fernet, InvalidToken
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Sequence
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 
 from .config import settings
 
+# Tokens handed to one worker thread per job; large enough to amortise the executor hop.
+BATCH_CHUNK_SIZE = 256
+
 
 class FoodCodeCipher:
-    """Encrypts and decrypts food codes with Fernet."""
+    """Encrypts and decrypts food codes with Fernet.
+
+    Accepts a list of keys, newest first: new tokens use the first key and any listed key
+    can decrypt, so old keys stay readable until :meth:`rotate` has moved data off them.
+    The ``*_async`` variants run on a small dedicated thread pool so AES/HMAC work never
+    stalls the event loop; OpenSSL releases the GIL while it runs.
+    """
 
-    def __init__(self, key: str) -> None:
-        self._fernet = Fernet(key)
+    def __init__(self, keys: str | Sequence[str], workers: int = 2) -> None:
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        if not keys:
+            raise ValueError("حداقل یک کلید رمزنگاری لازم است.")
+        self._fernet = MultiFernet([Fernet(key) for key in keys])
+        self.key_count = len(keys)
+        # Identifies the primary key without revealing it, e.g. to tag re-encryption progress.
+        self.primary_key_id = hashlib.sha256(keys[0].encode("utf-8")).hexdigest()[:16]
+        self._workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
 
     def encrypt(self, value: str) -> bytes:
         return self._fernet.encrypt(value.encode("utf-8"))
@@ -20,6 +42,55 @@ class FoodCodeCipher:
         except InvalidToken as exc:  # pragma: no cover - defensive
             raise ValueError("رمز کد غذا نامعتبر است.") from exc
 
+    def rotate(self, token: bytes) -> bytes:
+        try:
+            return self._fernet.rotate(token)
+        except InvalidToken as exc:  # pragma: no cover - defensive
+            raise ValueError("رمز کد غذا نامعتبر است.") from exc
+
+    def rotate_many(self, tokens: Iterable[bytes]) -> List[bytes]:
+        return [self.rotate(token) for token in tokens]
+
+    def encrypt_many(self, values: Iterable[str]) -> List[bytes]:
+        return [self.encrypt(value) for value in values]
+
+    def decrypt_many(self, tokens: Iterable[bytes]) -> List[str]:
+        return [self.decrypt(token) for token in tokens]
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="crypto")
+        return self._executor
+
+    async def _offload(self, func, *args):  # noqa: ANN001, ANN202 - thin run_in_executor wrapper
+        return await asyncio.get_running_loop().run_in_executor(self._pool(), func, *args)
+
+    async def encrypt_async(self, value: str) -> bytes:
+        return await self._offload(self.encrypt, value)
+
+    async def decrypt_async(self, token: bytes) -> str:
+        return await self._offload(self.decrypt, token)
+
+    async def encrypt_many_async(self, values: Sequence[str]) -> List[bytes]:
+        return await self._chunked(self.encrypt_many, values)
+
+    async def decrypt_many_async(self, tokens: Sequence[bytes]) -> List[str]:
+        return await self._chunked(self.decrypt_many, tokens)
+
+    async def rotate_many_async(self, tokens: Sequence[bytes]) -> List[bytes]:
+        return await self._chunked(self.rotate_many, tokens)
+
+    async def _chunked(self, func, items: Sequence) -> list:  # noqa: ANN001
+        if not items:
+            return []
+        chunks = [items[start:start + BATCH_CHUNK_SIZE] for start in range(0, len(items), BATCH_CHUNK_SIZE)]
+        results = await asyncio.gather(*(self._offload(func, chunk) for chunk in chunks))
+        return [value for chunk in results for value in chunk]
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
 
-cipher = FoodCodeCipher(settings.fernet_key)
 
+cipher = FoodCodeCipher(settings.encryption_keys, workers=settings.crypto_workers)
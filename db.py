@@ -3,15 +3,20 @@ from __future__ import annotations
 import asyncio
 import logging
 from contextlib import asynccontextmanager
-from typing import AsyncIterator, Callable
+from typing import AsyncIterator, Callable, Sequence
 
+from sqlalchemy import Connection, Row, Update, event, select, text
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.orm import DeclarativeBase, Session
+from sqlalchemy.schema import CreateIndex
 
 from .config import settings
 
 logger = logging.getLogger(__name__)
 
+# Indexes of earlier releases that newer ones cover; dropped from existing databases on start.
+REPLACED_INDEXES = ("idx_listings_status_date_meal", "idx_listings_seller_id", "idx_payments_status")
+
 
 class Base(DeclarativeBase):
     pass
@@ -26,9 +31,23 @@ async def init_db() -> None:
 
     async with engine.begin() as conn:
         await conn.run_sync(models.Base.metadata.create_all)
+        await conn.run_sync(sync_indexes)
     logger.info("پایگاه داده مقداردهی شد.")
 
 
+def sync_indexes(conn: Connection) -> None:
+    """Brings the indexes of tables that already existed up to date.
+
+    ``create_all`` skips existing tables entirely, so indexes added to them later would only
+    ever appear on a fresh database. Both statements are idempotent and cheap once applied.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+    for name in REPLACED_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
 @asynccontextmanager
 async def session_scope() -> AsyncIterator[AsyncSession]:
     session = AsyncSessionMaker()
@@ -42,6 +61,38 @@ async def session_scope() -> AsyncIterator[AsyncSession]:
         await session.close()
 
 
+async def update_returning(session: AsyncSession, stmt: Update, *columns) -> Sequence[Row]:
+    """Executes ``stmt`` and returns ``columns`` of the updated rows.
+
+    Uses ``RETURNING`` when the dialect supports it; otherwise the rows are selected with the
+    same criteria inside the transaction right before the update.
+    """
+    if session.get_bind().dialect.update_returning:
+        return (await session.execute(stmt.returning(*columns))).all()
+    rows = (await session.execute(select(*columns).where(stmt.whereclause))).all()
+    await session.execute(stmt)
+    return rows
+
+
+def on_commit(session: AsyncSession, callback: Callable[[], None]) -> None:
+    """Runs ``callback`` after the session's current transaction commits; dropped on rollback."""
+    session.info.setdefault("on_commit", []).append(callback)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_commit_hooks(session: Session) -> None:
+    for callback in session.info.pop("on_commit", []):
+        try:
+            callback()
+        except Exception:  # pragma: no cover - a hook must never break the commit path
+            logger.exception("Commit hook %r failed", callback)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_commit_hooks(session: Session) -> None:
+    session.info.pop("on_commit", None)
+
+
 def run_sync(coro_factory: Callable[[], asyncio.Future]) -> None:
     asyncio.run(coro_factory())
 
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from .services.fsm_store import FsmStore, fsm_store
+
+
+class DatabaseStorage(BaseStorage):
+    """aiogram FSM storage over :class:`FsmStore`, so conversations survive restarts."""
+
+    def __init__(self, store: FsmStore = fsm_store) -> None:
+        self._store = store
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or 0}:{key.destiny}"
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._store.get(self._key(key))
+        entry.state = state.state if isinstance(state, State) else state
+        await self._store.put(self._key(key), entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._store.get(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._store.get(self._key(key))
+        entry.data = dict(data)
+        await self._store.put(self._key(key), entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._store.get(self._key(key))).data
+
+    async def close(self) -> None:
+        await self._store.close()
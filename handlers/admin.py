@@ -7,112 +7,153 @@ from aiogram.filters import Command, CommandObject
 from aiogram.types import CallbackQuery, Message
 
 from ..config import settings
-from ..crypto import cipher
 from ..db import session_scope
-from ..keyboards.admin import AdminAction, admin_dashboard_keyboard, admin_dispute_actions, admin_payment_review
+from ..keyboards.admin import (
+    AdminAction,
+    AdminPageAction,
+    admin_dashboard_keyboard,
+    admin_dispute_actions,
+    admin_payment_queue,
+)
 from ..messages import fa
-from ..models import DisputeStatus, Payment
-from ..services import dispute_service, payment_service, report_service
-from ..services.user_service import get_user_by_tg_id, set_ban_status
+from ..middlewares.throttling import throttle_stats
+from ..models import DisputeStatus
+from ..services import code_index, dispute_service, payment_service, report_service
+from ..services.user_service import UserSnapshot, get_user_snapshot, set_ban_status
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
 
-def _is_admin(tg_id: int, is_admin_flag: bool) -> bool:
-    return is_admin_flag or tg_id in settings.admin_tg_ids
+def _is_admin(user: UserSnapshot | None) -> bool:
+    return user is not None and (user.is_admin or user.tg_id in settings.admin_tg_ids)
 
 
-async def _assert_admin(message: Message) -> bool:
-    async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user and _is_admin(message.from_user.id, user.is_admin):
-            return True
+async def _assert_admin(message: Message, current_user: UserSnapshot | None) -> bool:
+    if _is_admin(current_user):
+        return True
     await message.answer("به پنل ادمین دسترسی نداری.")
     return False
 
 
 @router.message(Command("admin"))
-async def admin_dashboard(message: Message) -> None:
-    async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user is None or not _is_admin(message.from_user.id, user.is_admin):
-            await message.answer("به پنل ادمین دسترسی نداری.")
-            return
+async def admin_dashboard(message: Message, current_user: UserSnapshot | None) -> None:
+    if not _is_admin(current_user):
+        await message.answer("به پنل ادمین دسترسی نداری.")
+        return
     await message.answer(fa.ADMIN_DASHBOARD_HEADER, reply_markup=admin_dashboard_keyboard())
 
 
-@router.callback_query(AdminAction.filter(F.action == "payments"))
-async def admin_payments(callback: CallbackQuery) -> None:
+def _render_payment_queue(total: int, page: payment_service.PaymentQueuePage) -> str:
+    lines = [fa.ADMIN_PAYMENT_QUEUE_HEADER.format(count=total)]
+    for item in page.items:
+        lines.append(
+            f"#{item.payment_id} | رزرو {item.reservation_id} | خریدار @{item.buyer_name} | "
+            f"{item.dish_name} - {item.listing_date}\nروش: {item.method}",
+        )
+    return "\n\n".join(lines)
+
+
+@router.callback_query(AdminAction.filter(F.action.in_({"payments", "payments_page"})))
+async def admin_payments(callback: CallbackQuery, callback_data: AdminAction, current_user: UserSnapshot | None) -> None:
     await callback.answer()
+    if not _is_admin(current_user):
+        await callback.message.answer("اجازه نداری.")
+        return
+    after_id = callback_data.entity_id
     async with session_scope() as session:
-        user = await get_user_by_tg_id(session, callback.from_user.id)
-        if user is None or not _is_admin(callback.from_user.id, user.is_admin):
-            await callback.message.answer("اجازه نداری.")
-            return
-        payments = await payment_service.list_pending_payments(session)
-        if not payments:
-            await callback.message.answer("رسید در صف نیست.")
-            return
-        await callback.message.answer(fa.ADMIN_PAYMENT_QUEUE_HEADER.format(count=len(payments)))
-        for payment in payments:
-            buyer = payment.reservation.buyer
-            listing = payment.reservation.listing
-            text = (
-                f"#{payment.id} | رزرو {payment.reservation_id} | خریدار @{buyer.name} | "
-                f"{listing.dish_name} - {listing.date}\nروش: {payment.method}"
-            )
-            await callback.message.answer(text, reply_markup=admin_payment_review(payment.id))
+        total = await payment_service.count_pending_payments(session)
+        page = await payment_service.list_pending_payments_page(session, after_id, settings.admin_queue_page_size)
+    if not page.items:
+        await callback.message.answer("رسید در صف نیست.")
+        return
+    text = _render_payment_queue(total, page)
+    keyboard = admin_payment_queue((item.payment_id for item in page.items), after_id, page.next_after)
+    if callback_data.action == "payments_page":
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    else:
+        await callback.message.answer(text, reply_markup=keyboard)
+
+
+@router.callback_query(AdminPageAction.filter(F.action == "approve_page"))
+async def admin_approve_page(
+    callback: CallbackQuery,
+    callback_data: AdminPageAction,
+    current_user: UserSnapshot | None,
+) -> None:
+    await callback.answer()
+    if not _is_admin(current_user):
+        await callback.message.answer("اجازه نداری.")
+        return
+    page_size = settings.admin_queue_page_size
+    async with session_scope() as session:
+        page = await payment_service.list_pending_payments_page(session, callback_data.after_id, page_size)
+        # Only what the admin was shown; payments that arrived since then stay in the queue.
+        payment_ids = [item.payment_id for item in page.items if item.payment_id <= callback_data.until_id]
+        outcomes = await payment_service.review_payments(session, payment_ids, current_user.id, approve=True)
+        total = await payment_service.count_pending_payments(session)
+        page = await payment_service.list_pending_payments_page(session, callback_data.after_id, page_size)
+    approved = sum(outcome.ok for outcome in outcomes)
+    await callback.message.answer(fa.ADMIN_BULK_APPROVED.format(approved=approved, failed=len(outcomes) - approved))
+    if page.items:
+        await callback.message.edit_text(
+            _render_payment_queue(total, page),
+            reply_markup=admin_payment_queue(
+                (item.payment_id for item in page.items),
+                callback_data.after_id,
+                page.next_after,
+            ),
+        )
+    else:
+        await callback.message.edit_text("رسید در صف نیست.")
 
 
 @router.callback_query(AdminAction.filter(F.action == "approve_payment"))
-async def admin_approve_payment(callback: CallbackQuery, callback_data: AdminAction) -> None:
+async def admin_approve_payment(
+    callback: CallbackQuery,
+    callback_data: AdminAction,
+    current_user: UserSnapshot | None,
+) -> None:
     await callback.answer()
+    if not _is_admin(current_user):
+        await callback.message.answer("اجازه نداری.")
+        return
     async with session_scope() as session:
-        admin = await get_user_by_tg_id(session, callback.from_user.id)
-        if admin is None or not _is_admin(callback.from_user.id, admin.is_admin):
-            await callback.message.answer("اجازه نداری.")
-            return
         try:
-            payment = await payment_service.approve_payment(session, callback_data.entity_id, admin.id)
+            await payment_service.approve_payment(session, callback_data.entity_id, current_user.id)
         except ValueError as exc:
             await callback.message.answer(str(exc))
             return
-        reservation = payment.reservation
-        listing = reservation.listing
-        full_code = cipher.decrypt(listing.full_code_enc)
-        buyer = reservation.buyer
     await callback.message.answer(fa.PAYMENT_APPROVED)
-    await callback.message.bot.send_message(buyer.tg_id, fa.CODE_DELIVERED.format(code=full_code))
 
 
 @router.callback_query(AdminAction.filter(F.action == "reject_payment"))
-async def admin_reject_payment(callback: CallbackQuery, callback_data: AdminAction) -> None:
+async def admin_reject_payment(
+    callback: CallbackQuery,
+    callback_data: AdminAction,
+    current_user: UserSnapshot | None,
+) -> None:
     await callback.answer()
+    if not _is_admin(current_user):
+        await callback.message.answer("اجازه نداری.")
+        return
     async with session_scope() as session:
-        admin = await get_user_by_tg_id(session, callback.from_user.id)
-        if admin is None or not _is_admin(callback.from_user.id, admin.is_admin):
-            await callback.message.answer("اجازه نداری.")
-            return
         try:
-            payment = await payment_service.reject_payment(session, callback_data.entity_id, admin.id)
+            await payment_service.reject_payment(session, callback_data.entity_id, current_user.id)
         except ValueError as exc:
             await callback.message.answer(str(exc))
             return
-        buyer = payment.reservation.buyer
     await callback.message.answer(fa.PAYMENT_REJECTED)
-    await callback.message.bot.send_message(buyer.tg_id, fa.PAYMENT_REJECTED)
 
 
 @router.callback_query(AdminAction.filter(F.action == "disputes"))
-async def admin_disputes(callback: CallbackQuery) -> None:
+async def admin_disputes(callback: CallbackQuery, current_user: UserSnapshot | None) -> None:
     await callback.answer()
+    if not _is_admin(current_user):
+        await callback.message.answer("اجازه نداری.")
+        return
     async with session_scope() as session:
-        admin = await get_user_by_tg_id(session, callback.from_user.id)
-        if admin is None or not _is_admin(callback.from_user.id, admin.is_admin):
-            await callback.message.answer("اجازه نداری.")
-            return
         disputes = await dispute_service.list_open_disputes(session)
         if not disputes:
             await callback.message.answer("اختلاف باز وجود ندارد.")
@@ -124,18 +165,21 @@ async def admin_disputes(callback: CallbackQuery) -> None:
 
 
 @router.callback_query(AdminAction.filter(lambda a: a.action in {"in_review", "resolved", "dismissed"}))
-async def admin_dispute_update(callback: CallbackQuery, callback_data: AdminAction) -> None:
+async def admin_dispute_update(
+    callback: CallbackQuery,
+    callback_data: AdminAction,
+    current_user: UserSnapshot | None,
+) -> None:
     await callback.answer()
     status_map = {
         "in_review": DisputeStatus.in_review,
         "resolved": DisputeStatus.resolved,
         "dismissed": DisputeStatus.dismissed,
     }
+    if not _is_admin(current_user):
+        await callback.message.answer("اجازه نداری.")
+        return
     async with session_scope() as session:
-        admin = await get_user_by_tg_id(session, callback.from_user.id)
-        if admin is None or not _is_admin(callback.from_user.id, admin.is_admin):
-            await callback.message.answer("اجازه نداری.")
-            return
         try:
             await dispute_service.set_dispute_status(session, callback_data.entity_id, status_map[callback_data.action])
         except ValueError as exc:
@@ -145,19 +189,23 @@ async def admin_dispute_update(callback: CallbackQuery, callback_data: AdminActi
 
 
 @router.callback_query(AdminAction.filter(F.action == "stats"))
-async def admin_stats(callback: CallbackQuery) -> None:
+async def admin_stats(callback: CallbackQuery, current_user: UserSnapshot | None) -> None:
     await callback.answer()
+    if not _is_admin(current_user):
+        await callback.message.answer("اجازه نداری.")
+        return
     async with session_scope() as session:
-        admin = await get_user_by_tg_id(session, callback.from_user.id)
-        if admin is None or not _is_admin(callback.from_user.id, admin.is_admin):
-            await callback.message.answer("اجازه نداری.")
-            return
         stats = await report_service.daily_stats(session)
     await callback.message.answer(
         fa.ADMIN_STATS.format(
             sales=stats["sales"],
             reservations=stats["reservations"],
             approved=stats["approved"],
+        )
+        + "\n"
+        + fa.ADMIN_THROTTLE_STATS.format(
+            messages=throttle_stats.throttled_messages,
+            callbacks=throttle_stats.throttled_callbacks,
         ),
     )
 
@@ -177,8 +225,8 @@ async def admin_settings(callback: CallbackQuery) -> None:
 
 
 @router.message(Command("set_ttl"))
-async def set_ttl(message: Message, command: CommandObject) -> None:
-    if not await _assert_admin(message):
+async def set_ttl(message: Message, command: CommandObject, current_user: UserSnapshot | None) -> None:
+    if not await _assert_admin(message, current_user):
         return
     args = command.args
     if not args or not args.isdigit():
@@ -190,8 +238,8 @@ async def set_ttl(message: Message, command: CommandObject) -> None:
 
 
 @router.message(Command("set_listing_limit"))
-async def set_listing_limit(message: Message, command: CommandObject) -> None:
-    if not await _assert_admin(message):
+async def set_listing_limit(message: Message, command: CommandObject, current_user: UserSnapshot | None) -> None:
+    if not await _assert_admin(message, current_user):
         return
     args = command.args
     if not args or not args.isdigit():
@@ -203,8 +251,8 @@ async def set_listing_limit(message: Message, command: CommandObject) -> None:
 
 
 @router.message(Command("set_reserve_limit"))
-async def set_reserve_limit(message: Message, command: CommandObject) -> None:
-    if not await _assert_admin(message):
+async def set_reserve_limit(message: Message, command: CommandObject, current_user: UserSnapshot | None) -> None:
+    if not await _assert_admin(message, current_user):
         return
     args = command.args
     if not args or not args.isdigit():
@@ -216,8 +264,8 @@ async def set_reserve_limit(message: Message, command: CommandObject) -> None:
 
 
 @router.message(Command("toggle_registration"))
-async def toggle_registration(message: Message) -> None:
-    if not await _assert_admin(message):
+async def toggle_registration(message: Message, current_user: UserSnapshot | None) -> None:
+    if not await _assert_admin(message, current_user):
         return
     settings.registration_enabled = not settings.registration_enabled
     status = "فعال" if settings.registration_enabled else "غیرفعال"
@@ -225,8 +273,8 @@ async def toggle_registration(message: Message) -> None:
 
 
 @router.message(Command("ban"))
-async def admin_ban(message: Message, command: CommandObject) -> None:
-    if not await _assert_admin(message):
+async def admin_ban(message: Message, command: CommandObject, current_user: UserSnapshot | None) -> None:
+    if not await _assert_admin(message, current_user):
         return
     args = command.args
     if not args or not args.isdigit():
@@ -234,11 +282,7 @@ async def admin_ban(message: Message, command: CommandObject) -> None:
         return
     tg_id = int(args)
     async with session_scope() as session:
-        admin = await get_user_by_tg_id(session, message.from_user.id)
-        if admin is None or not _is_admin(message.from_user.id, admin.is_admin):
-            await message.answer("اجازه نداری.")
-            return
-        target = await get_user_by_tg_id(session, tg_id)
+        target = await get_user_snapshot(session, tg_id)
         if target is None:
             await message.answer("کاربر پیدا نشد.")
             return
@@ -247,8 +291,8 @@ async def admin_ban(message: Message, command: CommandObject) -> None:
 
 
 @router.message(Command("unban"))
-async def admin_unban(message: Message, command: CommandObject) -> None:
-    if not await _assert_admin(message):
+async def admin_unban(message: Message, command: CommandObject, current_user: UserSnapshot | None) -> None:
+    if not await _assert_admin(message, current_user):
         return
     args = command.args
     if not args or not args.isdigit():
@@ -256,13 +300,37 @@ async def admin_unban(message: Message, command: CommandObject) -> None:
         return
     tg_id = int(args)
     async with session_scope() as session:
-        admin = await get_user_by_tg_id(session, message.from_user.id)
-        if admin is None or not _is_admin(message.from_user.id, admin.is_admin):
-            await message.answer("اجازه نداری.")
-            return
-        target = await get_user_by_tg_id(session, tg_id)
+        target = await get_user_snapshot(session, tg_id)
         if target is None:
             await message.answer("کاربر پیدا نشد.")
             return
         await set_ban_status(session, target.id, False)
     await message.answer("کاربر از بن خارج شد.")
+
+
+def _format_shared_code(listings: list[code_index.SharedCodeListing]) -> str:
+    return "\n".join(
+        f"آگهی #{item.listing_id} | فروشنده {item.seller_id} | {item.status.value} | {item.listing_date}"
+        for item in listings
+    )
+
+
+@router.message(Command("dupes"))
+async def admin_duplicate_codes(message: Message, command: CommandObject, current_user: UserSnapshot | None) -> None:
+    if not await _assert_admin(message, current_user):
+        return
+    args = command.args
+    if args and not args.isdigit():
+        await message.answer("دستور: /dupes یا /dupes <listing_id>")
+        return
+    async with session_scope() as session:
+        if args:
+            groups = [await code_index.listings_sharing_code(session, int(args))]
+        else:
+            groups = await code_index.duplicate_code_groups(session)
+    groups = [group for group in groups if len(group) > 1]
+    if not groups:
+        await message.answer("کد تکراری پیدا نشد.")
+        return
+    for group in groups:
+        await message.answer(f"{len(group)} آگهی با کد یکسان:\n{_format_shared_code(group)}")
@@ -13,7 +13,7 @@ from aiogram.types import Message
 from ..config import settings
 from ..db import session_scope
 from ..messages import fa
-from ..services.user_service import ensure_user_exists, get_user_by_tg_id, update_user_email
+from ..services.user_service import UserSnapshot, ensure_user_exists, update_user_email
 
 logger = logging.getLogger(__name__)
 
@@ -28,15 +28,13 @@ class RegisterStates(StatesGroup):
 
 
 @router.message(Command(commands=["register", "login"]))
-async def cmd_register(message: Message, state: FSMContext) -> None:
-    async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user:
-            if user.is_banned:
-                await message.answer(fa.USER_BANNED)
-                return
-            await message.answer(fa.REGISTRATION_EXISTS)
+async def cmd_register(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
+    if current_user:
+        if current_user.is_banned:
+            await message.answer(fa.USER_BANNED)
             return
+        await message.answer(fa.REGISTRATION_EXISTS)
+        return
     if not settings.registration_enabled:
         await message.answer(fa.REGISTRATION_DISABLED)
         return
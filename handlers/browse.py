@@ -1,64 +1,94 @@
 from __future__ import annotations
 
 from aiogram import F, Router
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
 from ..db import session_scope
-from ..keyboards.buyer import BrowseAction, browse_listing_keyboard
+from ..keyboards.buyer import BrowseAction, BrowseNext, listing_card, listing_version
 from ..messages import fa
 from ..models import Listing
 from ..services import listing_service
-from ..services.user_service import get_user_by_tg_id
+from ..services.listing_catalog import ListingRecord, catalog
+from ..services.listing_service import BrowseFilters, ListingCursor, parse_browse_filters
+from ..services.user_service import UserSnapshot
 
 router = Router()
 
 
-async def _send_listing(message: Message, listing: Listing) -> None:
-    text = fa.format_listing(
-        date=listing.date.isoformat(),
-        meal="ناهار" if listing.meal_type.value == "lunch" else "شام",
-        dish=listing.dish_name,
-        price=listing.price,
-        masked=listing.masked_code,
-    )
-    await message.answer(text, reply_markup=browse_listing_keyboard(listing.id))
+async def _next_listing(after: ListingCursor | None, filters: BrowseFilters) -> Listing | ListingRecord | None:
+    if catalog.loaded and filters.is_default:
+        records = catalog.after(after)
+        if not records and after is not None:
+            records = catalog.after()
+        return records[0] if records else None
+    async with session_scope() as session:
+        listings = await listing_service.list_active_listings(session, limit=1, after=after, filters=filters)
+        if not listings and after is not None:
+            listings = await listing_service.list_active_listings(session, limit=1, filters=filters)
+    return listings[0] if listings else None
+
+
+async def _send_listing(message: Message, listing: Listing | ListingRecord) -> None:
+    card = listing_card(listing)
+    await message.answer(card.text, reply_markup=card.reply_markup)
+
+
+async def _cursor_for(listing_id: int) -> ListingCursor | None:
+    """Rebuilds the browse position of the card being paged from, even if it has since sold."""
+    listing = catalog.get(listing_id)
+    if listing is None:
+        async with session_scope() as session:
+            listing = await listing_service.get_listing(session, listing_id)
+    return ListingCursor.from_listing(listing) if listing is not None else None
 
 
 @router.message(Command("buy"))
-async def cmd_buy(message: Message, state: FSMContext) -> None:
-    async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user is None:
-            await message.answer("برای خرید ابتدا ثبت‌نام کن: /register")
-            return
-        if user.is_banned:
-            await message.answer(fa.USER_BANNED)
-            return
-        listings = await listing_service.list_active_listings(session, limit=20)
-    if not listings:
+async def cmd_buy(
+    message: Message,
+    command: CommandObject,
+    state: FSMContext,
+    current_user: UserSnapshot | None,
+) -> None:
+    if current_user is None:
+        await message.answer("برای خرید ابتدا ثبت‌نام کن: /register")
+        return
+    if current_user.is_banned:
+        await message.answer(fa.USER_BANNED)
+        return
+    try:
+        filters = parse_browse_filters(command.args or "")
+    except ValueError as exc:
+        await message.answer(f"{exc}\n{fa.BROWSE_FILTER_HELP}")
+        return
+    listing = await _next_listing(None, filters)
+    if listing is None:
         await message.answer(fa.NO_LISTINGS)
         return
-    await state.update_data(listing_ids=[listing.id for listing in listings], index=0)
-    await _send_listing(message, listings[0])
+    await state.update_data(browse_filters=command.args or "")
+    await _send_listing(message, listing)
 
 
+@router.callback_query(BrowseNext.filter())
+# Cards sent before the button carried a version.
 @router.callback_query(BrowseAction.filter(F.action == "next"))
-async def browse_next(callback: CallbackQuery, callback_data: BrowseAction, state: FSMContext) -> None:
-    await callback.answer()
+async def browse_next(callback: CallbackQuery, callback_data: BrowseNext | BrowseAction, state: FSMContext) -> None:
     data = await state.get_data()
-    ids = data.get("listing_ids", [])
-    if not ids:
-        await callback.message.answer(fa.NO_LISTINGS)
+    try:
+        filters = parse_browse_filters(data.get("browse_filters", ""))
+    except ValueError:
+        # A stored date range can lapse overnight; paging on unfiltered would show what they did not ask for.
+        await callback.answer(fa.BROWSE_FILTER_LAPSED, show_alert=True)
         return
-    index = data.get("index", 0) + 1
-    if index >= len(ids):
-        index = 0
-    async with session_scope() as session:
-        listing = await listing_service.get_listing(session, ids[index])
-        if listing is None:
-            await callback.message.answer("این آگهی دیگر موجود نیست.")
-            return
-        await _send_listing(callback.message, listing)
-    await state.update_data(index=index)
+    # The card's own listing id is the cursor, so paging needs no per-user state beyond the filters.
+    listing = await _next_listing(await _cursor_for(callback_data.item_id), filters)
+    if listing is None:
+        await callback.answer(fa.NO_LISTINGS)
+        return
+    await callback.answer()
+    card = listing_card(listing)
+    if listing.id == callback_data.item_id and listing_version(listing) == getattr(callback_data, "version", None):
+        # Wrapped around to the same card: editing would only earn a "message is not modified" error.
+        return
+    await callback.message.edit_text(card.text, reply_markup=card.reply_markup)
@@ -11,7 +11,7 @@ from ..keyboards.buyer import BrowseAction
 from ..messages import fa
 from ..models import Listing, Reservation
 from ..services.dispute_service import create_dispute
-from ..services.user_service import get_user_by_tg_id
+from ..services.user_service import UserSnapshot
 
 router = Router()
 
@@ -23,28 +23,28 @@ class DisputeStates(StatesGroup):
 
 
 @router.message(Command("report"))
-async def dispute_start(message: Message, state: FSMContext) -> None:
-    async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user is None:
-            await message.answer("ابتدا ثبت‌نام کن: /register")
-            return
+async def dispute_start(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
+    if current_user is None:
+        await message.answer("ابتدا ثبت‌نام کن: /register")
+        return
     await state.set_state(DisputeStates.reservation)
     await message.answer("شناسهٔ رزرو یا آگهی‌ای که مشکل دارد را بنویس.")
 
 
 @router.message(DisputeStates.reservation)
-async def dispute_reservation(message: Message, state: FSMContext) -> None:
+async def dispute_reservation(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
     if not message.text.isdigit():
         await message.answer("شناسه باید عدد باشد.")
         return
+    if current_user is None:
+        await message.answer("ابتدا ثبت‌نام کن: /register")
+        return
     identifier = int(message.text)
     async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
         listing = await session.get(Listing, identifier)
         if listing:
             seller_id = listing.seller_id
-            buyer_id = user.id
+            buyer_id = current_user.id
             listing_id = listing.id
         else:
             reservation = await session.get(Reservation, identifier)
@@ -63,15 +63,19 @@ async def dispute_reservation(message: Message, state: FSMContext) -> None:
 
 
 @router.callback_query(BrowseAction.filter(F.action == "report"))
-async def dispute_from_listing(callback: CallbackQuery, callback_data: BrowseAction, state: FSMContext) -> None:
+async def dispute_from_listing(
+    callback: CallbackQuery,
+    callback_data: BrowseAction,
+    state: FSMContext,
+    current_user: UserSnapshot | None,
+) -> None:
     await callback.answer()
     async with session_scope() as session:
         listing = await session.get(Listing, callback_data.item_id)
-        user = await get_user_by_tg_id(session, callback.from_user.id)
-        if listing is None or user is None:
+        if listing is None or current_user is None:
             await callback.message.answer("آگهی پیدا نشد.")
             return
-        await state.update_data(listing_id=listing.id, seller_id=listing.seller_id, buyer_id=user.id)
+        await state.update_data(listing_id=listing.id, seller_id=listing.seller_id, buyer_id=current_user.id)
     await state.set_state(DisputeStates.reason)
     await callback.message.answer(fa.DISPUTE_PROMPT_REASON)
 
@@ -88,16 +92,16 @@ async def dispute_reason(message: Message, state: FSMContext) -> None:
 
 
 @router.message(DisputeStates.evidence, F.document | F.photo)
-async def dispute_evidence_file(message: Message, state: FSMContext) -> None:
+async def dispute_evidence_file(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
     data = await state.get_data()
     file_id = message.document.file_id if message.document else message.photo[-1].file_id
-    await _finalize_dispute(message, state, evidence=file_id, data=data)
+    await _finalize_dispute(message, state, current_user, evidence=file_id, data=data)
 
 
 @router.message(DisputeStates.evidence, F.text == "/skip")
-async def dispute_evidence_skip(message: Message, state: FSMContext) -> None:
+async def dispute_evidence_skip(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
     data = await state.get_data()
-    await _finalize_dispute(message, state, evidence=None, data=data)
+    await _finalize_dispute(message, state, current_user, evidence=None, data=data)
 
 
 @router.message(DisputeStates.evidence)
@@ -105,12 +109,17 @@ async def dispute_evidence_invalid(message: Message) -> None:
     await message.answer("فایل یا /skip بفرست.")
 
 
-async def _finalize_dispute(message: Message, state: FSMContext, evidence: str | None, data: dict) -> None:
+async def _finalize_dispute(
+    message: Message,
+    state: FSMContext,
+    current_user: UserSnapshot | None,
+    evidence: str | None,
+    data: dict,
+) -> None:
+    if current_user is None:
+        await message.answer("ابتدا ثبت‌نام کن.")
+        return
     async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user is None:
-            await message.answer("ابتدا ثبت‌نام کن.")
-            return
         await create_dispute(
             session=session,
             listing_id=data["listing_id"],
@@ -10,7 +10,7 @@ from ..db import session_scope
 from ..keyboards.buyer import BrowseAction
 from ..messages import fa
 from ..services import payment_service
-from ..services.user_service import get_user_by_tg_id
+from ..services.user_service import UserSnapshot
 
 router = Router()
 
@@ -40,7 +40,7 @@ async def payment_method(message: Message, state: FSMContext) -> None:
 
 
 @router.message(PaymentStates.proof, F.document | F.photo)
-async def payment_proof(message: Message, state: FSMContext) -> None:
+async def payment_proof(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
     data = await state.get_data()
     reservation_id = data.get("reservation_id")
     method = data.get("method")
@@ -51,14 +51,13 @@ async def payment_proof(message: Message, state: FSMContext) -> None:
     else:
         await message.answer("لطفاً رسید را به صورت فایل یا عکس ارسال کن.")
         return
+    if current_user is None:
+        await message.answer("ابتدا ثبت‌نام کن: /register")
+        return
+    if current_user.is_banned:
+        await message.answer(fa.USER_BANNED)
+        return
     async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user is None:
-            await message.answer("ابتدا ثبت‌نام کن: /register")
-            return
-        if user.is_banned:
-            await message.answer(fa.USER_BANNED)
-            return
         try:
             await payment_service.submit_payment(session, reservation_id, method, file_id)
         except ValueError as exc:
@@ -10,7 +10,7 @@ from ..db import session_scope
 from ..messages import fa
 from ..models import Reservation, ReservationStatus
 from ..services.rating_service import submit_rating
-from ..services.user_service import get_user_by_tg_id
+from ..services.user_service import UserSnapshot
 
 router = Router()
 
@@ -23,15 +23,13 @@ class RateStates(StatesGroup):
 
 
 @router.message(Command("rate"))
-async def rate_start(message: Message, state: FSMContext) -> None:
-    async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user is None:
-            await message.answer("ابتدا ثبت‌نام کن: /register")
-            return
-        if user.is_banned:
-            await message.answer(fa.USER_BANNED)
-            return
+async def rate_start(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
+    if current_user is None:
+        await message.answer("ابتدا ثبت‌نام کن: /register")
+        return
+    if current_user.is_banned:
+        await message.answer(fa.USER_BANNED)
+        return
     await state.set_state(RateStates.role)
     await message.answer(fa.RATING_PROMPT_TARGET)
 
@@ -48,35 +46,34 @@ async def rate_role(message: Message, state: FSMContext) -> None:
 
 
 @router.message(RateStates.reservation)
-async def rate_reservation(message: Message, state: FSMContext) -> None:
+async def rate_reservation(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
     if not message.text.isdigit():
         await message.answer("شناسهٔ رزرو باید عدد باشد.")
         return
     reservation_id = int(message.text)
+    if current_user is None:
+        await message.answer("ابتدا ثبت‌نام کن.")
+        return
     async with session_scope() as session:
         reservation = await session.get(Reservation, reservation_id)
         if reservation is None or reservation.status != ReservationStatus.approved:
             await message.answer("رزرو پیدا نشد یا هنوز تمام نشده است.")
             return
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user is None:
-            await message.answer("ابتدا ثبت‌نام کن.")
-            return
         role = (await state.get_data()).get("role")
         if role == "فروشنده":
-            if reservation.buyer_id != user.id:
+            if reservation.buyer_id != current_user.id:
                 await message.answer("این معامله متعلق به تو نیست.")
                 return
             target_id = reservation.listing.seller_id
         else:
-            if reservation.listing.seller_id != user.id:
+            if reservation.listing.seller_id != current_user.id:
                 await message.answer("این معامله متعلق به تو نیست.")
                 return
             target_id = reservation.buyer_id
         if reservation.status != ReservationStatus.approved:
             await message.answer("این معامله هنوز نهایی نشده است.")
             return
-        user_id = user.id
+        user_id = current_user.id
     await state.update_data(reservation_id=reservation_id, to_user=target_id, from_user=user_id)
     await state.set_state(RateStates.stars)
     await message.answer(fa.RATING_PROMPT_STARS)
@@ -6,38 +6,46 @@ from aiogram import F, Router
 from aiogram.types import CallbackQuery
 
 from ..db import session_scope
-from ..keyboards.buyer import BrowseAction, reservation_actions
+from ..keyboards.buyer import BrowseAction, reservation_actions, waitlist_keyboard
 from ..messages import fa
-from ..services import reservation_service
-from ..services.user_service import get_user_by_tg_id
+from ..services import reservation_service, waitlist_service
+from ..services.user_service import UserSnapshot
 
 router = Router()
 
 
 @router.callback_query(BrowseAction.filter(F.action == "reserve"))
-async def handle_reserve(callback: CallbackQuery, callback_data: BrowseAction) -> None:
+async def handle_reserve(
+    callback: CallbackQuery,
+    callback_data: BrowseAction,
+    current_user: UserSnapshot | None,
+) -> None:
     await callback.answer()
-    async with session_scope() as session:
-        user = await get_user_by_tg_id(session, callback.from_user.id)
-        if user is None:
-            await callback.message.answer("ابتدا ثبت‌نام کن: /register")
-            return
-        if user.is_banned:
-            await callback.message.answer(fa.USER_BANNED)
-            return
-        try:
+    if current_user is None:
+        await callback.message.answer("ابتدا ثبت‌نام کن: /register")
+        return
+    if current_user.is_banned:
+        await callback.message.answer(fa.USER_BANNED)
+        return
+    try:
+        async with reservation_service.listing_claim_lock(callback_data.item_id), session_scope() as session:
             reservation = await reservation_service.create_reservation(
                 session=session,
                 listing_id=callback_data.item_id,
-                buyer_id=user.id,
+                buyer_id=current_user.id,
             )
-        except PermissionError as exc:
+            reserved_until = reservation.reserved_until
+    except PermissionError as exc:
+        await callback.message.answer(str(exc))
+        return
+    except ValueError as exc:
+        async with session_scope() as session:
+            waitable = await waitlist_service.is_waitable(session, callback_data.item_id)
+        if waitable:
+            await callback.message.answer(fa.WAITLIST_OFFER, reply_markup=waitlist_keyboard(callback_data.item_id, joined=False))
+        else:
             await callback.message.answer(str(exc))
-            return
-        except ValueError as exc:
-            await callback.message.answer(str(exc))
-            return
-        reserved_until = reservation.reserved_until
+        return
     until = reserved_until.strftime("%H:%M:%S")
     await callback.message.answer(
         fa.RESERVE_DONE.format(until=until),
@@ -46,16 +54,58 @@ async def handle_reserve(callback: CallbackQuery, callback_data: BrowseAction) -
 
 
 @router.callback_query(BrowseAction.filter(F.action == "cancel"))
-async def handle_cancel(callback: CallbackQuery, callback_data: BrowseAction) -> None:
+async def handle_cancel(
+    callback: CallbackQuery,
+    callback_data: BrowseAction,
+    current_user: UserSnapshot | None,
+) -> None:
     await callback.answer()
+    if current_user is None:
+        await callback.message.answer("ابتدا ثبت‌نام کن: /register")
+        return
     async with session_scope() as session:
-        user = await get_user_by_tg_id(session, callback.from_user.id)
-        if user is None:
-            await callback.message.answer("ابتدا ثبت‌نام کن: /register")
-            return
         try:
             await reservation_service.cancel_reservation(session, callback_data.item_id)
         except ValueError as exc:
             await callback.message.answer(str(exc))
             return
     await callback.message.answer("رزرو لغو شد و آگهی دوباره فعال شد.")
+
+
+@router.callback_query(BrowseAction.filter(F.action == "waitlist_join"))
+async def handle_waitlist_join(
+    callback: CallbackQuery,
+    callback_data: BrowseAction,
+    current_user: UserSnapshot | None,
+) -> None:
+    await callback.answer()
+    if current_user is None:
+        await callback.message.answer("ابتدا ثبت‌نام کن: /register")
+        return
+    if current_user.is_banned:
+        await callback.message.answer(fa.USER_BANNED)
+        return
+    try:
+        async with session_scope() as session:
+            position = await waitlist_service.join_waitlist(session, callback_data.item_id, current_user.id)
+    except (ValueError, PermissionError) as exc:
+        await callback.message.answer(str(exc))
+        return
+    await callback.message.answer(
+        fa.WAITLIST_JOINED.format(position=position),
+        reply_markup=waitlist_keyboard(callback_data.item_id, joined=True),
+    )
+
+
+@router.callback_query(BrowseAction.filter(F.action == "waitlist_leave"))
+async def handle_waitlist_leave(
+    callback: CallbackQuery,
+    callback_data: BrowseAction,
+    current_user: UserSnapshot | None,
+) -> None:
+    await callback.answer()
+    if current_user is None:
+        return
+    async with session_scope() as session:
+        await waitlist_service.leave_waitlist(session, callback_data.item_id, current_user.id)
+    await callback.message.answer(fa.WAITLIST_LEFT)
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+from aiogram import Bot, F, Router
+from aiogram.filters import CommandObject, CommandStart
+from aiogram.fsm.context import FSMContext
+from aiogram.types import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Message,
+)
+
+from ..config import settings
+from ..keyboards.buyer import listing_card
+from ..messages import fa
+from ..services.listing_catalog import ListingRecord, catalog
+from ..services.user_service import UserSnapshot
+
+router = Router()
+
+DEEP_LINK_PREFIX = "listing_"
+# Telegram caches an answer per query text for this long; listings change faster than the default 300s.
+INLINE_CACHE_SECONDS = 10
+
+
+def _meal_label(listing: ListingRecord) -> str:
+    return "ناهار" if listing.meal_type.value == "lunch" else "شام"
+
+
+def _result(listing: ListingRecord, bot_username: str) -> InlineQueryResultArticle:
+    # Callback buttons on inline messages carry no chat, so reserving happens in the bot's private chat.
+    link = f"https://t.me/{bot_username}?start={DEEP_LINK_PREFIX}{listing.id}"
+    return InlineQueryResultArticle(
+        id=str(listing.id),
+        title=listing.dish_name,
+        description=fa.SEARCH_RESULT_DESCRIPTION.format(
+            date=listing.date.isoformat(),
+            meal=_meal_label(listing),
+            price=listing.price,
+        ),
+        input_message_content=InputTextMessageContent(message_text=listing_card(listing).text),
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text=fa.SEARCH_OPEN_BUTTON, url=link)]],
+        ),
+    )
+
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery, bot: Bot) -> None:
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    page_size = settings.inline_search_page_size
+    # One extra row tells whether another page exists without counting every match.
+    listings = catalog.search(inline_query.query, offset=offset, limit=page_size + 1)
+    me = await bot.me()
+    await inline_query.answer(
+        [_result(listing, me.username) for listing in listings[:page_size]],
+        cache_time=INLINE_CACHE_SECONDS,
+        next_offset=str(offset + page_size) if len(listings) > page_size else "",
+    )
+
+
+@router.message(CommandStart(deep_link=True, magic=F.args.startswith(DEEP_LINK_PREFIX)))
+async def open_search_result(
+    message: Message,
+    command: CommandObject,
+    state: FSMContext,
+    current_user: UserSnapshot | None,
+) -> None:
+    if current_user is None:
+        await message.answer("برای خرید ابتدا ثبت‌نام کن: /register")
+        return
+    if current_user.is_banned:
+        await message.answer(fa.USER_BANNED)
+        return
+    raw_id = command.args[len(DEEP_LINK_PREFIX):]
+    listing = catalog.get(int(raw_id)) if raw_id.isdigit() else None
+    if listing is None:
+        await message.answer(fa.LISTING_UNAVAILABLE)
+        return
+    await state.update_data(browse_filters="")
+    card = listing_card(listing)
+    await message.answer(card.text, reply_markup=card.reply_markup)
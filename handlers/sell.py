@@ -1,19 +1,22 @@
 from __future__ import annotations
 
+import io
 import logging
 from datetime import datetime
+from typing import Iterable, List
 
 from aiogram import F, Router
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message
 
+from ..config import settings
 from ..db import session_scope
 from ..keyboards.seller import MealSelection, meal_keyboard
 from ..messages import fa
 from ..services import listing_service
-from ..services.user_service import get_user_by_tg_id
+from ..services.user_service import UserSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -27,22 +30,45 @@ class SellStates(StatesGroup):
     price = State()
     code = State()
     confirm = State()
+    bulk = State()
+
+
+BULK_FILE_MAX_BYTES = 256 * 1024
+MESSAGE_LIMIT = 4000
+
+
+def _chunk_lines(lines: Iterable[str]) -> List[str]:
+    chunks: List[str] = []
+    current = ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > MESSAGE_LIMIT:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
 
 
 @router.message(Command("sell"))
-async def cmd_sell(message: Message, state: FSMContext) -> None:
-    async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user is None:
-            await message.answer("برای فروش ابتدا ثبت‌نام کن: /register")
-            return
-        if user.is_banned:
-            await message.answer(fa.USER_BANNED)
-            return
+async def cmd_sell(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
+    if current_user is None:
+        await message.answer("برای فروش ابتدا ثبت‌نام کن: /register")
+        return
+    if current_user.is_banned:
+        await message.answer(fa.USER_BANNED)
+        return
     await state.set_state(SellStates.date)
     await message.answer(fa.SELL_INTRO)
 
 
+# Ahead of the state handlers below, which would otherwise take /cancel as an answer.
+@router.message(StateFilter(SellStates), Command("cancel"))
+async def sell_cancel(message: Message, state: FSMContext) -> None:
+    await state.clear()
+    await message.answer(fa.SELL_CANCELLED)
+
+
 @router.message(SellStates.date)
 async def sell_get_date(message: Message, state: FSMContext) -> None:
     try:
@@ -102,21 +128,20 @@ async def sell_get_code(message: Message, state: FSMContext) -> None:
 
 
 @router.message(SellStates.confirm)
-async def sell_confirm(message: Message, state: FSMContext) -> None:
+async def sell_confirm(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
     if message.text.strip() not in {"تایید", "تاييد", "بله"}:
         await message.answer("برای ثبت آگهی «تایید» را بنویس یا /cancel بزن.")
         return
+    if current_user is None:
+        await message.answer("ابتدا ثبت‌نام کن: /register")
+        await state.clear()
+        return
     data = await state.get_data()
     async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user is None:
-            await message.answer("ابتدا ثبت‌نام کن: /register")
-            await state.clear()
-            return
         try:
             listing = await listing_service.create_listing(
                 session=session,
-                seller_id=user.id,
+                seller_id=current_user.id,
                 listing_date=datetime.fromisoformat(data["listing_date"]).date(),
                 meal_type=data["meal"],
                 dish_name=data["dish"],
@@ -135,3 +160,58 @@ async def sell_confirm(message: Message, state: FSMContext) -> None:
     await message.answer(fa.SELL_CREATED)
     await state.clear()
 
+
+@router.message(Command("sell_bulk"))
+async def cmd_sell_bulk(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
+    if current_user is None:
+        await message.answer("برای فروش ابتدا ثبت‌نام کن: /register")
+        return
+    if current_user.is_banned:
+        await message.answer(fa.USER_BANNED)
+        return
+    await state.set_state(SellStates.bulk)
+    await message.answer(fa.SELL_BULK_INTRO.format(max_rows=settings.bulk_listing_max_rows))
+
+
+# Other commands pass through to their own handlers instead of being parsed as a row.
+@router.message(SellStates.bulk, ~F.text.startswith("/"))
+async def sell_bulk_rows(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
+    if current_user is None:
+        await message.answer("ابتدا ثبت‌نام کن: /register")
+        await state.clear()
+        return
+    if message.document is not None:
+        if (message.document.file_size or 0) > BULK_FILE_MAX_BYTES:
+            await message.answer(fa.SELL_BULK_BAD_FILE)
+            return
+        buffer = await message.bot.download(message.document, destination=io.BytesIO())
+        try:
+            raw = buffer.getvalue().decode("utf-8-sig")
+        except UnicodeDecodeError:
+            await message.answer(fa.SELL_BULK_BAD_FILE)
+            return
+    else:
+        raw = message.text or ""
+
+    rows = listing_service.parse_bulk_listings(raw)
+    if not rows:
+        await message.answer(fa.SELL_BULK_EMPTY)
+        return
+    if len(rows) > settings.bulk_listing_max_rows:
+        await message.answer(fa.SELL_BULK_TOO_MANY.format(max_rows=settings.bulk_listing_max_rows))
+        return
+
+    async with session_scope() as session:
+        results = await listing_service.create_listings_bulk(session, current_user.id, rows)
+    await state.clear()
+
+    created = sum(result.ok for result in results)
+    lines = [fa.SELL_BULK_SUMMARY.format(created=created, failed=len(results) - created)]
+    lines.extend(
+        fa.SELL_BULK_ROW_OK.format(line=result.line, listing_id=result.listing_id)
+        if result.ok
+        else fa.SELL_BULK_ROW_FAILED.format(line=result.line, error=result.error)
+        for result in results
+    )
+    for chunk in _chunk_lines(lines):
+        await message.answer(chunk)
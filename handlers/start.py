@@ -7,9 +7,8 @@ from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 
-from ..db import session_scope
 from ..messages import fa
-from ..services.user_service import get_user_by_tg_id
+from ..services.user_service import UserSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -17,13 +16,11 @@ router = Router()
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext) -> None:
+async def cmd_start(message: Message, state: FSMContext, current_user: UserSnapshot | None) -> None:
     await state.clear()
-    async with session_scope() as session:
-        user = await get_user_by_tg_id(session, message.from_user.id)
-        if user and user.is_banned:
-            await message.answer(fa.USER_BANNED)
-            return
+    if current_user and current_user.is_banned:
+        await message.answer(fa.USER_BANNED)
+        return
     await message.answer(fa.WELCOME)
 
 
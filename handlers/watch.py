@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from aiogram import F, Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import CallbackQuery, Message
+
+from ..db import session_scope
+from ..keyboards.buyer import WatchAction, watch_list_keyboard
+from ..messages import fa
+from ..models import MealType, Watch
+from ..services import watch_service
+from ..services.user_service import UserSnapshot
+
+router = Router()
+
+
+def _describe(watch: Watch) -> str:
+    parts = [f"#{watch.id}", f"{watch.date_from}..{watch.date_to}"]
+    if watch.meal_type is not None:
+        parts.append("ناهار" if watch.meal_type == MealType.lunch else "شام")
+    if watch.max_price is not None:
+        parts.append(f"تا {watch.max_price} تومان")
+    if watch.dish_query:
+        parts.append(f"«{watch.dish_query}»")
+    return " | ".join(parts)
+
+
+@router.message(Command("watch"))
+async def cmd_watch(message: Message, command: CommandObject, current_user: UserSnapshot | None) -> None:
+    if current_user is None:
+        await message.answer("برای ثبت هشدار ابتدا ثبت‌نام کن: /register")
+        return
+    if current_user.is_banned:
+        await message.answer(fa.USER_BANNED)
+        return
+    if not command.args:
+        await message.answer(fa.WATCH_HELP)
+        return
+    try:
+        spec = watch_service.parse_watch_spec(command.args)
+    except ValueError as exc:
+        await message.answer(str(exc))
+        return
+    async with session_scope() as session:
+        try:
+            watch = await watch_service.create_watch(session, current_user.id, spec)
+        except PermissionError as exc:
+            await message.answer(str(exc))
+            return
+    await message.answer(fa.WATCH_CREATED.format(watch_id=watch.id))
+
+
+@router.message(Command("watches"))
+async def cmd_watches(message: Message, current_user: UserSnapshot | None) -> None:
+    if current_user is None:
+        await message.answer("ابتدا ثبت‌نام کن: /register")
+        return
+    async with session_scope() as session:
+        watches = await watch_service.list_watches(session, current_user.id)
+    if not watches:
+        await message.answer(fa.WATCH_NONE)
+        return
+    text = "\n".join([fa.WATCH_LIST_HEADER, *(_describe(watch) for watch in watches)])
+    await message.answer(text, reply_markup=watch_list_keyboard([watch.id for watch in watches]))
+
+
+@router.callback_query(WatchAction.filter(F.action == "delete"))
+async def delete_watch(callback: CallbackQuery, callback_data: WatchAction, current_user: UserSnapshot | None) -> None:
+    await callback.answer()
+    if current_user is None:
+        return
+    async with session_scope() as session:
+        deleted = await watch_service.delete_watch(session, current_user.id, callback_data.watch_id)
+    if deleted:
+        await callback.message.answer(fa.WATCH_DELETED)
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from typing import Iterable, Optional
+
 from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
@@ -9,30 +11,61 @@ class AdminAction(CallbackData, prefix="admin"):
     entity_id: int
 
 
-def admin_dashboard_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="صف رسیدها", callback_data=AdminAction(action="payments", entity_id=0).pack()),
-                InlineKeyboardButton(text="اختلاف‌ها", callback_data=AdminAction(action="disputes", entity_id=0).pack()),
-            ],
-            [
-                InlineKeyboardButton(text="آمار امروز", callback_data=AdminAction(action="stats", entity_id=0).pack()),
-                InlineKeyboardButton(text="تنظیمات", callback_data=AdminAction(action="settings", entity_id=0).pack()),
-            ],
+class AdminPageAction(CallbackData, prefix="adminpage"):
+    """Acts on the pending payments shown on one queue page: ``after_id < id <= until_id``."""
+
+    action: str
+    after_id: int
+    until_id: int
+
+
+# Static markup is built once: packing callback data through pydantic is not free per message.
+_ADMIN_DASHBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="صف رسیدها", callback_data=AdminAction(action="payments", entity_id=0).pack()),
+            InlineKeyboardButton(text="اختلاف‌ها", callback_data=AdminAction(action="disputes", entity_id=0).pack()),
         ],
-    )
+        [
+            InlineKeyboardButton(text="آمار امروز", callback_data=AdminAction(action="stats", entity_id=0).pack()),
+            InlineKeyboardButton(text="تنظیمات", callback_data=AdminAction(action="settings", entity_id=0).pack()),
+        ],
+    ],
+)
 
 
-def admin_payment_review(payment_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
+def admin_dashboard_keyboard() -> InlineKeyboardMarkup:
+    return _ADMIN_DASHBOARD
+
+
+def admin_payment_queue(payment_ids: Iterable[int], after_id: int, next_after: Optional[int]) -> InlineKeyboardMarkup:
+    payment_ids = list(payment_ids)
+    rows = [
+        [
+            InlineKeyboardButton(text=f"✅ #{payment_id}", callback_data=AdminAction(action="approve_payment", entity_id=payment_id).pack()),
+            InlineKeyboardButton(text=f"❌ #{payment_id}", callback_data=AdminAction(action="reject_payment", entity_id=payment_id).pack()),
+        ]
+        for payment_id in payment_ids
+    ]
+    if payment_ids:
+        rows.append(
             [
-                InlineKeyboardButton(text="تأیید", callback_data=AdminAction(action="approve_payment", entity_id=payment_id).pack()),
-                InlineKeyboardButton(text="رد", callback_data=AdminAction(action="reject_payment", entity_id=payment_id).pack()),
+                InlineKeyboardButton(
+                    text="✅ تأیید همه رسیدهای این صفحه",
+                    callback_data=AdminPageAction(action="approve_page", after_id=after_id, until_id=payment_ids[-1]).pack(),
+                ),
             ],
-        ],
-    )
+        )
+    navigation = []
+    if after_id:
+        navigation.append(InlineKeyboardButton(text="« ابتدای صف", callback_data=AdminAction(action="payments_page", entity_id=0).pack()))
+    if next_after is not None:
+        navigation.append(
+            InlineKeyboardButton(text="صفحه بعد »", callback_data=AdminAction(action="payments_page", entity_id=next_after).pack()),
+        )
+    if navigation:
+        rows.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
 def admin_dispute_actions(dispute_id: int) -> InlineKeyboardMarkup:
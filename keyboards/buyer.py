@@ -1,28 +1,107 @@
 from __future__ import annotations
 
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Tuple
+
 from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
+from ..cache import TTLCache
+from ..config import settings
+from ..messages import fa
+from ..models import Listing
+from ..services.listing_catalog import ListingRecord
+
 
 class BrowseAction(CallbackData, prefix="browse"):
     action: str
     item_id: int
 
 
-def browse_listing_keyboard(listing_id: int) -> InlineKeyboardMarkup:
+class BrowseNext(CallbackData, prefix="browse_next"):
+    """The "next" button; carries the version of the card it sits on."""
+
+    item_id: int
+    version: int
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def listing_version(listing: Listing | ListingRecord) -> int:
+    """``updated_at`` in microseconds: changes with every edit that could change the card."""
+    return (listing.updated_at - _EPOCH) // timedelta(microseconds=1)
+
+
+def browse_listing_keyboard(listing: Listing | ListingRecord) -> InlineKeyboardMarkup:
+    next_page = BrowseNext(item_id=listing.id, version=listing_version(listing))
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
-                InlineKeyboardButton(text="رزرو", callback_data=BrowseAction(action="reserve", item_id=listing_id).pack()),
-                InlineKeyboardButton(text="بعدی", callback_data=BrowseAction(action="next", item_id=listing_id).pack()),
+                InlineKeyboardButton(text="رزرو", callback_data=BrowseAction(action="reserve", item_id=listing.id).pack()),
+                InlineKeyboardButton(text="بعدی", callback_data=next_page.pack()),
             ],
             [
-                InlineKeyboardButton(text="گزارش مشکل", callback_data=BrowseAction(action="report", item_id=listing_id).pack()),
+                InlineKeyboardButton(text="گزارش مشکل", callback_data=BrowseAction(action="report", item_id=listing.id).pack()),
             ],
         ],
     )
 
 
+@dataclass(frozen=True)
+class ListingCard:
+    text: str
+    reply_markup: InlineKeyboardMarkup
+
+
+# Keyed by (listing_id, updated_at): any edit to a listing bumps updated_at, so stale cards are never served.
+_listing_cards: TTLCache[Tuple[int, datetime], ListingCard] = TTLCache(
+    maxsize=settings.listing_card_cache_size,
+    ttl=settings.listing_card_cache_ttl_seconds,
+)
+
+
+def listing_card(listing: Listing | ListingRecord) -> ListingCard:
+    """Final browse text and keyboard for ``listing``, rendered once per listing version."""
+    key = (listing.id, listing.updated_at)
+    card = _listing_cards.get(key)
+    if card is None:
+        card = ListingCard(
+            text=fa.format_listing(
+                date=listing.date.isoformat(),
+                meal="ناهار" if listing.meal_type.value == "lunch" else "شام",
+                dish=listing.dish_name,
+                price=listing.price,
+                masked=listing.masked_code,
+            ),
+            reply_markup=browse_listing_keyboard(listing),
+        )
+        _listing_cards.set(key, card)
+    return card
+
+
+def waitlist_keyboard(listing_id: int, joined: bool) -> InlineKeyboardMarkup:
+    action, text = ("waitlist_leave", "خروج از صف انتظار") if joined else ("waitlist_join", "ورود به صف انتظار")
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text=text, callback_data=BrowseAction(action=action, item_id=listing_id).pack())]],
+    )
+
+
+class WatchAction(CallbackData, prefix="watch"):
+    action: str
+    watch_id: int
+
+
+def watch_list_keyboard(watch_ids: list[int]) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text=f"حذف هشدار #{watch_id}", callback_data=WatchAction(action="delete", watch_id=watch_id).pack())]
+            for watch_id in watch_ids
+        ],
+    )
+
+
 def reservation_actions(reservation_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -12,6 +12,8 @@ def pagination_keyboard(prev_callback: str | None, next_callback: str | None) ->
     return InlineKeyboardMarkup(inline_keyboard=[buttons] if buttons else [])
 
 
-def cancel_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="لغو")]], resize_keyboard=True, one_time_keyboard=True)
+_CANCEL_KEYBOARD = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="لغو")]], resize_keyboard=True, one_time_keyboard=True)
+
 
+def cancel_keyboard() -> ReplyKeyboardMarkup:
+    return _CANCEL_KEYBOARD
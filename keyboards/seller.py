@@ -13,15 +13,18 @@ class MealSelection(CallbackData, prefix="meal"):
     meal_type: str
 
 
-def meal_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="ناهار", callback_data=MealSelection(meal_type="lunch").pack()),
-                InlineKeyboardButton(text="شام", callback_data=MealSelection(meal_type="dinner").pack()),
-            ],
+_MEAL_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="ناهار", callback_data=MealSelection(meal_type="lunch").pack()),
+            InlineKeyboardButton(text="شام", callback_data=MealSelection(meal_type="dinner").pack()),
         ],
-    )
+    ],
+)
+
+
+def meal_keyboard() -> InlineKeyboardMarkup:
+    return _MEAL_KEYBOARD
 
 
 def seller_listing_actions(listing_id: int) -> InlineKeyboardMarkup:
@@ -10,7 +10,11 @@ HELP = (
     "دستورات در دسترس:\n"
     "/register — ثبت‌نام سریع\n"
     "/sell — فروش کُد\n"
-    "/buy — مرور آگهی‌ها\n"
+    "/sell_bulk — ثبت گروهی چند آگهی\n"
+    "/buy — مرور آگهی‌ها (با فیلتر: /buy meal=شام max=80000)\n"
+    "@نام‌ربات کباب — جستجوی غذا در هر چت\n"
+    "/watch — هشدار آگهی جدید\n"
+    "/watches — هشدارهای من\n"
     "/me — پروفایل\n"
     "/reservations — رزروهای فعال\n"
     "/report — ثبت اختلاف\n"
@@ -50,15 +54,60 @@ SELL_CODE_PROMPT = "کد کامل غذا را وارد کن. این کد بعد
 SELL_CONFIRM_TEXT = "همه چیز درسته؟ تایید کن تا آگهی منتشر شود."
 SELL_CREATED = "آگهی با موفقیت منتشر شد. کد کامل فقط بعد از تایید پرداخت نمایش داده می‌شود."
 SELL_LIMIT_REACHED = "سقف آگهی فعال روزانه را رد کرده‌ای. فردا دوباره تلاش کن."
+SELL_CODE_DUPLICATE = "این کد قبلاً در یک آگهی دیگر ثبت شده است."
+SELL_BULK_INTRO = (
+    "آگهی‌ها را هر کدام در یک خط به این شکل بفرست (یا همین را به صورت فایل CSV):\n"
+    "تاریخ,وعده,غذا,قیمت,کد\n"
+    "مثال: 2024-05-01,ناهار,خورشت قیمه,50000,ABCD1234\n"
+    "حداکثر {max_rows} ردیف. برای انصراف /cancel بزن."
+)
+SELL_BULK_TOO_MANY = "حداکثر {max_rows} ردیف در هر بار مجاز است."
+SELL_BULK_EMPTY = "ردیفی پیدا نشد. طبق نمونه بفرست یا /cancel بزن."
+SELL_BULK_BAD_FILE = "فایل باید CSV با کدگذاری UTF-8 و کوچک‌تر از ۲۵۶ کیلوبایت باشد."
+SELL_BULK_ROW_OK = "ردیف {line}: ✅ آگهی #{listing_id}"
+SELL_BULK_ROW_FAILED = "ردیف {line}: ❌ {error}"
+SELL_BULK_SUMMARY = "{created} آگهی منتشر شد، {failed} ردیف ناموفق."
+SELL_CANCELLED = "ثبت آگهی لغو شد."
 
 LISTING_SUMMARY = "📅 {date} | 🍽️ {meal} | 🍛 {dish} | 💰 {price} تومان | 🔒 {masked}"
 NO_LISTINGS = "هیچ آگهی فعالی پیدا نشد. بعداً دوباره امتحان کن."
+BROWSE_FILTER_HELP = (
+    "فیلترهای /buy اختیاری‌اند و به شکل کلید=مقدار نوشته می‌شوند:\n"
+    "meal=ناهار|شام  date=week یا YYYY-MM-DD..YYYY-MM-DD  max=80000\n"
+    "uni=نام‌دانشگاه  rating=4  sort=date|price"
+)
+BROWSE_FILTER_LAPSED = "بازهٔ تاریخ فیلترت گذشته است. برای ادامه دوباره /buy را با فیلتر تازه بزن."
+LISTING_UNAVAILABLE = "این آگهی دیگر فعال نیست. با /buy آگهی‌های دیگر را ببین."
+SEARCH_RESULT_DESCRIPTION = "📅 {date} | 🍽️ {meal} | 💰 {price} تومان"
+SEARCH_OPEN_BUTTON = "مشاهده و رزرو"
+
+WATCH_HELP = (
+    "هر وقت آگهی مطابق شرط‌هایت منتشر شود خبرت می‌کنیم. نمونه‌ها:\n"
+    "/watch meal=شام date=2026-10-20 max=80000\n"
+    "/watch meal=ناهار date=week\n"
+    "/watch dish=کباب\n"
+    "تاریخ می‌تواند یک روز، بازهٔ YYYY-MM-DD..YYYY-MM-DD یا week باشد."
+)
+WATCH_CREATED = "هشدار #{watch_id} ثبت شد."
+WATCH_LIMIT = "به سقف هشدارهای فعال رسیده‌ای. یکی را از /watches حذف کن."
+WATCH_LIST_HEADER = "هشدارهای فعال تو:"
+WATCH_NONE = "هشدار فعالی نداری. با /watch یکی بساز."
+WATCH_DELETED = "هشدار حذف شد."
+WATCH_MATCH = "🔔 آگهی تازه مطابق هشدارت:\n{listings}\nبرای رزرو /buy را بزن."
+WATCH_MATCH_MORE = "و {count} آگهی دیگر"
 
 RESERVE_CONFIRM = "آیا این آگهی را برای {minutes} دقیقه رزرو می‌کنی؟"
 RESERVE_DONE = "آگهی رزرو شد. تا {until} فرصت داری رسید پرداخت را بفرستی."
 RESERVE_LIMIT = "به سقف رزروهای همزمان رسیده‌ای. ابتدا رزرو قبلی را تعیین تکلیف کن."
 RESERVE_ALREADY = "برای این آگهی رزرو فعال داری."
 RESERVE_EXPIRED_NOTICE = "رزرو آگهی تمام شد و دوباره فعال شد."
+WAITLIST_JOINED = "در صف انتظار این آگهی قرار گرفتی (نفر {position}). اگر رزرو فعلی آزاد شود، خودکار برایت رزرو می‌شود."
+WAITLIST_LEFT = "از صف انتظار خارج شدی."
+WAITLIST_OFFER = "این آگهی الان رزرو شده است. می‌خواهی در صف انتظارش بمانی؟"
+WAITLIST_HANDOFF = (
+    "🎉 نوبتت رسید! آگهی «{dish}» که در صف انتظارش بودی برایت رزرو شد. "
+    "تا {until} فرصت داری رسید پرداخت را بفرستی؛ از /reservations استفاده کن."
+)
 RESERVE_EXPIRY_WARNING = "⏰ سه دقیقه تا پایان رزرو باقی مانده."
 
 PAYMENT_PROMPT = "نوع پرداخت را بنویس (مثلاً «کارت‌به‌کارت»)."
@@ -82,13 +131,16 @@ DISPUTE_SUBMITTED = "اختلاف ثبت شد. ادمین به‌زودی برر
 
 ADMIN_DASHBOARD_HEADER = "ادمین عزیز خوش اومدی. از منو یکی از بخش‌ها را انتخاب کن."
 ADMIN_PAYMENT_QUEUE_HEADER = "صف رسیدها ({count} مورد)"
+ADMIN_BULK_APPROVED = "{approved} رسید تأیید شد و کدها در صف ارسال قرار گرفتند. ناموفق: {failed}"
 ADMIN_DISPUTE_QUEUE_HEADER = "اختلاف‌های باز ({count} مورد)"
 ADMIN_STATS = "آمار امروز:\nکل فروش: {sales}\nتعداد رزرو: {reservations}\nپرداخت تایید شده: {approved}"
+ADMIN_THROTTLE_STATS = "درخواست‌های محدودشده از ابتدای اجرا: {messages} پیام، {callbacks} دکمه"
 ADMIN_NOTES_SAVED = "یادداشت ذخیره شد."
 
 USER_BANNED = "حساب شما مسدود است. برای پیگیری با ادمین تماس بگیر."
 REGISTRATION_DISABLED = "ثبت‌نام موقتاً غیرفعال است."
 
+THROTTLED = "کمی آهسته‌تر! چند لحظه بعد دوباره امتحان کن."
 ERROR_GENERIC = "مشکلی پیش آمد. دوباره تلاش کن یا با ادمین هماهنگ شو."
 ERROR_NOT_AUTH = "ابتدا باید ثبت‌نام کنی."
 
@@ -1,20 +1,55 @@
 from __future__ import annotations
 
 import asyncio
-import time
-from collections import defaultdict
-from typing import Callable, Dict, Optional
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict
 
 from aiogram import BaseMiddleware
-from aiogram.types import Message, TelegramObject
+from aiogram.types import CallbackQuery, TelegramObject, User
+
+from ..messages import fa
+from ..ratelimit import BatchingLimiter, Limit, global_limit, rate_limiter, user_limit
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ThrottleStats:
+    allowed: int = 0
+    throttled_messages: int = 0
+    throttled_callbacks: int = 0
+
+    @property
+    def throttled(self) -> int:
+        return self.throttled_messages + self.throttled_callbacks
+
+
+# Process-wide counters, shown to admins next to the daily stats.
+throttle_stats = ThrottleStats()
 
 
 class ThrottlingMiddleware(BaseMiddleware):
-    def __init__(self, rate: float = 0.5) -> None:
+    """Per-user token bucket, plus an optional global one, over messages and callback queries.
+
+    Excess updates are dropped on the spot instead of being delayed, so a flooding user never
+    parks coroutines; callback queries get a short toast so the button's spinner stops.
+    Buckets live in the ``THROTTLE_BACKEND`` chosen for :data:`rate_limiter`, so workers sharing a
+    backend share each user's budget. Register the same instance on every observer.
+    """
+
+    def __init__(
+        self,
+        limiter: BatchingLimiter = rate_limiter,
+        per_user: Limit = user_limit,
+        overall: Limit | None = global_limit,
+        stats: ThrottleStats = throttle_stats,
+    ) -> None:
         super().__init__()
-        self.rate = rate
-        self._locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
-        self._last_call: Dict[int, float] = {}
+        self._limiter = limiter
+        self._per_user = per_user
+        self._overall = overall
+        self.stats = stats
 
     async def __call__(
         self,
@@ -22,22 +57,20 @@ class ThrottlingMiddleware(BaseMiddleware):
         event: TelegramObject,
         data: Dict[str, object],
     ) -> object:
-        user_id = self._extract_user_id(event)
-        if user_id is None:
+        user = data.get("event_from_user")
+        if not isinstance(user, User):
+            return await handler(event, data)
+        claim = ((f"user:{user.id}", self._per_user),)
+        if self._overall is not None:
+            claim += (("global", self._overall),)
+        if await self._limiter.acquire(claim):
+            self.stats.allowed += 1
             return await handler(event, data)
 
-        async with self._locks[user_id]:
-            now = time.monotonic()
-            last = self._last_call.get(user_id, 0.0)
-            delta = now - last
-            if delta < self.rate:
-                await asyncio.sleep(self.rate - delta)
-            self._last_call[user_id] = time.monotonic()
-        return await handler(event, data)
-
-    @staticmethod
-    def _extract_user_id(event: TelegramObject) -> Optional[int]:
-        if isinstance(event, Message) and event.from_user:
-            return event.from_user.id
+        if isinstance(event, CallbackQuery):
+            self.stats.throttled_callbacks += 1
+            await event.answer(fa.THROTTLED)
+        else:
+            self.stats.throttled_messages += 1
+        logger.debug("Throttled update from user %s", user.id)
         return None
-
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from ..db import session_scope
+from ..services.user_service import get_user_snapshot, user_cache
+
+
+class CurrentUserMiddleware(BaseMiddleware):
+    """Resolves the caller once per update and exposes it as ``current_user``."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, object]], asyncio.Future],
+        event: TelegramObject,
+        data: Dict[str, object],
+    ) -> object:
+        tg_user = data.get("event_from_user")
+        snapshot = None
+        if isinstance(tg_user, User):
+            snapshot = user_cache.get(tg_user.id)
+            if snapshot is None:
+                async with session_scope() as session:
+                    snapshot = await get_user_snapshot(session, tg_user.id)
+        data["current_user"] = snapshot
+        return await handler(event, data)
@@ -18,6 +18,7 @@ from sqlalchemy import (
     String,
     Text,
     UniqueConstraint,
+    text,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -52,6 +53,13 @@ class PaymentStatus(str, enum.Enum):
     rejected = "rejected"
 
 
+class OutboxStatus(str, enum.Enum):
+    pending = "pending"
+    sending = "sending"
+    sent = "sent"
+    failed = "failed"
+
+
 class DisputeStatus(str, enum.Enum):
     open = "open"
     in_review = "in_review"
@@ -81,6 +89,9 @@ class User(Base):
 
     __table_args__ = (
         Index("idx_users_is_seller_account_created_at", "is_seller_account", "created_at"),
+        # Browse filters by seller university and/or minimum rating.
+        Index("idx_users_uni_rating", "uni", "rating_avg"),
+        Index("idx_users_rating_avg", "rating_avg"),
     )
 
 
@@ -104,12 +115,38 @@ class Listing(Base):
     reservations: Mapped[List["Reservation"]] = relationship(back_populates="listing", cascade="all, delete-orphan")
 
     __table_args__ = (
-        Index("idx_listings_status_date_meal", "status", "date", "meal_type"),
-        Index("idx_listings_seller_id", "seller_id"),
+        Index("idx_listings_status_date_meal_created", "status", "date", "meal_type", "created_at", "id"),
+        Index("idx_listings_status_meal_date_created", "status", "meal_type", "date", "created_at", "id"),
+        Index("idx_listings_status_price_date", "status", "price", "date", "meal_type", "created_at", "id"),
+        # Seller-driven plans: probe the listings of a few matching sellers in date order.
+        Index("idx_listings_seller_status_date", "seller_id", "status", "date"),
+        Index("idx_listings_status_expires_at", "status", "expires_at"),
+        # Catalog sync in each worker process reads what changed since its last pass.
+        Index("idx_listings_updated_at", "updated_at"),
         CheckConstraint("price >= 0", name="ck_listing_price_positive"),
     )
 
 
+class ListingCodeHash(Base):
+    __tablename__ = "listing_code_hashes"
+
+    listing_id: Mapped[int] = mapped_column(ForeignKey("listings.id"), primary_key=True)
+    code_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    # Cleared once the listing expires or is cancelled, which frees its code to be listed again.
+    claimed: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
+
+    __table_args__ = (
+        Index("idx_listing_code_hashes_code_hash", "code_hash"),
+        Index(
+            "uq_listing_code_hashes_claimed",
+            "code_hash",
+            unique=True,
+            sqlite_where=text("claimed"),
+            postgresql_where=text("claimed"),
+        ),
+    )
+
+
 class Reservation(Base):
     __tablename__ = "reservations"
 
@@ -133,9 +170,17 @@ class Reservation(Base):
     __table_args__ = (
         Index("idx_reservations_listing_status", "listing_id", "status"),
         Index("idx_reservations_buyer_status", "buyer_id", "status"),
+        Index("idx_reservations_status_reserved_until", "status", "reserved_until"),
     )
 
 
+class ReservationWarning(Base):
+    __tablename__ = "reservation_warnings"
+
+    reservation_id: Mapped[int] = mapped_column(ForeignKey("reservations.id"), primary_key=True)
+    sent_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
 class Payment(Base):
     __tablename__ = "payments"
 
@@ -150,7 +195,7 @@ class Payment(Base):
     reservation: Mapped["Reservation"] = relationship("Reservation", back_populates="payment")
 
     __table_args__ = (
-        Index("idx_payments_status", "status"),
+        Index("idx_payments_status_id", "status", "id"),
     )
 
 
@@ -190,3 +235,100 @@ class Dispute(Base):
     __table_args__ = (
         Index("idx_disputes_status", "status"),
     )
+
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox_messages"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    chat_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    text: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    text_enc: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    status: Mapped[OutboxStatus] = mapped_column(Enum(OutboxStatus), default=OutboxStatus.pending, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("idx_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class JobCheckpoint(Base):
+    __tablename__ = "job_checkpoints"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    position: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class Lease(Base):
+    """A named lease: ``holder`` owns it until ``expires_at`` unless it renews first."""
+
+    __tablename__ = "leases"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    holder: Mapped[str] = mapped_column(String(128), nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class Watch(Base):
+    __tablename__ = "watches"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    date_from: Mapped[date] = mapped_column(Date, nullable=False)
+    date_to: Mapped[date] = mapped_column(Date, nullable=False)
+    meal_type: Mapped[Optional[MealType]] = mapped_column(Enum(MealType), nullable=True)
+    max_price: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    dish_query: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # Matching is a range probe on (date_to, date_from); meal and price are checked from the index.
+        Index("idx_watches_dates_meal_price", "date_to", "date_from", "meal_type", "max_price"),
+        Index("idx_watches_user_id", "user_id"),
+    )
+
+
+class WatchNotification(Base):
+    """A watch already told about a listing while it is on the market; cleared when it goes back on sale."""
+
+    __tablename__ = "watch_notifications"
+
+    watch_id: Mapped[int] = mapped_column(ForeignKey("watches.id"), primary_key=True)
+    listing_id: Mapped[int] = mapped_column(ForeignKey("listings.id"), primary_key=True)
+    notified_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class WaitlistEntry(Base):
+    __tablename__ = "waitlist_entries"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    listing_id: Mapped[int] = mapped_column(ForeignKey("listings.id"), nullable=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("listing_id", "user_id", name="uq_waitlist_listing_user"),
+        # FIFO order within a listing is the autoincrement id.
+        Index("idx_waitlist_listing_id_id", "listing_id", "id"),
+    )
+
+
+class FsmRecord(Base):
+    """Persisted aiogram FSM state; ``data_enc`` is the Fernet-encrypted JSON of the state data."""
+
+    __tablename__ = "fsm_records"
+
+    key: Mapped[str] = mapped_column(String(160), primary_key=True)
+    state: Mapped[Optional[str]] = mapped_column(String(120), nullable=True)
+    data_enc: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("idx_fsm_records_updated_at", "updated_at"),
+    )
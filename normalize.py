@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import re
+import unicodedata
+
+# Persian (۰-۹) and Arabic-Indic (٠-٩) digits map to ASCII.
+_DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+_CODE_NOISE = re.compile(r"[\s\-_.]+")
+
+
+def normalize_code(code: str) -> str:
+    """Canonical form of a food code: NFKC, ASCII digits, no separators, upper case."""
+    code = unicodedata.normalize("NFKC", code).translate(_DIGITS)
+    return _CODE_NOISE.sub("", code).upper()
+
+
+# Arabic letter forms that Persian keyboards and OCR mix in, mapped to their Persian equivalents.
+_PERSIAN_LETTERS = str.maketrans({"ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه", "أ": "ا", "إ": "ا", "ٱ": "ا"})
+# Harakat, tatweel and zero-width characters carry no meaning for matching.
+_TEXT_NOISE = re.compile("[\u064b-\u065f\u0670\u0640\u200b-\u200f\ufeff]")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Folds Persian free text for matching: unified letters and digits, no diacritics, single spaces."""
+    text = unicodedata.normalize("NFKC", text).translate(_PERSIAN_LETTERS).translate(_DIGITS)
+    text = _TEXT_NOISE.sub("", text)
+    return _SPACES.sub(" ", text).strip().lower()
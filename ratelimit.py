@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, List, Optional, Protocol, Sequence, Tuple
+
+from .cache import TTLCache
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Refills ``rate`` tokens per second up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+
+class KeyedTokenBuckets:
+    """One :class:`TokenBucket` per key, held in a bounded LRU.
+
+    A bucket idle for ``capacity / rate`` seconds would be full again, so it expires then and a
+    returning key simply starts with a fresh one; memory is bounded by ``maxsize`` either way.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        maxsize: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._buckets: TTLCache[Hashable, TokenBucket] = TTLCache(maxsize=maxsize, ttl=capacity / rate, clock=clock)
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity, clock=self._clock)
+        # Re-setting refreshes the idle deadline as well as the LRU position.
+        self._buckets.set(key, bucket)
+        return bucket
+
+    def try_acquire(self, key: Hashable, tokens: float = 1.0) -> bool:
+        return self.bucket(key).try_acquire(tokens)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+@dataclass(frozen=True)
+class Limit:
+    rate: float
+    capacity: float
+
+    @property
+    def idle_ttl(self) -> float:
+        """Seconds after which an untouched bucket is full again and can be forgotten."""
+        return self.capacity / self.rate
+
+
+# Buckets that must each yield one token for a request to pass; none is charged unless all can pay.
+Claim = Tuple[Tuple[str, Limit], ...]
+
+
+class LimiterBackend(Protocol):
+    async def acquire_many(self, claims: Sequence[Claim]) -> List[bool]: ...
+
+    async def close(self) -> None: ...
+
+
+class MemoryLimiterBackend:
+    """Buckets in this process only; the default for a single worker."""
+
+    def __init__(self, maxsize: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self._maxsize = maxsize
+        self._clock = clock
+        self._groups: Dict[Limit, KeyedTokenBuckets] = {}
+
+    def _bucket(self, key: str, limit: Limit) -> TokenBucket:
+        group = self._groups.get(limit)
+        if group is None:
+            group = self._groups[limit] = KeyedTokenBuckets(limit.rate, limit.capacity, self._maxsize, clock=self._clock)
+        return group.bucket(key)
+
+    def acquire_now(self, claim: Claim) -> bool:
+        buckets = [self._bucket(key, limit) for key, limit in claim]
+        if any(bucket.delay() > 0 for bucket in buckets):
+            return False
+        for bucket in buckets:
+            bucket.try_acquire()
+        return True
+
+    async def acquire_many(self, claims: Sequence[Claim]) -> List[bool]:
+        return [self.acquire_now(claim) for claim in claims]
+
+    async def close(self) -> None:
+        self._groups.clear()
+
+
+class SqliteLimiterBackend:
+    """Buckets in a SQLite file shared by every worker on the host.
+
+    The file runs in WAL mode, and each batch is one ``BEGIN IMMEDIATE`` transaction, so refill and
+    spend are atomic across processes. It lives apart from the main database so throttling writes
+    never contend with business transactions. Calls run on one dedicated thread.
+    """
+
+    # Idle rows are swept at most this often.
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time) -> None:
+        self._path = path
+        self._clock = clock
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ratelimit")
+        self._next_sweep = 0.0
+        self._max_idle = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path, isolation_level=None, check_same_thread=False, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID",
+        )
+        return conn
+
+    def _acquire_sync(self, claims: Sequence[Claim]) -> List[bool]:
+        if self._conn is None:
+            self._conn = self._connect()
+        conn = self._conn
+        keys = list({key for claim in claims for key, _ in claim})
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = self._clock()
+            rows = conn.execute(
+                f"SELECT key, tokens, updated FROM rate_buckets WHERE key IN ({', '.join('?' * len(keys))})",
+                keys,
+            ).fetchall()
+            state: Dict[str, Tuple[float, float]] = {key: (tokens, updated) for key, tokens, updated in rows}
+            results = []
+            for claim in claims:
+                levels = []
+                for key, limit in claim:
+                    tokens, updated = state.get(key, (limit.capacity, now))
+                    levels.append((key, min(limit.capacity, tokens + max(0.0, now - updated) * limit.rate)))
+                    self._max_idle = max(self._max_idle, limit.idle_ttl)
+                allowed = all(level >= 1 for _, level in levels)
+                for key, level in levels:
+                    state[key] = (level - 1 if allowed else level, now)
+                results.append(allowed)
+            conn.executemany(
+                "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                [(key, *state[key]) for key in keys],
+            )
+            if now >= self._next_sweep:
+                conn.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - self._max_idle,))
+                self._next_sweep = now + self.SWEEP_INTERVAL
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return results
+
+    async def acquire_many(self, claims: Sequence[Claim]) -> List[bool]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._acquire_sync, claims)
+
+    async def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, conn.close)
+        self._executor.shutdown(wait=False)
+
+
+_REDIS_CLAIM = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local allowed = 1
+for i, key in ipairs(KEYS) do
+    local rate, capacity = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    local bucket = redis.call('HMGET', key, 't', 'u')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    levels[i] = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    if levels[i] < 1 then allowed = 0 end
+end
+for i, key in ipairs(KEYS) do
+    local rate, capacity = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    redis.call('HSET', key, 't', levels[i] - allowed, 'u', now)
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000))
+end
+return allowed
+"""
+
+
+class RedisLimiterBackend:
+    """Buckets in Redis or any server speaking its protocol, for workers spread over several hosts.
+
+    Each claim is one Lua script call, so checking and spending is atomic. A batch goes out as a
+    single pipeline round trip. Requires the optional ``redis`` package.
+    """
+
+    KEY_PREFIX = "throttle:"
+
+    def __init__(self, url: str, clock: Callable[[], float] = time.time) -> None:
+        self._url = url
+        self._clock = clock
+        self._client = None
+        self._script = None
+
+    def _connect(self) -> None:
+        try:
+            from redis import asyncio as redis_asyncio  # noqa: WPS433 - optional dependency
+        except ImportError as exc:  # pragma: no cover - depends on the deployment
+            raise RuntimeError("THROTTLE_BACKEND=redis requires the 'redis' package") from exc
+        self._client = redis_asyncio.from_url(self._url)
+        self._script = self._client.register_script(_REDIS_CLAIM)
+
+    async def acquire_many(self, claims: Sequence[Claim]) -> List[bool]:
+        if self._client is None:
+            self._connect()
+        now = self._clock()
+        async with self._client.pipeline(transaction=False) as pipe:
+            for claim in claims:
+                args: List[float] = [now]
+                for _, limit in claim:
+                    args.extend((limit.rate, limit.capacity))
+                await self._script(keys=[self.KEY_PREFIX + key for key, _ in claim], args=args, client=pipe)
+            results = await pipe.execute()
+        return [bool(int(result)) for result in results]
+
+    async def close(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+
+class BatchingLimiter:
+    """Coalesces concurrent checks into one backend call per round trip.
+
+    Checks arriving while a call is in flight are sent together in the next one, so shared
+    backends cost one transaction or pipeline per batch rather than one per update. A backend
+    failure lets the batch through: throttling must never take the bot down with it.
+    """
+
+    def __init__(self, backend: LimiterBackend, max_batch: int = 256) -> None:
+        self.backend = backend
+        self._max_batch = max_batch
+        self._pending: List[Tuple[Claim, asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def acquire(self, claim: Claim) -> bool:
+        if isinstance(self.backend, MemoryLimiterBackend):
+            # Nothing to amortise in-process; answer inline.
+            return self.backend.acquire_now(claim)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((claim, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self) -> None:
+        while self._pending:
+            batch, self._pending = self._pending[:self._max_batch], self._pending[self._max_batch:]
+            try:
+                results = await self.backend.acquire_many([claim for claim, _ in batch])
+            except Exception:  # noqa: BLE001 - fail open, see class docstring
+                logger.warning("Rate limiter backend failed; letting %s updates through", len(batch), exc_info=True)
+                results = [True] * len(batch)
+            for (_, future), allowed in zip(batch, results):
+                if not future.done():
+                    future.set_result(allowed)
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.backend.close()
+
+
+def build_limiter_backend(kind: str) -> LimiterBackend:
+    if kind == "memory":
+        return MemoryLimiterBackend(maxsize=settings.throttle_max_users)
+    if kind == "sqlite":
+        return SqliteLimiterBackend(settings.throttle_sqlite_path)
+    if kind == "redis":
+        return RedisLimiterBackend(settings.throttle_redis_url)
+    raise ValueError(f"Unknown THROTTLE_BACKEND {kind!r}; expected memory, sqlite or redis")
+
+
+rate_limiter = BatchingLimiter(build_limiter_backend(settings.throttle_backend))
+user_limit = Limit(rate=settings.throttle_rate, capacity=settings.throttle_burst)
+# Caps what all users together can push at the handlers (and so the database); 0 disables it.
+global_limit = (
+    Limit(rate=settings.throttle_global_rate, capacity=settings.throttle_global_burst)
+    if settings.throttle_global_rate > 0
+    else None
+)
+
+# Telegram allows roughly 30 messages per second per bot across all chats.
+telegram_send_bucket = TokenBucket(rate=settings.telegram_send_rate, capacity=settings.telegram_send_rate)
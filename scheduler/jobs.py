@@ -1,64 +1,204 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 from datetime import datetime
+from typing import Optional, Set
 
 from aiogram import Bot
+from apscheduler.executors.asyncio import AsyncIOExecutor
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from sqlalchemy import select
 
-from ..db import AsyncSessionMaker
-from ..messages import fa
-from ..models import Listing, ListingStatus, Reservation, ReservationStatus
-from ..services import reservation_service
+from ..config import settings
+from ..crypto import cipher
+from ..db import AsyncSessionMaker, session_scope
+from ..services import code_index, key_rotation, listing_service, reservation_service, watch_service
+from ..services.fsm_store import fsm_store
+from ..services.listing_catalog import catalog
+from ..services.reservation_deadlines import load_pending_deadlines, reservation_deadlines
 
 logger = logging.getLogger(__name__)
 
 
 async def expire_reservations_job(bot: Bot) -> None:
-    async with AsyncSessionMaker() as session:
-        expired_count = await reservation_service.expire_overdue_reservations(session)
-        await session.commit()
-        if expired_count:
-            logger.info("Expired %s reservations via scheduler", expired_count)
+    chunk_size = settings.expiry_chunk_size
+    while True:
+        async with AsyncSessionMaker() as session:
+            report = await reservation_service.expire_overdue_reservations(session, limit=chunk_size)
+            await session.commit()
+        if report.count:
+            logger.info(
+                "Expired reservations %s via scheduler, reactivated listings %s",
+                report.reservation_ids,
+                report.reactivated_listing_ids,
+            )
+        if report.count < chunk_size:
+            break
 
 
-async def expire_listings_job() -> None:
-    async with AsyncSessionMaker() as session:
-        now = datetime.utcnow()
-        stmt = select(Listing).where(
-            Listing.status == ListingStatus.active,
-            Listing.expires_at.is_not(None),
-            Listing.expires_at < now,
+async def expire_due_reservations(reservation_ids: list[int]) -> None:
+    async with session_scope() as session:
+        report = await reservation_service.expire_reservations(session, reservation_ids)
+    if report.count:
+        logger.info(
+            "Expired reservations %s at their deadline, reactivated listings %s",
+            report.reservation_ids,
+            report.reactivated_listing_ids,
         )
-        result = await session.execute(stmt)
-        listings = result.scalars().all()
-        for listing in listings:
-            listing.status = ListingStatus.expired
-        if listings:
-            logger.info("Expired %s listings", len(listings))
-        await session.commit()
+
+
+def start_reservation_deadlines() -> None:
+    """Fires the deadlines of reservations this process commits; every process runs it.
+
+    The heap is fed by commit hooks, which only fire in the process that made the change, so
+    the leader could not see the other workers' deadlines. Expiry is compare-and-set, so a
+    deadline fired twice is harmless.
+    """
+    reservation_deadlines.start(expire_due_reservations)
+
+
+async def load_reservation_deadlines() -> None:
+    """Adopts every pending deadline, including those of processes that have since exited; leader only."""
+    async with session_scope() as session:
+        pending = await load_pending_deadlines(session)
+    # Merged rather than replacing the heap, so deadlines committed meanwhile are kept.
+    for reservation_id, deadline in pending:
+        reservation_deadlines.schedule(reservation_id, deadline)
+    logger.info("Tracking %s reservation deadlines", len(reservation_deadlines))
+
+
+async def expire_listings_job() -> None:
+    chunk_size = settings.expiry_chunk_size
+    while True:
+        async with AsyncSessionMaker() as session:
+            expired_ids = await listing_service.expire_stale_listings(session, limit=chunk_size)
+            await session.commit()
+        if expired_ids:
+            logger.info("Expired %s listings", len(expired_ids))
+        if len(expired_ids) < chunk_size:
+            break
+    async with session_scope() as session:
+        pruned = await watch_service.prune_expired_watches(session)
+    if pruned:
+        logger.info("Pruned %s expired watches", pruned)
 
 
 async def reservation_warning_job(bot: Bot) -> None:
-    async with AsyncSessionMaker() as session:
-        reservations = await reservation_service.reservations_about_to_expire(session)
-        for reservation in reservations:
-            if reservation.status != ReservationStatus.pending:
-                continue
-            buyer = reservation.buyer
-            if buyer and buyer.tg_id:
-                await bot.send_message(buyer.tg_id, fa.RESERVE_EXPIRY_WARNING)
-        if reservations:
-            logger.debug("Sent %s reservation warnings", len(reservations))
-
-
-def setup_scheduler(bot: Bot) -> AsyncIOScheduler:
+    async with session_scope() as session:
+        warnings = await reservation_service.queue_expiry_warnings(session)
+    if warnings:
+        logger.debug("Queued reservation warnings for %s reservations", len(warnings))
+
+
+async def reencrypt_codes_job() -> None:
+    """Moves every encrypted column onto the newest key in small, paced transactions; resumes where it stopped."""
+    if cipher.key_count < 2:
+        return
+    async with session_scope() as session:
+        if await key_rotation.rotation_complete(session):
+            return
+    total = 0
+    for column in key_rotation.ENCRYPTED_COLUMNS:
+        after = None
+        while True:
+            async with session_scope() as session:
+                rotated, after = await key_rotation.reencrypt_chunk(
+                    session,
+                    column,
+                    settings.reencrypt_chunk_size,
+                    after=after,
+                )
+            if not rotated:
+                break
+            total += rotated
+            await asyncio.sleep(settings.reencrypt_pause_seconds)
+    if total:
+        logger.info("Re-encrypted %s tokens", total)
+    async with session_scope() as session:
+        if await key_rotation.rotation_complete(session):
+            logger.info("Key rotation to %s complete; older keys can be dropped", cipher.primary_key_id)
+
+
+async def backfill_code_index_job() -> None:
+    """Indexes codes of listings created before the duplicate-code index existed."""
+    total = 0
+    while True:
+        async with session_scope() as session:
+            indexed = await code_index.backfill_code_hashes_chunk(session, settings.reencrypt_chunk_size)
+        if not indexed:
+            break
+        total += indexed
+        await asyncio.sleep(settings.reencrypt_pause_seconds)
+    if total:
+        logger.info("Checked %s listings for the code index", total)
+
+
+async def fsm_gc_job() -> None:
+    """Deletes conversations abandoned for longer than ``FSM_TTL_HOURS``; they may hold plaintext codes."""
+    removed = await fsm_store.collect_garbage()
+    if removed:
+        logger.info("Removed %s abandoned FSM conversations", removed)
+
+
+async def fsm_hot_purge_job() -> None:
+    """Drops this process's expired FSM hot entries, which may hold plaintext codes, instead of waiting for eviction."""
+    purged = fsm_store.purge_hot()
+    if purged:
+        logger.debug("Purged %s expired FSM cache entries", purged)
+
+
+async def sync_catalog_job() -> None:
+    """Pulls listing changes committed by other processes into this process's catalog."""
+    async with session_scope() as session:
+        changed = await catalog.sync(session)
+    if changed:
+        logger.debug("Catalog sync applied %s listing changes", changed)
+
+
+def setup_worker_scheduler() -> AsyncIOScheduler:
+    """Jobs every process runs for itself, whether or not it leads."""
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(expire_reservations_job, IntervalTrigger(minutes=1), kwargs={"bot": bot})
+    scheduler.add_job(sync_catalog_job, IntervalTrigger(seconds=settings.catalog_sync_seconds), max_instances=1)
+    scheduler.add_job(fsm_hot_purge_job, IntervalTrigger(seconds=settings.fsm_cache_ttl_seconds))
+    scheduler.start()
+    return scheduler
+
+
+class DrainingExecutor(AsyncIOExecutor):
+    """Cancels running jobs on shutdown like its parent, and lets the caller await their end.
+
+    ``shutdown`` cannot wait for coroutines itself, so a demoted leader awaits :meth:`drain`
+    to be sure its jobs are over before another process's scheduler starts the same ones.
+    """
+
+    def start(self, scheduler, alias) -> None:
+        super().start(scheduler, alias)
+        self._stopping: Set[asyncio.Future] = set()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._stopping = {future for future in self._pending_futures if not future.done()}
+        super().shutdown(wait)
+
+    async def drain(self) -> None:
+        await asyncio.gather(*self._stopping, return_exceptions=True)
+        self._stopping = set()
+
+
+def setup_scheduler(bot: Bot, executor: Optional[DrainingExecutor] = None) -> AsyncIOScheduler:
+    """Database-wide jobs; started only in the process holding the scheduler lease."""
+    scheduler = AsyncIOScheduler(executors={"default": executor or DrainingExecutor()})
+    # Deadlines fire from reservation_deadlines; this sweep only catches what it missed.
+    scheduler.add_job(
+        expire_reservations_job,
+        IntervalTrigger(minutes=settings.reservation_sweep_minutes),
+        kwargs={"bot": bot},
+    )
     scheduler.add_job(expire_listings_job, IntervalTrigger(minutes=5))
     scheduler.add_job(reservation_warning_job, IntervalTrigger(minutes=1), kwargs={"bot": bot})
+    scheduler.add_job(reencrypt_codes_job, IntervalTrigger(hours=1), next_run_time=datetime.now())
+    scheduler.add_job(backfill_code_index_job, IntervalTrigger(hours=1), next_run_time=datetime.now())
+    scheduler.add_job(fsm_gc_job, IntervalTrigger(minutes=30))
     scheduler.start()
     return scheduler
 
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import logging
+from typing import Optional
+
+from aiogram import Bot
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from .jobs import DrainingExecutor, load_reservation_deadlines, setup_scheduler
+from .outbox import start_outbox_sender, stop_outbox_sender
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderDuties:
+    """The scheduled jobs and the outbox sender, which must run in exactly one process.
+
+    Several outbox senders would be safe thanks to leasing, but each keeps its own Telegram
+    send bucket, so together they would exceed the bot-wide send rate. On election the leader
+    also adopts every pending reservation deadline, including those of workers that exited.
+    """
+
+    def __init__(self, bot: Bot) -> None:
+        self.bot = bot
+        self._scheduler: Optional[AsyncIOScheduler] = None
+        self._executor = DrainingExecutor()
+
+    async def start(self) -> None:
+        if self._scheduler is None:
+            self._scheduler = setup_scheduler(self.bot, self._executor)
+            start_outbox_sender(self.bot)
+            await load_reservation_deadlines()
+            logger.info("Scheduler and outbox sender started")
+
+    async def stop(self) -> None:
+        if self._scheduler is not None:
+            self._scheduler.shutdown(wait=False)
+            self._scheduler = None
+            # Running jobs were cancelled; the lease is handed on only once they have unwound.
+            await self._executor.drain()
+            await stop_outbox_sender()
+            logger.info("Scheduler and outbox sender stopped")
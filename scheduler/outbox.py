@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from ..cache import TTLCache
+from ..config import settings
+from ..db import session_scope
+from ..ratelimit import TokenBucket, telegram_send_bucket
+from ..services import outbox_service
+from ..services.outbox_service import PendingMessage, outbox_signal
+
+logger = logging.getLogger(__name__)
+
+# Retries scheduled for later are picked up by this poll even when nothing new is enqueued.
+POLL_INTERVAL_SECONDS = 5.0
+
+
+class OutboxSender:
+    """Drains the outbox with a pool of workers.
+
+    One feeder leases due messages in batches; the workers share the global Telegram
+    bucket and keep at least ``per_chat_interval`` seconds between messages to one chat.
+    A message whose chat is busy for longer goes back to the outbox rather than holding
+    its lease while it waits.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = settings.outbox_workers,
+        batch_size: int = settings.outbox_batch_size,
+        bucket: TokenBucket = telegram_send_bucket,
+        per_chat_interval: float = settings.outbox_per_chat_interval,
+    ) -> None:
+        self.bot = bot
+        self.workers = workers
+        self.batch_size = batch_size
+        self.bucket = bucket
+        self.per_chat_interval = per_chat_interval
+        self._queue: asyncio.Queue[PendingMessage] = asyncio.Queue(maxsize=batch_size)
+        self._chat_ready: TTLCache[int, float] = TTLCache(maxsize=10_000, ttl=60)
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._feed()))
+        self._tasks.extend(asyncio.create_task(self._work()) for _ in range(self.workers))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        # Anything leased but unsent goes back out once its lease runs out.
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _feed(self) -> None:
+        while True:
+            try:
+                async with session_scope() as session:
+                    batch = await outbox_service.claim_due(session, self.batch_size)
+            except Exception:
+                logger.exception("Failed to claim outbox messages")
+                batch = []
+            for message in batch:
+                await self._queue.put(message)
+            if len(batch) < self.batch_size:
+                await outbox_signal.wait(POLL_INTERVAL_SECONDS)
+
+    async def _work(self) -> None:
+        while True:
+            message = await self._queue.get()
+            try:
+                await self._deliver(message)
+            except Exception:
+                logger.exception("Outbox message %s could not be processed", message.id)
+            finally:
+                self._queue.task_done()
+
+    async def _wait_for_chat(self, chat_id: int) -> float:
+        """Waits for the chat's next free slot; if that is over an interval away, returns how far instead."""
+        now = time.monotonic()
+        ready = max(now, self._chat_ready.get(chat_id) or now)
+        if ready - now > self.per_chat_interval:
+            return ready - now
+        self._chat_ready.set(chat_id, ready + self.per_chat_interval)
+        if ready > now:
+            await asyncio.sleep(ready - now)
+        return 0.0
+
+    async def _deliver(self, message: PendingMessage) -> None:
+        busy_for = await self._wait_for_chat(message.chat_id)
+        if busy_for:
+            # Sleeping would hold this claim, and the ones queued behind it, past their lease.
+            async with session_scope() as session:
+                await outbox_service.defer(session, message.id, busy_for)
+            return
+        await self.bucket.acquire()
+        error: Optional[str] = None
+        delay: Optional[float] = None
+        try:
+            await self.bot.send_message(message.chat_id, message.text)
+        except TelegramRetryAfter as exc:
+            error = str(exc)
+            self._chat_ready.set(message.chat_id, time.monotonic() + exc.retry_after)
+            if message.attempts < settings.outbox_max_attempts:
+                delay = float(exc.retry_after)
+        except (TelegramForbiddenError, TelegramBadRequest) as exc:
+            # Blocked bots and malformed messages will not get better by retrying.
+            error = str(exc)
+        except TelegramAPIError as exc:
+            error = str(exc)
+            if message.attempts < settings.outbox_max_attempts:
+                delay = outbox_service.retry_delay(message.attempts)
+
+        async with session_scope() as session:
+            if error is None:
+                await outbox_service.mark_sent(session, message.id)
+            elif delay is not None:
+                await outbox_service.mark_retry(session, message.id, delay, error)
+            else:
+                await outbox_service.mark_failed(session, message.id, error)
+        if error is not None:
+            logger.warning("Outbox message %s to %s not delivered: %s", message.id, message.chat_id, error)
+
+
+_sender: Optional[OutboxSender] = None
+
+
+def start_outbox_sender(bot: Bot) -> OutboxSender:
+    global _sender
+    if _sender is None:
+        _sender = OutboxSender(bot)
+    _sender.start()
+    return _sender
+
+
+async def stop_outbox_sender() -> None:
+    global _sender
+    if _sender is not None:
+        await _sender.stop()
+        _sender = None
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Mapping, Sequence
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..crypto import FoodCodeCipher, cipher
+from ..models import JobCheckpoint, Listing, ListingCodeHash, ListingStatus
+from ..normalize import normalize_code
+
+logger = logging.getLogger(__name__)
+
+# A code listed in any of these states cannot be listed again.
+CLAIMED_LISTING_STATUSES = (ListingStatus.active, ListingStatus.reserved, ListingStatus.sold)
+BACKFILL_CHECKPOINT = "listing_code_hashes_backfill"
+
+
+def code_hash(code: str) -> str:
+    return hmac.new(settings.code_hash_secret, normalize_code(code).encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+async def claimed_hashes(session: AsyncSession, hashes: Iterable[str]) -> set[str]:
+    """Returns which of ``hashes`` already belong to an active, reserved or sold listing.
+
+    Only a hint for reporting: :func:`claim_hashes` is what actually keeps a code listed once.
+    """
+    hashes = list(set(hashes))
+    if not hashes:
+        return set()
+    result = await session.execute(
+        select(ListingCodeHash.code_hash).where(ListingCodeHash.code_hash.in_(hashes), ListingCodeHash.claimed),
+    )
+    return set(result.scalars().all())
+
+
+async def record_hashes(
+    session: AsyncSession,
+    hashes_by_listing: Mapping[int, str],
+    claimed: Mapping[int, bool] | None = None,
+) -> None:
+    if hashes_by_listing:
+        claimed = claimed or {}
+        await session.execute(
+            insert(ListingCodeHash),
+            [
+                {"listing_id": listing_id, "code_hash": digest, "claimed": claimed.get(listing_id, True)}
+                for listing_id, digest in hashes_by_listing.items()
+            ],
+        )
+
+
+async def claim_hashes(session: AsyncSession, hashes_by_listing: Mapping[int, str]) -> set[int]:
+    """Records the codes of freshly inserted listings; returns the listings whose code was already claimed.
+
+    The unique index on claimed hashes decides, so two sellers racing with one code cannot both
+    win. Losing listings get no hash row; the caller removes them.
+    """
+    try:
+        async with session.begin_nested():
+            await record_hashes(session, hashes_by_listing)
+        return set()
+    except IntegrityError:
+        pass
+    # Someone else holds at least one of the codes: claim row by row to find out which.
+    lost = set()
+    for listing_id, digest in hashes_by_listing.items():
+        try:
+            async with session.begin_nested():
+                await record_hashes(session, {listing_id: digest})
+        except IntegrityError:
+            lost.add(listing_id)
+    return lost
+
+
+async def release_hashes(session: AsyncSession, listing_ids: Sequence[int]) -> None:
+    """Frees the codes of listings that left the market, so they can be listed again."""
+    if listing_ids:
+        await session.execute(
+            update(ListingCodeHash).where(ListingCodeHash.listing_id.in_(listing_ids)).values(claimed=False),
+        )
+
+
+async def reclaim_hash(session: AsyncSession, listing_id: int) -> bool:
+    """Claims a released listing's code again; ``False`` if another listing holds it meanwhile."""
+    try:
+        async with session.begin_nested():
+            await session.execute(
+                update(ListingCodeHash).where(ListingCodeHash.listing_id == listing_id).values(claimed=True),
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+@dataclass(frozen=True)
+class SharedCodeListing:
+    listing_id: int
+    seller_id: int
+    status: ListingStatus
+    listing_date: date
+
+
+async def listings_sharing_code(session: AsyncSession, listing_id: int) -> List[SharedCodeListing]:
+    """All listings, in any state, whose code matches ``listing_id``'s."""
+    digest = select(ListingCodeHash.code_hash).where(ListingCodeHash.listing_id == listing_id).scalar_subquery()
+    result = await session.execute(
+        select(Listing.id, Listing.seller_id, Listing.status, Listing.date)
+        .join(ListingCodeHash, ListingCodeHash.listing_id == Listing.id)
+        .where(ListingCodeHash.code_hash == digest)
+        .order_by(Listing.id),
+    )
+    return [SharedCodeListing(*row) for row in result.all()]
+
+
+async def duplicate_code_groups(session: AsyncSession, limit: int = 20) -> List[List[SharedCodeListing]]:
+    """Groups of listings that share a code, most recently listed first."""
+    shared = (
+        select(ListingCodeHash.code_hash, func.max(ListingCodeHash.listing_id).label("latest"))
+        .group_by(ListingCodeHash.code_hash)
+        .having(func.count() > 1)
+        .order_by(func.max(ListingCodeHash.listing_id).desc())
+        .limit(limit)
+        .subquery()
+    )
+    result = await session.execute(
+        select(ListingCodeHash.code_hash, Listing.id, Listing.seller_id, Listing.status, Listing.date)
+        .join(shared, shared.c.code_hash == ListingCodeHash.code_hash)
+        .join(Listing, Listing.id == ListingCodeHash.listing_id)
+        .order_by(shared.c.latest.desc(), Listing.id),
+    )
+    groups: Dict[str, List[SharedCodeListing]] = {}
+    for digest, *columns in result.all():
+        groups.setdefault(digest, []).append(SharedCodeListing(*columns))
+    return list(groups.values())
+
+
+async def backfill_code_hashes_chunk(
+    session: AsyncSession,
+    limit: int,
+    code_cipher: FoodCodeCipher = cipher,
+) -> int:
+    """Indexes the next ``limit`` listings created before the index existed; 0 once done."""
+    checkpoint = await session.get(JobCheckpoint, BACKFILL_CHECKPOINT)
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(name=BACKFILL_CHECKPOINT, position=0)
+        session.add(checkpoint)
+    if checkpoint.completed_at is not None:
+        return 0
+    rows: Sequence = (
+        await session.execute(
+            select(Listing.id, Listing.status, Listing.full_code_enc, ListingCodeHash.listing_id.label("indexed"))
+            .outerjoin(ListingCodeHash, ListingCodeHash.listing_id == Listing.id)
+            .where(Listing.id > checkpoint.position)
+            .order_by(Listing.id)
+            .limit(limit),
+        )
+    ).all()
+    if not rows:
+        checkpoint.completed_at = datetime.utcnow()
+        logger.info("Listing code index backfilled")
+        return 0
+    missing = [row for row in rows if row.indexed is None]
+    codes = await code_cipher.decrypt_many_async([row.full_code_enc for row in missing])
+    hashes = {row.id: code_hash(code) for row, code in zip(missing, codes)}
+    # Codes listed twice before the index existed stay claimed by the first listing only.
+    taken = await claimed_hashes(session, hashes.values())
+    claimed = {}
+    for row in missing:
+        claimed[row.id] = row.status in CLAIMED_LISTING_STATUSES and hashes[row.id] not in taken
+        if claimed[row.id]:
+            taken.add(hashes[row.id])
+    await record_hashes(session, hashes, claimed)
+    checkpoint.position = rows[-1].id
+    return len(rows)
+
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, AsyncContextManager, Callable, Dict, Optional
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..cache import TTLCache
+from ..config import settings
+from ..crypto import FoodCodeCipher, cipher
+from ..db import session_scope
+from ..models import FsmRecord
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FsmEntry:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+def _pack(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class FsmStore:
+    """Conversation state persisted in ``fsm_records``, behind a hot in-memory layer.
+
+    Reads hit the hot layer first. Writes land there immediately and reach the database in one
+    transaction per ``flush_interval``, so the several ``update_data`` calls of one handler cost a
+    single write. Data payloads are Fernet-encrypted at rest because flows such as /sell carry the
+    plaintext food code. Entries untouched for ``ttl`` count as abandoned: they read as empty and
+    :meth:`collect_garbage` deletes them. Expired hot entries are dropped by :meth:`purge_hot`.
+
+    The hot layer assumes one worker owns a given user's updates; with several workers either
+    route users consistently or keep ``cache_ttl`` short.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncContextManager[AsyncSession]] = session_scope,
+        code_cipher: FoodCodeCipher = cipher,
+        ttl: timedelta = timedelta(hours=settings.fsm_ttl_hours),
+        flush_interval: float = settings.fsm_flush_interval,
+        cache_size: int = settings.fsm_cache_size,
+        cache_ttl: float = settings.fsm_cache_ttl_seconds,
+    ) -> None:
+        self._session_factory = session_factory
+        self._cipher = code_cipher
+        self.ttl = ttl
+        self._flush_interval = flush_interval
+        self._hot: TTLCache[str, FsmEntry] = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._dirty: Dict[str, FsmEntry] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        # Serialises flushes so an older snapshot of a key can never commit after a newer one.
+        self._flush_lock = asyncio.Lock()
+
+    async def get(self, key: str) -> FsmEntry:
+        entry = self._dirty.get(key) or self._hot.get(key)
+        if entry is None:
+            entry = await self._load(key)
+            self._hot.set(key, entry)
+        return FsmEntry(entry.state, dict(entry.data))
+
+    async def put(self, key: str, entry: FsmEntry) -> None:
+        entry = FsmEntry(entry.state, dict(entry.data))
+        self._hot.set(key, entry)
+        self._dirty[key] = entry
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _load(self, key: str) -> FsmEntry:
+        async with self._session_factory() as session:
+            row = (
+                await session.execute(
+                    select(FsmRecord.state, FsmRecord.data_enc).where(
+                        FsmRecord.key == key,
+                        FsmRecord.updated_at >= datetime.utcnow() - self.ttl,
+                    ),
+                )
+            ).first()
+        if row is None:
+            return FsmEntry()
+        if not row.data_enc:
+            return FsmEntry(row.state, {})
+        try:
+            data = json.loads(await self._cipher.decrypt_async(row.data_enc))
+        except ValueError:
+            # Written under a key that is no longer configured. Left in place, every update of this
+            # user would fail on it until garbage collection; starting over is the only way out.
+            logger.warning("FSM record %s is unreadable with the configured keys; discarding it", key)
+            async with self._session_factory() as session:
+                await session.execute(
+                    delete(FsmRecord).where(FsmRecord.key == key, FsmRecord.data_enc == row.data_enc),
+                )
+            return FsmEntry()
+        return FsmEntry(row.state, data)
+
+    async def _flush_later(self) -> None:
+        # Loops while writes keep arriving (or a failed flush put them back), then exits.
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+            if not self._dirty:
+                return
+
+    async def flush(self) -> int:
+        """Writes every pending entry in one transaction; returns how many keys were written."""
+        async with self._flush_lock:
+            pending, self._dirty = self._dirty, {}
+            if not pending:
+                return 0
+            try:
+                await self._write(pending)
+            except Exception:
+                # Keep the writes for the next flush unless a newer value superseded them meanwhile.
+                for key, entry in pending.items():
+                    self._dirty.setdefault(key, entry)
+                logger.exception("FSM flush of %s keys failed; will retry", len(pending))
+                return 0
+        return len(pending)
+
+    async def _write(self, pending: Dict[str, FsmEntry]) -> None:
+        now = datetime.utcnow()
+        rows = [
+            {"key": key, "state": entry.state, "data_enc": None, "updated_at": now}
+            for key, entry in pending.items()
+            if not entry.empty
+        ]
+        with_data = [row for row in rows if pending[row["key"]].data]
+        tokens = await self._cipher.encrypt_many_async([_pack(pending[row["key"]].data) for row in with_data])
+        for row, token in zip(with_data, tokens):
+            row["data_enc"] = token
+        async with self._session_factory() as session:
+            # Delete-then-insert is a portable upsert; cleared conversations are simply deleted.
+            await session.execute(delete(FsmRecord).where(FsmRecord.key.in_(list(pending))))
+            if rows:
+                await session.execute(insert(FsmRecord), rows)
+
+    def purge_hot(self) -> int:
+        """Drops expired entries from this process's hot layer now rather than when next looked up."""
+        return self._hot.purge_expired()
+
+    async def collect_garbage(self) -> int:
+        """Deletes abandoned conversations; each process purges its own hot layer with :meth:`purge_hot`."""
+        async with self._session_factory() as session:
+            result = await session.execute(delete(FsmRecord).where(FsmRecord.updated_at < datetime.utcnow() - self.ttl))
+        return result.rowcount
+
+    async def close(self) -> None:
+        # The lock makes this wait for an in-flight flush, so only the idle timer is cancelled.
+        await self.flush()
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+
+
+fsm_store = FsmStore()
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import Column, bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..crypto import FoodCodeCipher, cipher
+from ..models import FsmRecord, JobCheckpoint, Listing, OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PREFIX = "reencrypt_"
+
+
+@dataclass(frozen=True)
+class EncryptedColumn:
+    """A column of Fernet tokens that a key rotation has to move onto the primary key."""
+
+    name: str
+    key: Column
+    token: Column
+    # Assigned to themselves so their onupdate does not fire: rotation is not an edit.
+    keep: Tuple[Column, ...] = ()
+
+    @property
+    def resumable(self) -> bool:
+        # Progress is checkpointed as an integer; other keys restart their (small) pass after a restart.
+        return self.key.type.python_type is int
+
+
+_listings = Listing.__table__
+_outbox = OutboxMessage.__table__
+_fsm = FsmRecord.__table__
+
+ENCRYPTED_COLUMNS: Tuple[EncryptedColumn, ...] = (
+    EncryptedColumn("listings", _listings.c.id, _listings.c.full_code_enc, keep=(_listings.c.updated_at,)),
+    EncryptedColumn("outbox_messages", _outbox.c.id, _outbox.c.text_enc),
+    EncryptedColumn("fsm_records", _fsm.c.key, _fsm.c.data_enc),
+)
+
+
+def checkpoint_name(column: EncryptedColumn, code_cipher: FoodCodeCipher = cipher) -> str:
+    return f"{CHECKPOINT_PREFIX}{column.name}:{code_cipher.primary_key_id}"
+
+
+async def _checkpoint(session: AsyncSession, name: str) -> JobCheckpoint:
+    checkpoint = await session.get(JobCheckpoint, name)
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(name=name, position=0)
+        session.add(checkpoint)
+    return checkpoint
+
+
+async def reencrypt_chunk(
+    session: AsyncSession,
+    column: EncryptedColumn,
+    limit: int,
+    after: Optional[Any] = None,
+    code_cipher: FoodCodeCipher = cipher,
+) -> Tuple[int, Optional[Any]]:
+    """Re-encrypts the next ``limit`` tokens of ``column`` under the primary key.
+
+    Returns how many were rotated and the last key handled, to pass back as ``after``; integer
+    keys resume from the checkpoint instead. Progress is keyed by the primary key, so adding a
+    newer key starts a fresh pass. Returns ``(0, None)`` once the pass is complete.
+    """
+    checkpoint = await _checkpoint(session, checkpoint_name(column, code_cipher))
+    if checkpoint.completed_at is not None:
+        return 0, None
+    if column.resumable:
+        after = checkpoint.position
+
+    query = select(column.key, column.token).where(column.token.isnot(None)).order_by(column.key).limit(limit)
+    if after is not None:
+        query = query.where(column.key > after)
+    rows = (await session.execute(query)).all()
+    if not rows:
+        checkpoint.completed_at = datetime.utcnow()
+        logger.info("%s re-encrypted under key %s", column.name, code_cipher.primary_key_id)
+        return 0, None
+
+    tokens = await code_cipher.rotate_many_async([row[1] for row in rows])
+    # Only where the token is still the one read: a concurrent rewrite or clear wins over rotation.
+    rewrite = (
+        update(column.key.table)
+        .where(column.key == bindparam("row_key"), column.token == bindparam("old_token"))
+        .values({column.token.name: bindparam("new_token"), **{kept.name: kept for kept in column.keep}})
+    )
+    await session.execute(
+        rewrite,
+        [{"row_key": row[0], "old_token": row[1], "new_token": token} for row, token in zip(rows, tokens)],
+    )
+    last = rows[-1][0]
+    if column.resumable:
+        checkpoint.position = last
+    return len(rows), last
+
+
+async def rotation_complete(session: AsyncSession, code_cipher: FoodCodeCipher = cipher) -> bool:
+    """Whether every encrypted column has been moved onto the primary key, so older keys can go."""
+    names = [checkpoint_name(column, code_cipher) for column in ENCRYPTED_COLUMNS]
+    done = (
+        await session.execute(
+            select(JobCheckpoint.name).where(JobCheckpoint.name.in_(names), JobCheckpoint.completed_at.isnot(None)),
+        )
+    ).scalars().all()
+    return len(done) == len(names)
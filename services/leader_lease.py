@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncContextManager, Awaitable, Callable, Optional
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..db import session_scope
+from ..models import Lease
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_LEASE = "scheduler"
+
+
+async def acquire_lease(session: AsyncSession, name: str, holder: str, ttl: timedelta) -> bool:
+    """Takes or renews ``name`` for ``holder``; fails while another holder's lease is running."""
+    now = datetime.utcnow()
+    result = await session.execute(
+        update(Lease)
+        .where(Lease.name == name, or_(Lease.holder == holder, Lease.expires_at <= now))
+        .values(holder=holder, expires_at=now + ttl),
+    )
+    if result.rowcount:
+        return True
+    if await session.get(Lease, name) is not None:
+        return False
+    session.add(Lease(name=name, holder=holder, expires_at=now + ttl))
+    try:
+        await session.flush()
+    except IntegrityError:
+        # Another process created the row between the update and the insert; it holds the lease.
+        await session.rollback()
+        return False
+    return True
+
+
+async def release_lease(session: AsyncSession, name: str, holder: str) -> bool:
+    result = await session.execute(
+        update(Lease).where(Lease.name == name, Lease.holder == holder).values(expires_at=datetime.utcnow()),
+    )
+    return result.rowcount > 0
+
+
+class LeaderElector:
+    """Keeps leader-only work running in exactly one process, through a lease row.
+
+    Every process calls :meth:`tick` each ``heartbeat`` seconds. The holder renews its lease;
+    the others take it over once it has gone unrenewed for ``ttl``. A renewal that takes longer
+    than a heartbeat is abandoned, and a leader steps down while its last confirmed lease still
+    has two heartbeats to run, which leaves its duties time to stop before anyone else can take
+    over. ``ttl`` must therefore exceed two heartbeats.
+    """
+
+    def __init__(
+        self,
+        on_elected: Callable[[], Awaitable[None]],
+        on_demoted: Callable[[], Awaitable[None]],
+        name: str = SCHEDULER_LEASE,
+        holder: Optional[str] = None,
+        ttl: timedelta = timedelta(seconds=settings.leader_lease_seconds),
+        heartbeat: float = settings.leader_heartbeat_seconds,
+        session_factory: Callable[[], AsyncContextManager[AsyncSession]] = session_scope,
+    ) -> None:
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self.name = name
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._ttl = ttl
+        self._heartbeat = heartbeat
+        self._session_factory = session_factory
+        self._valid_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.is_leader = False
+
+    async def _renew(self) -> bool:
+        async with self._session_factory() as session:
+            return await acquire_lease(session, self.name, self.holder, self._ttl)
+
+    async def tick(self) -> bool:
+        attempted = time.monotonic()
+        try:
+            renewed = await asyncio.wait_for(self._renew(), timeout=self._heartbeat)
+        except Exception:
+            logger.exception("Lease %s could not be renewed by %s", self.name, self.holder)
+            # The outcome is unknown: keep leading on the last confirmed lease, if it lasts.
+            renewed = self.is_leader
+        else:
+            if renewed:
+                self._valid_until = attempted + self._ttl.total_seconds()
+        # Measured after the call, however long it took: the lease has to outlive the next
+        # heartbeat and that tick's renewal timeout, or this process steps down now.
+        held = renewed and time.monotonic() + 2 * self._heartbeat < self._valid_until
+        if held and not self.is_leader:
+            self.is_leader = True
+            logger.info("%s now leads %s", self.holder, self.name)
+            await self._on_elected()
+        elif not held and self.is_leader:
+            self.is_leader = False
+            logger.warning("%s lost the %s lease", self.holder, self.name)
+            await self._on_demoted()
+        return held
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.tick()
+            except Exception:  # noqa: BLE001 - a failing duty must not stop the heartbeat
+                logger.exception("Leader election for %s failed", self.name)
+            await asyncio.sleep(self._heartbeat)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the heartbeat and, when leading, hands the lease back so a follower takes over at once."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        await self._on_demoted()
+        try:
+            async with self._session_factory() as session:
+                await release_lease(session, self.name, self.holder)
+        except Exception:
+            logger.exception("Lease %s not released; it lapses after %s", self.name, self._ttl)
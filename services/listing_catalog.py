@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import logging
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Protocol, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db import on_commit
+from ..models import Listing, ListingStatus, MealType
+from .listing_search import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+BrowseKey = Tuple[date, str, datetime, int]
+# Each sync re-reads this far back, so a row stamped before a slow transaction committed is not missed.
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class _Positioned(Protocol):
+    date: date
+    meal_type: MealType
+    created_at: datetime
+    id: int
+
+
+def browse_key(item: _Positioned) -> BrowseKey:
+    return (item.date, item.meal_type.value, item.created_at, item.id)
+
+
+class ListingRecord:
+    """Read-only view of an active listing, shaped like the ``Listing`` columns browse needs."""
+
+    __slots__ = (
+        "id",
+        "seller_id",
+        "date",
+        "meal_type",
+        "dish_name",
+        "price",
+        "masked_code",
+        "created_at",
+        "updated_at",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        seller_id: int,
+        date: date,
+        meal_type: MealType,
+        dish_name: str,
+        price: int,
+        masked_code: str,
+        created_at: datetime,
+        updated_at: datetime,
+    ) -> None:
+        self.id = id
+        self.seller_id = seller_id
+        self.date = date
+        self.meal_type = meal_type
+        self.dish_name = dish_name
+        self.price = price
+        self.masked_code = masked_code
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_listing(cls, listing: Listing) -> "ListingRecord":
+        return cls(
+            id=listing.id,
+            seller_id=listing.seller_id,
+            date=listing.date,
+            meal_type=listing.meal_type,
+            dish_name=listing.dish_name,
+            price=listing.price,
+            masked_code=listing.masked_code,
+            created_at=listing.created_at,
+            updated_at=listing.updated_at,
+        )
+
+
+RECORD_COLUMNS = (
+    Listing.id,
+    Listing.seller_id,
+    Listing.date,
+    Listing.meal_type,
+    Listing.dish_name,
+    Listing.price,
+    Listing.masked_code,
+    Listing.created_at,
+    Listing.updated_at,
+)
+
+
+class ListingCatalog:
+    """In-process, browse-ordered index of active listings, plus a trigram index of their dishes.
+
+    Mutations are staged on the session with :func:`track_active` / :func:`track_removed`
+    and applied only once the transaction commits, so a rollback never leaks into it. Changes
+    committed by other processes arrive through :meth:`sync`.
+    """
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self._records: Dict[int, ListingRecord] = {}
+        self._keys: List[BrowseKey] = []
+        self._by_meal: Dict[str, List[BrowseKey]] = {meal.value: [] for meal in MealType}
+        self._dishes = TrigramIndex()
+        self._synced_at = datetime.min
+
+    async def load(self, session: AsyncSession) -> None:
+        started = datetime.utcnow()
+        result = await session.execute(select(*RECORD_COLUMNS).where(Listing.status == ListingStatus.active))
+        self.replace(ListingRecord(*row) for row in result.all())
+        self._synced_at = started
+        logger.info("Listing catalog loaded with %s active listings", len(self._records))
+
+    async def sync(self, session: AsyncSession) -> int:
+        """Applies listings changed since the last load or sync; returns how many changed here.
+
+        A row read just before a local commit may be applied just after it; the next sync reads
+        the row again and corrects it.
+        """
+        if not self.loaded:
+            return 0
+        started = datetime.utcnow()
+        result = await session.execute(
+            select(*RECORD_COLUMNS, Listing.status).where(Listing.updated_at >= self._synced_at - SYNC_OVERLAP),
+        )
+        changed = 0
+        for *columns, status in result.all():
+            record = ListingRecord(*columns)
+            current = self._records.get(record.id)
+            if status == ListingStatus.active:
+                if current is None or current.updated_at != record.updated_at:
+                    self.add(record)
+                    changed += 1
+            elif current is not None:
+                self.discard(record.id)
+                changed += 1
+        self._synced_at = started
+        return changed
+
+    def replace(self, records: Iterable[ListingRecord]) -> None:
+        self._records = {record.id: record for record in records}
+        self._keys = sorted(browse_key(record) for record in self._records.values())
+        self._by_meal = {meal.value: [] for meal in MealType}
+        for key in self._keys:
+            self._by_meal[key[1]].append(key)
+        self._dishes.clear()
+        for record in self._records.values():
+            self._dishes.add(record.id, record.dish_name)
+        self.loaded = True
+
+    def add(self, record: ListingRecord) -> None:
+        self.discard(record.id)
+        key = browse_key(record)
+        self._records[record.id] = record
+        insort(self._keys, key)
+        insort(self._by_meal[key[1]], key)
+        self._dishes.add(record.id, record.dish_name)
+
+    def discard(self, listing_id: int) -> None:
+        record = self._records.pop(listing_id, None)
+        if record is None:
+            return
+        self._dishes.discard(listing_id)
+        key = browse_key(record)
+        for keys in (self._keys, self._by_meal[key[1]]):
+            index = bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                del keys[index]
+
+    def get(self, listing_id: int) -> Optional[ListingRecord]:
+        return self._records.get(listing_id)
+
+    def after(
+        self,
+        cursor: _Positioned | None = None,
+        meal: MealType | None = None,
+        limit: int = 1,
+    ) -> List[ListingRecord]:
+        keys = self._by_meal[meal.value] if meal else self._keys
+        start = bisect_right(keys, browse_key(cursor)) if cursor is not None else 0
+        return [self._records[key[3]] for key in keys[start:start + limit]]
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> List[ListingRecord]:
+        """Listings whose dish matches ``query``, best match first and soonest first among equals."""
+        matches = self._dishes.match(query)
+        matches.sort(key=lambda match: (-match[1], browse_key(self._records[match[0]])))
+        return [self._records[listing_id] for listing_id, _ in matches[offset:offset + limit]]
+
+    def track_active(self, session: AsyncSession, listing: Listing | ListingRecord) -> None:
+        record = listing if isinstance(listing, ListingRecord) else ListingRecord.from_listing(listing)
+        on_commit(session, lambda: self._apply(self.add, record))
+
+    def track_removed(self, session: AsyncSession, listing_id: int) -> None:
+        on_commit(session, lambda: self._apply(self.discard, listing_id))
+
+    def _apply(self, operation, argument) -> None:  # noqa: ANN001 - add/discard share this path
+        if self.loaded:
+            operation(argument)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+catalog = ListingCatalog()
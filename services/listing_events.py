@@ -0,0 +1,22 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import Listing
+from . import watch_service
+from .listing_catalog import ListingRecord, catalog
+
+
+async def announce_active(session: AsyncSession, listings: Iterable[Listing | ListingRecord]) -> None:
+    """Every path that puts a listing on the market goes through here, inside its transaction.
+
+    The browse catalog picks the listings up on commit and matching watchers are queued for
+    notification in the same transaction.
+    """
+    records = [item if isinstance(item, ListingRecord) else ListingRecord.from_listing(item) for item in listings]
+    for record in records:
+        catalog.track_active(session, record)
+    if records:
+        await watch_service.notify_watchers(session, records)
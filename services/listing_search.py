@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import math
+from collections import Counter
+from typing import Dict, FrozenSet, List, Set, Tuple
+
+from ..normalize import normalize_text
+
+# Share of the query's trigrams a dish name must contain; below 1.0 so one typo still matches.
+MIN_SIMILARITY = 0.6
+
+
+def trigrams(text: str, prefix: bool = False) -> FrozenSet[str]:
+    """Word-bounded trigrams of ``normalize_text(text)``.
+
+    Every word is padded with a leading and trailing space so short words still produce grams.
+    With ``prefix`` the last word gets no trailing pad, letting a half-typed inline query match.
+    """
+    words = normalize_text(text).split()
+    grams: Set[str] = set()
+    for index, word in enumerate(words):
+        padded = f" {word}" if prefix and index == len(words) - 1 else f" {word} "
+        grams.update(padded[start:start + 3] for start in range(max(len(padded) - 2, 1)))
+    return frozenset(grams)
+
+
+class TrigramIndex:
+    """Inverted index from dish-name trigrams to listing ids, scored by query coverage."""
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, Set[int]] = {}
+        self._grams: Dict[int, FrozenSet[str]] = {}
+
+    def add(self, listing_id: int, text: str) -> None:
+        self.discard(listing_id)
+        grams = trigrams(text)
+        self._grams[listing_id] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(listing_id)
+
+    def discard(self, listing_id: int) -> None:
+        for gram in self._grams.pop(listing_id, ()):
+            postings = self._postings.get(gram)
+            if postings is None:
+                continue
+            postings.discard(listing_id)
+            if not postings:
+                del self._postings[gram]
+
+    def clear(self) -> None:
+        self._postings.clear()
+        self._grams.clear()
+
+    def match(self, query: str) -> List[Tuple[int, float]]:
+        """``(listing_id, similarity)`` for every listing covering enough of ``query``, unordered."""
+        grams = trigrams(query, prefix=True)
+        if not grams:
+            return []
+        hits: Counter[int] = Counter()
+        for gram in grams:
+            hits.update(self._postings.get(gram, ()))
+        needed = math.ceil(len(grams) * MIN_SIMILARITY)
+        return [(listing_id, count / len(grams)) for listing_id, count in hits.items() if count >= needed]
+
+    def __len__(self) -> int:
+        return len(self._grams)
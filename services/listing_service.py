@@ -1,21 +1,173 @@
 from __future__ import annotations
 
+import csv
 import logging
+from dataclasses import dataclass, replace
 from datetime import date, datetime, timedelta
-from typing import Iterable, List, Sequence
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
 
-from sqlalchemy import func, select, update
+from sqlalchemy import Select, delete, func, insert, select, tuple_, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..config import settings
 from ..crypto import cipher
+from ..db import update_returning
 from ..messages import fa
-from ..models import Listing, ListingStatus, MealType
+from ..models import Listing, ListingStatus, MealType, User
+from . import code_index, watch_service
+from .listing_catalog import RECORD_COLUMNS, ListingRecord, catalog
+from .listing_events import announce_active
+from .watch_service import ANY, MEAL_ALIASES, parse_date_range
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class ListingCursor:
+    """Position of a listing in the browse order ``(date, meal_type, created_at, id)``.
+
+    ``price`` is carried along so the same cursor can resume a price-sorted page.
+    """
+
+    date: date
+    meal_type: MealType
+    created_at: datetime
+    id: int
+    price: Optional[int] = None
+
+    @classmethod
+    def from_listing(cls, listing: Listing) -> "ListingCursor":
+        return cls(listing.date, listing.meal_type, listing.created_at, listing.id, listing.price)
+
+    def encode(self) -> str:
+        parts = [self.date.isoformat(), self.meal_type.value, self.created_at.isoformat(), str(self.id)]
+        if self.price is not None:
+            parts.append(str(self.price))
+        return "|".join(parts)
+
+    @classmethod
+    def decode(cls, raw: str) -> "ListingCursor":
+        try:
+            day, meal, created_at, listing_id, *price = raw.split("|")
+            if len(price) > 1:
+                raise ValueError(raw)
+            return cls(
+                date.fromisoformat(day),
+                MealType(meal),
+                datetime.fromisoformat(created_at),
+                int(listing_id),
+                int(price[0]) if price else None,
+            )
+        except ValueError as exc:
+            raise ValueError("نشانگر صفحه نامعتبر است.") from exc
+
+
+BROWSE_ORDER = (Listing.date, Listing.meal_type, Listing.created_at, Listing.id)
+PRICE_ORDER = (Listing.price, *BROWSE_ORDER)
+
+
+@dataclass(frozen=True)
+class BrowseFilters:
+    """Optional narrowing of the active-listing browse; the defaults match every listing."""
+
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    meals: Tuple[MealType, ...] = ()
+    max_price: Optional[int] = None
+    uni: Optional[str] = None
+    min_rating: Optional[float] = None
+    sort: str = "date"
+
+    @property
+    def is_default(self) -> bool:
+        return self == BrowseFilters()
+
+
+def parse_browse_filters(raw: str, today: Optional[date] = None) -> BrowseFilters:
+    """Parses ``/buy`` arguments: ``meal=شام date=week max=80000 uni=UT rating=4 sort=price``."""
+    today = today or date.today()
+    terms = {}
+    for token in (raw or "").split():
+        key, sep, value = token.partition("=")
+        if not sep or not value:
+            raise ValueError("هر شرط را به شکل کلید=مقدار بنویس؛ مثلاً meal=شام")
+        terms[key.lower()] = value
+    unknown = set(terms) - {"meal", "date", "max", "uni", "rating", "sort"}
+    if unknown:
+        raise ValueError(f"شرط ناشناخته: {', '.join(sorted(unknown))}")
+
+    filters = BrowseFilters()
+    if "meal" in terms and terms["meal"].lower() not in ANY:
+        meal = MEAL_ALIASES.get(terms["meal"].lower())
+        if meal is None:
+            raise ValueError("وعده نامعتبر است.")
+        filters = replace(filters, meals=(meal,))
+    dates = parse_date_range(terms.get("date", ""), today)
+    if dates is not None:
+        filters = replace(filters, date_from=max(dates[0], today), date_to=dates[1])
+    if "max" in terms:
+        if not terms["max"].isdigit():
+            raise ValueError("قیمت باید یک عدد باشد.")
+        filters = replace(filters, max_price=int(terms["max"]))
+    if "uni" in terms:
+        filters = replace(filters, uni=terms["uni"])
+    if "rating" in terms:
+        try:
+            rating = float(terms["rating"])
+        except ValueError as exc:
+            raise ValueError("حداقل امتیاز باید عددی بین ۰ تا ۵ باشد.") from exc
+        if not 0 <= rating <= 5:
+            raise ValueError("حداقل امتیاز باید عددی بین ۰ تا ۵ باشد.")
+        filters = replace(filters, min_rating=rating)
+    if "sort" in terms:
+        if terms["sort"].lower() not in ("date", "price"):
+            raise ValueError("مرتب‌سازی فقط بر اساس date یا price ممکن است.")
+        filters = replace(filters, sort=terms["sort"].lower())
+    return filters
+
+
+def active_listings_query(
+    filters: BrowseFilters | None = None,
+    limit: int = 10,
+    after: ListingCursor | None = None,
+) -> Select:
+    """Keyset page of active listings matching ``filters``.
+
+    Every shape stays on an index: date sorts walk ``idx_listings_status_date_meal_created``
+    (or ``idx_listings_status_meal_date_created`` for a single meal), price sorts walk
+    ``idx_listings_status_price_date`` and seller criteria resolve through
+    ``idx_users_uni_rating`` / ``idx_users_rating_avg`` into an ``IN`` probe on ``seller_id``.
+    """
+    filters = filters or BrowseFilters()
+    order = PRICE_ORDER if filters.sort == "price" else BROWSE_ORDER
+    stmt = select(Listing).where(Listing.status == ListingStatus.active)
+    if len(filters.meals) == 1:
+        # An equality (not a one-element IN) lets date order come straight off the meal-first index.
+        stmt = stmt.where(Listing.meal_type == filters.meals[0])
+    elif filters.meals:
+        stmt = stmt.where(Listing.meal_type.in_(filters.meals))
+    if filters.date_from is not None:
+        stmt = stmt.where(Listing.date >= filters.date_from)
+    if filters.date_to is not None:
+        stmt = stmt.where(Listing.date <= filters.date_to)
+    if filters.max_price is not None:
+        stmt = stmt.where(Listing.price <= filters.max_price)
+    if filters.uni is not None or filters.min_rating is not None:
+        sellers = select(User.id)
+        if filters.uni is not None:
+            sellers = sellers.where(User.uni == filters.uni)
+        if filters.min_rating is not None:
+            sellers = sellers.where(User.rating_avg >= filters.min_rating)
+        stmt = stmt.where(Listing.seller_id.in_(sellers))
+    if after is not None:
+        position = (after.date, after.meal_type, after.created_at, after.id)
+        if filters.sort == "price":
+            position = (after.price, *position)
+        stmt = stmt.where(tuple_(*order) > position)
+    return stmt.order_by(*order).limit(limit)
+
+
 async def count_active_listings_for_seller(session: AsyncSession, seller_id: int) -> int:
     stmt = select(func.count(Listing.id)).where(
         Listing.seller_id == seller_id,
@@ -70,7 +222,7 @@ async def create_listing(
         dish_name=dish_name.strip(),
         price=price,
         masked_code=mask_code(code),
-        full_code_enc=cipher.encrypt(code),
+        full_code_enc=await cipher.encrypt_async(code),
         expires_at=expires_at or datetime.combine(listing_date, datetime.min.time()) + timedelta(hours=24),
     )
     session.add(listing)
@@ -79,21 +231,163 @@ async def create_listing(
     except IntegrityError as exc:  # pragma: no cover - unlikely with correct data
         logger.exception("Failed to create listing", exc_info=exc)
         raise ValueError("ثبت آگهی با خطا مواجه شد.") from exc
+    if await code_index.claim_hashes(session, {listing.id: code_index.code_hash(code)}):
+        await session.delete(listing)
+        await session.flush()
+        raise ValueError(fa.SELL_CODE_DUPLICATE)
+    await announce_active(session, [listing])
     logger.info("Listing %s created by user %s", listing.id, seller_id)
     return listing
 
 
+@dataclass(frozen=True)
+class ListingDraft:
+    listing_date: date
+    meal_type: str
+    dish_name: str
+    price: int
+    code: str
+
+
+@dataclass(frozen=True)
+class BulkRowResult:
+    line: int
+    listing_id: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.listing_id is not None
+
+
+BULK_MEAL_ALIASES = {
+    "lunch": MealType.lunch.value,
+    "ناهار": MealType.lunch.value,
+    "نهار": MealType.lunch.value,
+    "dinner": MealType.dinner.value,
+    "شام": MealType.dinner.value,
+}
+BULK_HEADER_CELLS = {"date", "تاریخ"}
+
+
+def parse_bulk_listings(raw: str) -> List[Tuple[int, Union[ListingDraft, str]]]:
+    """Parses ``date,meal,dish,price,code`` lines (CSV quoting allowed, Persian comma accepted).
+
+    Returns ``(line_number, draft)`` pairs, or ``(line_number, error)`` for rows that do not parse.
+    Blank lines and a leading header row are skipped.
+    """
+    parsed: List[Tuple[int, Union[ListingDraft, str]]] = []
+    for line_number, line in enumerate(raw.splitlines(), start=1):
+        if not line.strip():
+            continue
+        delimiter = "," if "," in line or "،" not in line else "،"
+        cells = [cell.strip() for cell in next(csv.reader([line], delimiter=delimiter))]
+        if not parsed and cells[0].lower() in BULK_HEADER_CELLS:
+            continue
+        if len(cells) != 5:
+            parsed.append((line_number, "ردیف باید ۵ ستون داشته باشد: تاریخ، وعده، غذا، قیمت، کد."))
+            continue
+        day, meal, dish, price, code = cells
+        try:
+            listing_date = datetime.strptime(day, "%Y-%m-%d").date()
+        except ValueError:
+            parsed.append((line_number, "تاریخ را به صورت YYYY-MM-DD بنویس."))
+            continue
+        if not price.isdigit():
+            parsed.append((line_number, "قیمت باید یک عدد باشد."))
+            continue
+        parsed.append(
+            (line_number, ListingDraft(listing_date, BULK_MEAL_ALIASES.get(meal.lower(), meal), dish, int(price), code)),
+        )
+    return parsed
+
+
+async def create_listings_bulk(
+    session: AsyncSession,
+    seller_id: int,
+    rows: Sequence[Tuple[int, Union[ListingDraft, str]]],
+) -> List[BulkRowResult]:
+    """Validates every row, then encrypts and inserts the valid ones with a single executemany.
+
+    Codes that are already listed, and rows past the seller's active-listing limit, are
+    reported rather than inserted.
+    """
+    errors = {}
+    valid: List[Tuple[int, ListingDraft]] = []
+    for line, draft in rows:
+        if isinstance(draft, str):
+            errors[line] = draft
+            continue
+        try:
+            validate_listing_inputs(draft.listing_date, draft.meal_type, draft.dish_name, draft.price, draft.code)
+        except ValueError as exc:
+            errors[line] = str(exc)
+            continue
+        valid.append((line, draft))
+
+    hashes = {line: code_index.code_hash(draft.code) for line, draft in valid}
+    # Reported up front so duplicates do not use up the seller's limit; the insert below still decides.
+    taken = await code_index.claimed_hashes(session, hashes.values())
+    unique: List[Tuple[int, ListingDraft]] = []
+    for line, draft in valid:
+        if hashes[line] in taken:
+            errors[line] = fa.SELL_CODE_DUPLICATE
+            continue
+        taken.add(hashes[line])
+        unique.append((line, draft))
+    valid = unique
+
+    remaining = max(settings.daily_listing_limit - await count_active_listings_for_seller(session, seller_id), 0)
+    for line, _ in valid[remaining:]:
+        errors[line] = fa.SELL_LIMIT_REACHED
+    valid = valid[:remaining]
+
+    created = {}
+    if valid:
+        tokens = await cipher.encrypt_many_async([draft.code for _, draft in valid])
+        inserted = await session.execute(
+            insert(Listing).returning(*RECORD_COLUMNS, sort_by_parameter_order=True),
+            [
+                {
+                    "seller_id": seller_id,
+                    "date": draft.listing_date,
+                    "meal_type": MealType(draft.meal_type),
+                    "dish_name": draft.dish_name.strip(),
+                    "price": draft.price,
+                    "masked_code": mask_code(draft.code),
+                    "full_code_enc": token,
+                    "expires_at": datetime.combine(draft.listing_date, datetime.min.time()) + timedelta(hours=24),
+                }
+                for (_, draft), token in zip(valid, tokens)
+            ],
+        )
+        records = [ListingRecord(*row) for row in inserted.all()]
+        created = {line: record.id for (line, _), record in zip(valid, records)}
+        lost = await code_index.claim_hashes(session, {listing_id: hashes[line] for line, listing_id in created.items()})
+        if lost:
+            # Listed by someone else since the check above.
+            await session.execute(delete(Listing).where(Listing.id.in_(lost)))
+            for line in [line for line, listing_id in created.items() if listing_id in lost]:
+                errors[line] = fa.SELL_CODE_DUPLICATE
+                del created[line]
+            records = [record for record in records if record.id not in lost]
+        await announce_active(session, records)
+        logger.info("Seller %s created %s listings in bulk", seller_id, len(created))
+
+    return [BulkRowResult(line, listing_id=created.get(line), error=errors.get(line)) for line, _ in rows]
+
+
 async def list_active_listings(
     session: AsyncSession,
     meal_filters: Sequence[MealType] | None = None,
     limit: int = 10,
-    offset: int = 0,
+    after: ListingCursor | None = None,
+    filters: BrowseFilters | None = None,
 ) -> List[Listing]:
-    stmt = select(Listing).where(Listing.status == ListingStatus.active)
+    filters = filters or BrowseFilters()
     if meal_filters:
-        stmt = stmt.where(Listing.meal_type.in_(list(meal_filters)))
-    stmt = stmt.order_by(Listing.date, Listing.meal_type, Listing.created_at).limit(limit).offset(offset)
-    result = await session.execute(stmt)
+        filters = replace(filters, meals=tuple(meal_filters))
+    result = await session.execute(active_listings_query(filters, limit=limit, after=after))
     return result.scalars().all()
 
 
@@ -103,10 +397,42 @@ async def get_listing(session: AsyncSession, listing_id: int) -> Listing | None:
 
 
 async def set_listing_status(session: AsyncSession, listing_id: int, status: ListingStatus) -> None:
+    if status in code_index.CLAIMED_LISTING_STATUSES:
+        if not await code_index.reclaim_hash(session, listing_id):
+            raise ValueError(fa.SELL_CODE_DUPLICATE)
+    else:
+        await code_index.release_hashes(session, [listing_id])
     stmt = (
         update(Listing)
         .where(Listing.id == listing_id)
         .values(status=status, updated_at=datetime.utcnow())
     )
     await session.execute(stmt)
+    if status == ListingStatus.active:
+        listing = await session.get(Listing, listing_id, populate_existing=True)
+        if listing is not None:
+            await watch_service.forget_announcements(session, [listing_id])
+            await announce_active(session, [listing])
+    else:
+        catalog.track_removed(session, listing_id)
+
 
+async def expire_stale_listings(session: AsyncSession, limit: int | None = None) -> List[int]:
+    stale = select(Listing.id).where(
+        Listing.status == ListingStatus.active,
+        Listing.expires_at.is_not(None),
+        Listing.expires_at < datetime.utcnow(),
+    )
+    if limit is not None:
+        stale = stale.order_by(Listing.expires_at).limit(limit)
+    rows = await update_returning(
+        session,
+        update(Listing)
+        .where(Listing.id.in_(stale), Listing.status == ListingStatus.active)
+        .values(status=ListingStatus.expired, updated_at=datetime.utcnow()),
+        Listing.id,
+    )
+    for row in rows:
+        catalog.track_removed(session, row.id)
+    await code_index.release_hashes(session, [row.id for row in rows])
+    return [row.id for row in rows]
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..crypto import cipher
+from ..db import on_commit, update_returning
+from ..models import OutboxMessage, OutboxStatus, User
+
+# A claimed message that is still ``sending`` after this long belongs to a sender that died.
+CLAIM_LEASE = timedelta(minutes=5)
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 15 * 60
+
+
+@dataclass(frozen=True)
+class PendingMessage:
+    id: int
+    chat_id: int
+    text: str
+    attempts: int
+
+
+class OutboxSignal:
+    """Wakes the sender as soon as a transaction with new messages commits.
+
+    Only within this process: messages committed by another worker wait for the sender's
+    next poll, ``scheduler.outbox.POLL_INTERVAL_SECONDS`` at most.
+    """
+
+    def __init__(self) -> None:
+        self._event = asyncio.Event()
+
+    def notify(self) -> None:
+        self._event.set()
+
+    async def wait(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+
+outbox_signal = OutboxSignal()
+
+
+async def enqueue(session: AsyncSession, chat_id: int, text: str, sensitive: bool = False) -> None:
+    """Queues ``text`` for ``chat_id`` in the caller's transaction; it is only sent if that commits."""
+    if sensitive:
+        session.add(OutboxMessage(chat_id=chat_id, text_enc=await cipher.encrypt_async(text)))
+    else:
+        session.add(OutboxMessage(chat_id=chat_id, text=text))
+    on_commit(session, outbox_signal.notify)
+
+
+async def enqueue_to_user(session: AsyncSession, user_id: int, text: str, sensitive: bool = False) -> None:
+    tg_id = (await session.execute(select(User.tg_id).where(User.id == user_id))).scalar_one_or_none()
+    if tg_id is None:
+        raise ValueError("کاربر پیدا نشد.")
+    await enqueue(session, tg_id, text, sensitive=sensitive)
+
+
+async def enqueue_batch(session: AsyncSession, messages: Iterable[Tuple[int, str]], sensitive: bool = False) -> int:
+    """Queues ``(chat_id, text)`` pairs with a single multi-row insert."""
+    messages = list(messages)
+    if sensitive:
+        tokens = await cipher.encrypt_many_async([text for _, text in messages])
+        rows = [{"chat_id": chat_id, "text_enc": token} for (chat_id, _), token in zip(messages, tokens)]
+    else:
+        rows = [{"chat_id": chat_id, "text": text} for chat_id, text in messages]
+    if rows:
+        await session.execute(insert(OutboxMessage), rows)
+        on_commit(session, outbox_signal.notify)
+    return len(rows)
+
+
+async def enqueue_many(session: AsyncSession, chat_ids: Iterable[int], text: str) -> int:
+    """Queues one copy of ``text`` per distinct chat."""
+    return await enqueue_batch(session, ((chat_id, text) for chat_id in dict.fromkeys(chat_ids)))
+
+
+async def claim_due(session: AsyncSession, limit: int, now: Optional[datetime] = None) -> List[PendingMessage]:
+    """Leases up to ``limit`` due messages to the caller, oldest first."""
+    now = now or datetime.utcnow()
+    due_ids = (
+        select(OutboxMessage.id)
+        .where(
+            or_(OutboxMessage.status == OutboxStatus.pending, OutboxMessage.status == OutboxStatus.sending),
+            OutboxMessage.next_attempt_at <= now,
+        )
+        .order_by(OutboxMessage.next_attempt_at, OutboxMessage.id)
+        .limit(limit)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(due_ids))
+        .values(
+            status=OutboxStatus.sending,
+            attempts=OutboxMessage.attempts + 1,
+            next_attempt_at=now + CLAIM_LEASE,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    rows = await update_returning(
+        session,
+        stmt,
+        OutboxMessage.id,
+        OutboxMessage.chat_id,
+        OutboxMessage.text,
+        OutboxMessage.text_enc,
+        OutboxMessage.attempts,
+    )
+    # Without RETURNING the rows were read before the increment.
+    bump = 0 if session.get_bind().dialect.update_returning else 1
+    encrypted = [row.text_enc for row in rows if row.text_enc is not None]
+    plain = iter(await cipher.decrypt_many_async(encrypted))
+    messages = [
+        PendingMessage(
+            id=row.id,
+            chat_id=row.chat_id,
+            text=next(plain) if row.text_enc is not None else row.text,
+            attempts=row.attempts + bump,
+        )
+        for row in rows
+    ]
+    return sorted(messages, key=lambda message: message.id)
+
+
+def retry_delay(attempts: int) -> float:
+    return min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+
+
+async def mark_sent(session: AsyncSession, message_id: int) -> None:
+    await session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id == message_id)
+        .values(status=OutboxStatus.sent, sent_at=datetime.utcnow(), text_enc=None, last_error=None),
+    )
+
+
+async def mark_retry(session: AsyncSession, message_id: int, delay_seconds: float, error: str) -> None:
+    await session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id == message_id)
+        .values(
+            status=OutboxStatus.pending,
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=delay_seconds),
+            last_error=error,
+        ),
+    )
+
+
+async def defer(session: AsyncSession, message_id: int, delay_seconds: float) -> None:
+    """Hands a claimed message back unsent, to be claimed again in ``delay_seconds``; not an attempt."""
+    await session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id == message_id)
+        .values(
+            status=OutboxStatus.pending,
+            attempts=OutboxMessage.attempts - 1,
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=delay_seconds),
+        ),
+    )
+
+
+async def mark_failed(session: AsyncSession, message_id: int, error: str) -> None:
+    await session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id == message_id)
+        .values(status=OutboxStatus.failed, text_enc=None, last_error=error),
+    )
@@ -1,15 +1,25 @@
 from __future__ import annotations
 
 import logging
-from datetime import datetime
-from typing import List
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Iterable, List, Optional
 
-from sqlalchemy import select
+from sqlalchemy import func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
-from ..models import Payment, PaymentStatus, Reservation, ReservationStatus
-from .reservation_service import mark_reservation_approved, mark_reservation_paid, mark_reservation_rejected
+from ..crypto import cipher
+from ..db import update_returning
+from ..messages import fa
+from ..models import Listing, Payment, PaymentStatus, Reservation, ReservationStatus, User
+from . import outbox_service
+from .reservation_service import (
+    approve_reservations,
+    mark_reservation_approved,
+    mark_reservation_paid,
+    mark_reservation_rejected,
+    reject_reservations,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -50,16 +60,48 @@ async def submit_payment(
     return payment_obj
 
 
-async def list_pending_payments(session: AsyncSession) -> List[Payment]:
+@dataclass(frozen=True)
+class PaymentQueueItem:
+    payment_id: int
+    reservation_id: int
+    buyer_name: str
+    dish_name: str
+    listing_date: date
+    method: str
+
+
+@dataclass(frozen=True)
+class PaymentQueuePage:
+    items: List[PaymentQueueItem]
+    next_after: Optional[int]
+
+
+async def count_pending_payments(session: AsyncSession) -> int:
+    result = await session.execute(select(func.count()).select_from(Payment).where(Payment.status == PaymentStatus.pending))
+    return result.scalar_one()
+
+
+async def list_pending_payments_page(session: AsyncSession, after_id: int = 0, limit: int = 10) -> PaymentQueuePage:
+    """Returns up to ``limit`` pending payments with ids above ``after_id``, oldest first."""
     result = await session.execute(
-        select(Payment)
-        .options(
-            selectinload(Payment.reservation).selectinload(Reservation.listing),
-            selectinload(Payment.reservation).selectinload(Reservation.buyer),
+        select(
+            Payment.id,
+            Payment.reservation_id,
+            User.name,
+            Listing.dish_name,
+            Listing.date,
+            Payment.method,
         )
-        .where(Payment.status == PaymentStatus.pending),
+        .join(Reservation, Reservation.id == Payment.reservation_id)
+        .join(User, User.id == Reservation.buyer_id)
+        .join(Listing, Listing.id == Reservation.listing_id)
+        .where(Payment.status == PaymentStatus.pending, Payment.id > after_id)
+        .order_by(Payment.id)
+        .limit(limit + 1),
     )
-    return result.scalars().all()
+    items = [PaymentQueueItem(*row) for row in result.all()]
+    next_after = items[limit - 1].payment_id if len(items) > limit else None
+    return PaymentQueuePage(items=items[:limit], next_after=next_after)
 
 
 async def approve_payment(session: AsyncSession, payment_id: int, admin_id: int) -> Payment:
@@ -69,7 +111,14 @@ async def approve_payment(session: AsyncSession, payment_id: int, admin_id: int)
     payment.status = PaymentStatus.approved
     payment.reviewed_at = datetime.utcnow()
     payment.reviewed_by = admin_id
-    await mark_reservation_approved(session, payment.reservation_id)
+    reservation = await mark_reservation_approved(session, payment.reservation_id)
+    listing = await session.get(Listing, reservation.listing_id)
+    await outbox_service.enqueue_to_user(
+        session,
+        reservation.buyer_id,
+        fa.CODE_DELIVERED.format(code=await cipher.decrypt_async(listing.full_code_enc)),
+        sensitive=True,
+    )
     return payment
 
 
@@ -80,5 +129,73 @@ async def reject_payment(session: AsyncSession, payment_id: int, admin_id: int)
     payment.status = PaymentStatus.rejected
     payment.reviewed_at = datetime.utcnow()
     payment.reviewed_by = admin_id
-    await mark_reservation_rejected(session, payment.reservation_id)
+    reservation = await mark_reservation_rejected(session, payment.reservation_id)
+    await outbox_service.enqueue_to_user(session, reservation.buyer_id, fa.PAYMENT_REJECTED)
     return payment
+
+
+@dataclass(frozen=True)
+class PaymentOutcome:
+    payment_id: int
+    ok: bool
+    error: Optional[str] = None
+
+
+async def review_payments(
+    session: AsyncSession,
+    payment_ids: Iterable[int],
+    admin_id: int,
+    approve: bool,
+) -> List[PaymentOutcome]:
+    """Approves or rejects every still-pending payment in ``payment_ids`` in one transaction.
+
+    Buyers are notified through the outbox, so nothing is sent unless the batch commits.
+    """
+    ids = list(dict.fromkeys(payment_ids))
+    if not ids:
+        return []
+    reviewed = await update_returning(
+        session,
+        update(Payment)
+        .where(Payment.id.in_(ids), Payment.status == PaymentStatus.pending)
+        .values(
+            status=PaymentStatus.approved if approve else PaymentStatus.rejected,
+            reviewed_at=datetime.utcnow(),
+            reviewed_by=admin_id,
+        ),
+        Payment.id,
+        Payment.reservation_id,
+    )
+    reservation_ids = [row.reservation_id for row in reviewed]
+    if approve:
+        settled = await approve_reservations(session, reservation_ids) if reservation_ids else []
+        deliveries = await session.execute(
+            select(User.tg_id, Listing.full_code_enc)
+            .join(Reservation, Reservation.buyer_id == User.id)
+            .join(Listing, Listing.id == Reservation.listing_id)
+            .where(Reservation.id.in_([row.id for row in settled])),
+        )
+        deliveries = deliveries.all()
+        codes = await cipher.decrypt_many_async([row.full_code_enc for row in deliveries])
+        await outbox_service.enqueue_batch(
+            session,
+            ((row.tg_id, fa.CODE_DELIVERED.format(code=code)) for row, code in zip(deliveries, codes)),
+            sensitive=True,
+        )
+    else:
+        settled = await reject_reservations(session, reservation_ids) if reservation_ids else []
+        buyers = await session.execute(select(User.tg_id).where(User.id.in_({row.buyer_id for row in settled})))
+        await outbox_service.enqueue_many(session, buyers.scalars().all(), fa.PAYMENT_REJECTED)
+
+    done = {row.id for row in reviewed}
+    known = set((await session.execute(select(Payment.id).where(Payment.id.in_(ids)))).scalars().all())
+    outcomes = []
+    for payment_id in ids:
+        if payment_id in done:
+            outcomes.append(PaymentOutcome(payment_id, ok=True))
+        elif payment_id in known:
+            outcomes.append(PaymentOutcome(payment_id, ok=False, error="این رسید قبلاً بررسی شده است."))
+        else:
+            outcomes.append(PaymentOutcome(payment_id, ok=False, error="رسید پیدا نشد."))
+    logger.info("Admin %s reviewed %s of %s payments (approve=%s)", admin_id, len(done), len(ids), approve)
+    return outcomes
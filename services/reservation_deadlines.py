@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db import on_commit
+from ..models import Reservation, ReservationStatus
+
+logger = logging.getLogger(__name__)
+
+FireCallback = Callable[[List[int]], Awaitable[None]]
+
+
+class DeadlineScheduler:
+    """Min-heap of reservation deadlines that wakes exactly when the earliest one is due.
+
+    Cancelled or rescheduled entries are left in the heap and skipped when popped; the
+    ``_deadlines`` map is the source of truth for what is still pending.
+    """
+
+    def __init__(self, batch_size: int = 100) -> None:
+        self.batch_size = batch_size
+        self._heap: List[Tuple[datetime, int]] = []
+        self._deadlines: Dict[int, datetime] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, key: int, deadline: datetime) -> None:
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        if self._heap[0] == (deadline, key):
+            self._wakeup.set()
+
+    def cancel(self, key: int) -> None:
+        self._deadlines.pop(key, None)
+
+    def get(self, key: int) -> Optional[datetime]:
+        return self._deadlines.get(key)
+
+    def replace(self, entries: Iterable[Tuple[int, datetime]]) -> None:
+        self._deadlines = dict(entries)
+        self._heap = [(deadline, key) for key, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def track_scheduled(self, session: AsyncSession, key: int, deadline: datetime) -> None:
+        on_commit(session, lambda: self.schedule(key, deadline))
+
+    def track_cancelled(self, session: AsyncSession, key: int) -> None:
+        on_commit(session, lambda: self.cancel(key))
+
+    def pop_due(self, now: datetime) -> List[int]:
+        due: List[int] = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            deadline, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+                due.append(key)
+        return due
+
+    def next_delay(self, now: datetime) -> Optional[float]:
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max((self._heap[0][0] - now).total_seconds(), 0.0)
+
+    def start(self, fire: FireCallback) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(fire))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, fire: FireCallback) -> None:
+        while True:
+            due = self.pop_due(datetime.utcnow())
+            if due:
+                try:
+                    await fire(due)
+                except Exception:
+                    # The reconciliation sweep picks these up if the batch could not be expired.
+                    logger.exception("Failed to expire reservations %s", due)
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.next_delay(datetime.utcnow()))
+            except asyncio.TimeoutError:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+
+async def load_pending_deadlines(session: AsyncSession) -> List[Tuple[int, datetime]]:
+    result = await session.execute(
+        # reservation_service.EXPIRABLE_RESERVATION_STATUSES; that module imports this one.
+        select(Reservation.id, Reservation.reserved_until).where(
+            Reservation.status.in_((ReservationStatus.pending, ReservationStatus.paid)),
+        ),
+    )
+    return [(row.id, row.reserved_until) for row in result.all()]
+
+
+reservation_deadlines = DeadlineScheduler()
@@ -1,58 +1,110 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import weakref
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
 
-from sqlalchemy import and_, func, select, update
+from sqlalchemy import Row, and_, exists, func, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
 from ..config import settings
+from ..db import update_returning
+from ..messages import fa
 from ..models import (
     Listing,
     ListingStatus,
     Reservation,
     ReservationStatus,
+    ReservationWarning,
+    User,
 )
+from . import outbox_service, waitlist_service, watch_service
+from .listing_catalog import RECORD_COLUMNS, ListingRecord, catalog
+from .listing_events import announce_active
+from .reservation_deadlines import reservation_deadlines
 
 logger = logging.getLogger(__name__)
 
+OPEN_RESERVATION_STATUSES = (ReservationStatus.pending, ReservationStatus.paid, ReservationStatus.approved)
+EXPIRABLE_RESERVATION_STATUSES = (ReservationStatus.pending, ReservationStatus.paid)
 
-async def count_open_reservations(session: AsyncSession, buyer_id: int) -> int:
-    stmt = select(func.count(Reservation.id)).where(
+_claim_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+@asynccontextmanager
+async def listing_claim_lock(listing_id: int) -> AsyncIterator[None]:
+    """Queues same-process claims on one listing so they don't spin on the database write lock."""
+    lock = _claim_locks.get(listing_id)
+    if lock is None:
+        lock = _claim_locks[listing_id] = asyncio.Lock()
+    async with lock:
+        yield
+
+
+def _open_reservations_count(buyer_id: int):
+    return select(func.count(Reservation.id)).where(
         Reservation.buyer_id == buyer_id,
-        Reservation.status.in_(
-            [ReservationStatus.pending, ReservationStatus.paid, ReservationStatus.approved],
-        ),
+        Reservation.status.in_(OPEN_RESERVATION_STATUSES),
     )
-    result = await session.execute(stmt)
-    return int(result.scalar_one())
 
 
-async def reservation_exists(session: AsyncSession, listing_id: int, buyer_id: int) -> bool:
-    stmt = select(Reservation.id).where(
+def _open_reservation_on_listing(listing_id: int, buyer_id: int):
+    return exists().where(
         Reservation.listing_id == listing_id,
         Reservation.buyer_id == buyer_id,
-        Reservation.status.in_([ReservationStatus.pending, ReservationStatus.paid, ReservationStatus.approved]),
+        Reservation.status.in_(OPEN_RESERVATION_STATUSES),
     )
-    result = await session.execute(stmt)
-    return result.scalar_one_or_none() is not None
 
 
-async def create_reservation(session: AsyncSession, listing_id: int, buyer_id: int) -> Reservation:
-    listing = await session.get(Listing, listing_id)
-    if listing is None or listing.status != ListingStatus.active:
-        raise ValueError("آگهی در دسترس نیست.")
+async def count_open_reservations(session: AsyncSession, buyer_id: int) -> int:
+    result = await session.execute(_open_reservations_count(buyer_id))
+    return int(result.scalar_one())
 
-    if await reservation_exists(session, listing_id, buyer_id):
-        raise ValueError("برای این آگهی رزرو فعال داری.")
 
-    open_count = await count_open_reservations(session, buyer_id)
+async def reservation_exists(session: AsyncSession, listing_id: int, buyer_id: int) -> bool:
+    result = await session.execute(select(_open_reservation_on_listing(listing_id, buyer_id)))
+    return bool(result.scalar_one())
+
+
+async def _raise_claim_failure(session: AsyncSession, listing_id: int, buyer_id: int) -> None:
+    stmt = select(
+        select(Listing.status).where(Listing.id == listing_id).scalar_subquery(),
+        _open_reservation_on_listing(listing_id, buyer_id),
+        _open_reservations_count(buyer_id).scalar_subquery(),
+    )
+    status, duplicate, open_count = (await session.execute(stmt)).one()
+    if status != ListingStatus.active:
+        raise ValueError("آگهی در دسترس نیست.")
+    if duplicate:
+        raise ValueError("برای این آگهی رزرو فعال داری.")
     if open_count >= settings.reservation_limit_per_user:
         raise PermissionError("به سقف رزروهای همزمان رسیده‌ای. ابتدا رزرو قبلی را تعیین تکلیف کن.")
+    raise ValueError("آگهی در دسترس نیست.")
+
+
+async def create_reservation(session: AsyncSession, listing_id: int, buyer_id: int) -> Reservation:
+    # The listing is claimed with a single compare-and-set UPDATE that also enforces the
+    # buyer's quotas, so of several buyers racing for one listing exactly one sees rowcount 1.
+    claim = (
+        update(Listing)
+        .where(
+            Listing.id == listing_id,
+            Listing.status == ListingStatus.active,
+            ~_open_reservation_on_listing(listing_id, buyer_id),
+            _open_reservations_count(buyer_id).scalar_subquery() < settings.reservation_limit_per_user,
+        )
+        .values(status=ListingStatus.reserved, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session="fetch")
+    )
+    result = await session.execute(claim)
+    if result.rowcount != 1:
+        await _raise_claim_failure(session, listing_id, buyer_id)
 
-    listing.status = ListingStatus.reserved
+    catalog.track_removed(session, listing_id)
     reserved_until = datetime.utcnow() + timedelta(minutes=settings.reserve_ttl_minutes)
     reservation = Reservation(
         listing_id=listing_id,
@@ -61,6 +113,7 @@ async def create_reservation(session: AsyncSession, listing_id: int, buyer_id: i
     )
     session.add(reservation)
     await session.flush()
+    reservation_deadlines.track_scheduled(session, reservation.id, reserved_until)
     logger.info("Reservation %s created for listing %s by user %s", reservation.id, listing_id, buyer_id)
     return reservation
 
@@ -72,12 +125,60 @@ async def cancel_reservation(session: AsyncSession, reservation_id: int) -> None
     if reservation.status in {ReservationStatus.cancelled, ReservationStatus.expired}:
         return
     reservation.status = ReservationStatus.cancelled
-    listing = await session.get(Listing, reservation.listing_id)
+    reservation_deadlines.track_cancelled(session, reservation_id)
+    # Reloaded: after a rolled-back claim the session may hold this listing expired, and a lazy
+    # refresh cannot run under asyncio.
+    listing = await session.get(Listing, reservation.listing_id, populate_existing=True)
     if listing and listing.status == ListingStatus.reserved:
         listing.status = ListingStatus.active
+        await release_listings(session, [ListingRecord.from_listing(listing)])
     logger.info("Reservation %s cancelled", reservation_id)
 
 
+async def release_listings(session: AsyncSession, records: Sequence[ListingRecord]) -> None:
+    """Puts listings whose reservation lapsed back in play, inside the caller's transaction.
+
+    Each listing first goes to the earliest waitlisted buyer who can still take it, through
+    the same compare-and-set claim as a normal reservation. Waiters who cannot (quota
+    reached, already holding it) are skipped and dropped from the queue. Listings nobody
+    claims go back on the market.
+    """
+    waiting = await waitlist_service.waiters_for(session, [record.id for record in records])
+    unclaimed: List[ListingRecord] = []
+    handed_off: List[Tuple[int, ListingRecord, Reservation]] = []
+    for record in records:
+        tried: List[int] = []
+        for entry_id, user_id in waiting.get(record.id, []):
+            tried.append(entry_id)
+            try:
+                reservation = await create_reservation(session, record.id, user_id)
+            except (ValueError, PermissionError):
+                continue
+            handed_off.append((user_id, record, reservation))
+            break
+        else:
+            unclaimed.append(record)
+        await waitlist_service.remove_entries(session, tried)
+
+    if handed_off:
+        chats = dict(
+            (await session.execute(select(User.id, User.tg_id).where(User.id.in_([item[0] for item in handed_off])))).all(),
+        )
+        await outbox_service.enqueue_batch(
+            session,
+            (
+                (
+                    chats[user_id],
+                    fa.WAITLIST_HANDOFF.format(dish=record.dish_name, until=reservation.reserved_until.strftime("%H:%M:%S")),
+                )
+                for user_id, record, reservation in handed_off
+            ),
+        )
+        logger.info("Handed %s listings to waitlisted buyers", len(handed_off))
+    await watch_service.forget_announcements(session, [record.id for record in unclaimed])
+    await announce_active(session, unclaimed)
+
+
 async def mark_reservation_paid(session: AsyncSession, reservation_id: int) -> Reservation:
     reservation = await session.get(Reservation, reservation_id)
     if reservation is None:
@@ -92,9 +193,12 @@ async def mark_reservation_approved(session: AsyncSession, reservation_id: int)
     if reservation is None:
         raise ValueError("رزرو پیدا نشد.")
     reservation.status = ReservationStatus.approved
+    reservation_deadlines.track_cancelled(session, reservation_id)
     listing = await session.get(Listing, reservation.listing_id)
     if listing:
         listing.status = ListingStatus.sold
+        catalog.track_removed(session, listing.id)
+        await waitlist_service.clear_listings(session, [listing.id])
     await session.flush()
     logger.info("Reservation %s approved", reservation_id)
     return reservation
@@ -105,44 +209,170 @@ async def mark_reservation_rejected(session: AsyncSession, reservation_id: int)
     if reservation is None:
         raise ValueError("رزرو پیدا نشد.")
     reservation.status = ReservationStatus.rejected
+    reservation_deadlines.track_cancelled(session, reservation_id)
     listing = await session.get(Listing, reservation.listing_id)
     if listing:
         listing.status = ListingStatus.active
     await session.flush()
+    if listing:
+        await release_listings(session, [ListingRecord.from_listing(listing)])
     logger.info("Reservation %s rejected", reservation_id)
     return reservation
 
 
-async def expire_overdue_reservations(session: AsyncSession) -> int:
+async def _settle_reservations(
+    session: AsyncSession,
+    reservation_ids: Sequence[int],
+    status: ReservationStatus,
+) -> Sequence[Row]:
+    rows = await update_returning(
+        session,
+        update(Reservation)
+        .where(Reservation.id.in_(list(reservation_ids)))
+        .values(status=status, updated_at=datetime.utcnow()),
+        Reservation.id,
+        Reservation.buyer_id,
+        Reservation.listing_id,
+    )
+    for row in rows:
+        reservation_deadlines.track_cancelled(session, row.id)
+    return rows
+
+
+async def approve_reservations(session: AsyncSession, reservation_ids: Sequence[int]) -> Sequence[Row]:
+    """Set-based :func:`mark_reservation_approved`; returns ``(id, buyer_id, listing_id)`` rows."""
+    rows = await _settle_reservations(session, reservation_ids, ReservationStatus.approved)
+    if rows:
+        listing_ids = {row.listing_id for row in rows}
+        await session.execute(
+            update(Listing)
+            .where(Listing.id.in_(listing_ids))
+            .values(status=ListingStatus.sold, updated_at=datetime.utcnow()),
+        )
+        for listing_id in listing_ids:
+            catalog.track_removed(session, listing_id)
+        await waitlist_service.clear_listings(session, listing_ids)
+    logger.info("Approved %s reservations", len(rows))
+    return rows
+
+
+async def reject_reservations(session: AsyncSession, reservation_ids: Sequence[int]) -> Sequence[Row]:
+    """Set-based :func:`mark_reservation_rejected`; returns ``(id, buyer_id, listing_id)`` rows."""
+    rows = await _settle_reservations(session, reservation_ids, ReservationStatus.rejected)
+    if rows:
+        reactivated = await update_returning(
+            session,
+            update(Listing)
+            .where(Listing.id.in_({row.listing_id for row in rows}), Listing.status == ListingStatus.reserved)
+            .values(status=ListingStatus.active, updated_at=datetime.utcnow()),
+            *RECORD_COLUMNS,
+        )
+        await release_listings(session, [ListingRecord(*record) for record in reactivated])
+    logger.info("Rejected %s reservations", len(rows))
+    return rows
+
+
+@dataclass
+class ExpiryReport:
+    reservation_ids: List[int] = field(default_factory=list)
+    buyer_ids: List[int] = field(default_factory=list)
+    reactivated_listing_ids: List[int] = field(default_factory=list)
+
+    @property
+    def count(self) -> int:
+        return len(self.reservation_ids)
+
+
+async def _expire_where(session: AsyncSession, *criteria) -> ExpiryReport:
     now = datetime.utcnow()
-    stmt = (
-        select(Reservation)
+    expired = await update_returning(
+        session,
+        update(Reservation)
+        .where(Reservation.status.in_(EXPIRABLE_RESERVATION_STATUSES), *criteria)
+        .values(status=ReservationStatus.expired, updated_at=now),
+        Reservation.id,
+        Reservation.buyer_id,
+        Reservation.listing_id,
+    )
+    report = ExpiryReport(
+        reservation_ids=[row.id for row in expired],
+        buyer_ids=[row.buyer_id for row in expired],
+    )
+    if not expired:
+        return report
+    # Only listings still held by the lapsed reservation go back on the market.
+    reactivated = await update_returning(
+        session,
+        update(Listing)
         .where(
-            Reservation.status.in_([ReservationStatus.pending, ReservationStatus.paid]),
-            Reservation.reserved_until < now,
+            Listing.id.in_({row.listing_id for row in expired}),
+            Listing.status == ListingStatus.reserved,
         )
+        .values(status=ListingStatus.active, updated_at=now),
+        *RECORD_COLUMNS,
+    )
+    await release_listings(session, [ListingRecord(*row) for row in reactivated])
+    report.reactivated_listing_ids = [row.id for row in reactivated]
+    return report
+
+
+async def expire_reservations(session: AsyncSession, reservation_ids: Sequence[int]) -> ExpiryReport:
+    if not reservation_ids:
+        return ExpiryReport()
+    return await _expire_where(
+        session,
+        Reservation.id.in_(list(reservation_ids)),
+        Reservation.reserved_until <= datetime.utcnow(),
+    )
+
+
+async def expire_overdue_reservations(session: AsyncSession, limit: int | None = None) -> ExpiryReport:
+    overdue = select(Reservation.id).where(
+        Reservation.status.in_(EXPIRABLE_RESERVATION_STATUSES),
+        Reservation.reserved_until < datetime.utcnow(),
     )
-    result = await session.execute(stmt)
-    reservations = result.scalars().all()
-    count = 0
-    for reservation in reservations:
-        reservation.status = ReservationStatus.expired
-        listing = await session.get(Listing, reservation.listing_id)
-        if listing and listing.status == ListingStatus.reserved:
-            listing.status = ListingStatus.active
-        count += 1
-    if count:
-        logger.info("Expired %s reservations", count)
-    return count
-
-
-async def reservations_about_to_expire(session: AsyncSession, threshold_minutes: int = 3) -> list[Reservation]:
+    if limit is not None:
+        overdue = overdue.order_by(Reservation.reserved_until).limit(limit)
+    report = await _expire_where(session, Reservation.id.in_(overdue))
+    if report.count:
+        logger.info(
+            "Expired %s reservations, reactivated %s listings",
+            report.count,
+            len(report.reactivated_listing_ids),
+        )
+    return report
+
+
+@dataclass(frozen=True)
+class ExpiryWarning:
+    reservation_id: int
+    buyer_tg_id: int
+
+
+async def queue_expiry_warnings(session: AsyncSession, threshold_minutes: int = 3) -> List[ExpiryWarning]:
+    """Warns buyers of pending reservations about to expire that were never warned.
+
+    A reservation is marked warned in the same transaction that queues its message, so it
+    counts as warned only if the message is really on its way.
+    """
     now = datetime.utcnow()
     target = now + timedelta(minutes=threshold_minutes)
-    stmt = select(Reservation).where(
-        Reservation.status == ReservationStatus.pending,
-        Reservation.reserved_until <= target,
-        Reservation.reserved_until > now,
-    ).options(selectinload(Reservation.buyer))
-    result = await session.execute(stmt)
-    return list(result.scalars().all())
+    stmt = (
+        select(Reservation.id, User.tg_id)
+        .join(User, User.id == Reservation.buyer_id)
+        .where(
+            Reservation.status == ReservationStatus.pending,
+            Reservation.reserved_until <= target,
+            Reservation.reserved_until > now,
+            ~exists().where(ReservationWarning.reservation_id == Reservation.id),
+        )
+    )
+    rows = (await session.execute(stmt)).all()
+    if rows:
+        await session.execute(
+            insert(ReservationWarning),
+            [{"reservation_id": row.id, "sent_at": now} for row in rows],
+        )
+        # One message per chat also keeps a buyer with several expiring reservations under the per-chat limit.
+        await outbox_service.enqueue_many(session, (row.tg_id for row in rows), fa.RESERVE_EXPIRY_WARNING)
+    return [ExpiryWarning(reservation_id=row.id, buyer_tg_id=row.tg_id) for row in rows]
@@ -1,14 +1,67 @@
 from __future__ import annotations
 
+from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..cache import TTLCache
+from ..config import settings
+from ..db import on_commit
 from ..models import User
 
 
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    id: int
+    tg_id: int
+    is_banned: bool
+    is_admin: bool
+    is_seller_account: bool
+
+
+user_cache: TTLCache[int, UserSnapshot] = TTLCache(
+    maxsize=settings.user_cache_size,
+    ttl=settings.user_cache_ttl_seconds,
+)
+
+
+def invalidate_cached_user(tg_id: int) -> None:
+    user_cache.pop(tg_id)
+
+
+def _invalidate_on_commit(session: AsyncSession, tg_id: int) -> None:
+    # Before the commit a concurrent update could re-cache the old row for a whole TTL.
+    on_commit(session, lambda: invalidate_cached_user(tg_id))
+
+
+async def get_user_snapshot(session: AsyncSession, tg_id: int) -> Optional[UserSnapshot]:
+    snapshot = user_cache.get(tg_id)
+    if snapshot is not None:
+        return snapshot
+    stmt = select(
+        User.id,
+        User.tg_id,
+        User.is_banned,
+        User.is_admin,
+        User.is_seller_account,
+    ).where(User.tg_id == tg_id)
+    row = (await session.execute(stmt)).first()
+    if row is None:
+        return None
+    snapshot = UserSnapshot(
+        id=row.id,
+        tg_id=row.tg_id,
+        is_banned=row.is_banned,
+        is_admin=row.is_admin,
+        is_seller_account=row.is_seller_account,
+    )
+    user_cache.set(tg_id, snapshot)
+    return snapshot
+
+
 async def get_user_by_tg_id(session: AsyncSession, tg_id: int) -> Optional[User]:
     result = await session.execute(select(User).where(User.tg_id == tg_id))
     return result.scalars().first()
@@ -34,6 +87,7 @@ async def ensure_user_exists(
     )
     session.add(user)
     await session.flush()
+    _invalidate_on_commit(session, tg_id)
     return user
 
 
@@ -41,10 +95,13 @@ async def update_user_email(session: AsyncSession, user: User, email: str, verif
     user.email = email
     user.email_verified = verified
     await session.flush()
+    _invalidate_on_commit(session, user.tg_id)
     return user
 
 
 async def set_ban_status(session: AsyncSession, user_id: int, banned: bool) -> None:
     stmt = update(User).where(User.id == user_id).values(is_banned=banned, updated_at=datetime.utcnow())
     await session.execute(stmt)
-
+    tg_id = (await session.execute(select(User.tg_id).where(User.id == user_id))).scalar_one_or_none()
+    if tg_id is not None:
+        _invalidate_on_commit(session, tg_id)
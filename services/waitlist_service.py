@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..models import Listing, ListingStatus, Reservation, ReservationStatus, User, WaitlistEntry
+
+logger = logging.getLogger(__name__)
+
+
+async def join_waitlist(session: AsyncSession, listing_id: int, user_id: int) -> int:
+    """Queues ``user_id`` for a reserved listing and returns their 1-based position."""
+    listing = (
+        await session.execute(select(Listing.status, Listing.seller_id).where(Listing.id == listing_id))
+    ).first()
+    if listing is None:
+        raise ValueError("آگهی پیدا نشد.")
+    if listing.status == ListingStatus.active:
+        raise ValueError("این آگهی آزاد است؛ مستقیم رزروش کن.")
+    if listing.status != ListingStatus.reserved:
+        raise ValueError("آگهی در دسترس نیست.")
+    if listing.seller_id == user_id:
+        raise ValueError("نمی‌توانی در صف آگهی خودت باشی.")
+    holds = await session.execute(
+        select(Reservation.id).where(
+            Reservation.listing_id == listing_id,
+            Reservation.buyer_id == user_id,
+            Reservation.status.in_((ReservationStatus.pending, ReservationStatus.paid)),
+        ),
+    )
+    if holds.first() is not None:
+        raise ValueError("این آگهی در حال حاضر برای خودت رزرو است.")
+    if await waitlist_length(session, listing_id) >= settings.waitlist_max_per_listing:
+        raise PermissionError("صف انتظار این آگهی پر است.")
+    entry = WaitlistEntry(listing_id=listing_id, user_id=user_id)
+    session.add(entry)
+    try:
+        await session.flush()
+    except IntegrityError as exc:
+        raise ValueError("قبلاً در صف این آگهی هستی.") from exc
+    return await waitlist_position(session, listing_id, entry.id)
+
+
+async def is_waitable(session: AsyncSession, listing_id: int) -> bool:
+    status = (await session.execute(select(Listing.status).where(Listing.id == listing_id))).scalar_one_or_none()
+    return status == ListingStatus.reserved
+
+
+async def leave_waitlist(session: AsyncSession, listing_id: int, user_id: int) -> bool:
+    result = await session.execute(
+        delete(WaitlistEntry).where(WaitlistEntry.listing_id == listing_id, WaitlistEntry.user_id == user_id),
+    )
+    return result.rowcount > 0
+
+
+async def waitlist_length(session: AsyncSession, listing_id: int) -> int:
+    result = await session.execute(select(func.count(WaitlistEntry.id)).where(WaitlistEntry.listing_id == listing_id))
+    return int(result.scalar_one())
+
+
+async def waitlist_position(session: AsyncSession, listing_id: int, entry_id: int) -> int:
+    result = await session.execute(
+        select(func.count(WaitlistEntry.id)).where(WaitlistEntry.listing_id == listing_id, WaitlistEntry.id <= entry_id),
+    )
+    return int(result.scalar_one())
+
+
+async def waiters_for(session: AsyncSession, listing_ids: Iterable[int]) -> Dict[int, List[Tuple[int, int]]]:
+    """``(entry_id, user_id)`` per listing in queue order, skipping banned users."""
+    listing_ids = list(listing_ids)
+    if not listing_ids:
+        return {}
+    result = await session.execute(
+        select(WaitlistEntry.listing_id, WaitlistEntry.id, WaitlistEntry.user_id)
+        .join(User, User.id == WaitlistEntry.user_id)
+        .where(WaitlistEntry.listing_id.in_(listing_ids), User.is_banned.is_(False))
+        .order_by(WaitlistEntry.listing_id, WaitlistEntry.id),
+    )
+    waiters: Dict[int, List[Tuple[int, int]]] = {}
+    for listing_id, entry_id, user_id in result.all():
+        waiters.setdefault(listing_id, []).append((entry_id, user_id))
+    return waiters
+
+
+async def remove_entries(session: AsyncSession, entry_ids: Iterable[int]) -> None:
+    entry_ids = list(entry_ids)
+    if entry_ids:
+        await session.execute(delete(WaitlistEntry).where(WaitlistEntry.id.in_(entry_ids)))
+
+
+async def clear_listings(session: AsyncSession, listing_ids: Iterable[int]) -> None:
+    """Drops the queues of listings that can no longer come back, e.g. once sold."""
+    listing_ids = list(listing_ids)
+    if listing_ids:
+        await session.execute(delete(WaitlistEntry).where(WaitlistEntry.listing_id.in_(listing_ids)))
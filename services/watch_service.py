@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, func, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..messages import fa
+from ..models import MealType, User, Watch, WatchNotification
+from ..normalize import normalize_text
+from . import outbox_service
+from .listing_catalog import ListingRecord
+
+logger = logging.getLogger(__name__)
+
+MEAL_ALIASES = {
+    "lunch": MealType.lunch,
+    "ناهار": MealType.lunch,
+    "نهار": MealType.lunch,
+    "dinner": MealType.dinner,
+    "شام": MealType.dinner,
+}
+ANY = {"any", "هر", "همه"}
+# Matches shown in one notification; the rest are summarised as a count.
+NOTIFY_PREVIEW = 5
+
+
+@dataclass(frozen=True)
+class WatchSpec:
+    date_from: date
+    date_to: date
+    meal_type: Optional[MealType] = None
+    max_price: Optional[int] = None
+    dish_query: Optional[str] = None
+
+
+def parse_date_range(raw: str, today: date) -> Optional[Tuple[date, date]]:
+    """Parses a day, a ``from..to`` range or ``week``; ``None`` when empty or ``any``."""
+    raw = raw.lower()
+    if not raw or raw in ANY:
+        return None
+    if raw == "week":
+        return today, today + timedelta(days=6)
+    start, _, end = raw.partition("..")
+    try:
+        date_from = datetime.strptime(start, "%Y-%m-%d").date()
+        date_to = datetime.strptime(end, "%Y-%m-%d").date() if end else date_from
+    except ValueError as exc:
+        raise ValueError("تاریخ را به صورت YYYY-MM-DD یا YYYY-MM-DD..YYYY-MM-DD بنویس.") from exc
+    if date_to < date_from or date_to < today:
+        raise ValueError("بازهٔ تاریخ نامعتبر است.")
+    return date_from, date_to
+
+
+def parse_watch_spec(raw: str, today: Optional[date] = None) -> WatchSpec:
+    """Parses ``key=value`` terms: ``meal=شام date=2026-10-20 max=80000 dish=کباب``.
+
+    ``date`` takes a day, a ``from..to`` range or ``week``; without it the watch covers the
+    next ``settings.watch_max_days`` days. Every term is optional.
+    """
+    today = today or date.today()
+    horizon = today + timedelta(days=settings.watch_max_days)
+    terms: Dict[str, str] = {}
+    for token in (raw or "").split():
+        key, sep, value = token.partition("=")
+        if not sep or not value:
+            if "dish" in terms:
+                # Multi-word dish names: trailing words without ``=`` extend the dish term.
+                terms["dish"] = f"{terms['dish']} {token}"
+                continue
+            raise ValueError("هر شرط را به شکل کلید=مقدار بنویس؛ مثلاً meal=شام")
+        terms[key.lower()] = value
+
+    unknown = set(terms) - {"meal", "date", "max", "dish"}
+    if unknown:
+        raise ValueError(f"شرط ناشناخته: {', '.join(sorted(unknown))}")
+
+    meal = None
+    if "meal" in terms and terms["meal"].lower() not in ANY:
+        meal = MEAL_ALIASES.get(terms["meal"].lower())
+        if meal is None:
+            raise ValueError("وعده نامعتبر است.")
+
+    date_from, date_to = parse_date_range(terms.get("date", ""), today) or (today, horizon)
+    if date_to > horizon:
+        raise ValueError(f"هشدار حداکثر برای {settings.watch_max_days} روز آینده قابل ثبت است.")
+
+    max_price = None
+    if "max" in terms:
+        if not terms["max"].isdigit():
+            raise ValueError("قیمت باید یک عدد باشد.")
+        max_price = int(terms["max"])
+
+    dish = normalize_text(terms["dish"]) if terms.get("dish") else None
+    return WatchSpec(max(date_from, today), date_to, meal, max_price, dish[:64] if dish else None)
+
+
+async def create_watch(session: AsyncSession, user_id: int, spec: WatchSpec) -> Watch:
+    count = await session.execute(
+        select(func.count(Watch.id)).where(Watch.user_id == user_id, Watch.date_to >= date.today()),
+    )
+    if count.scalar_one() >= settings.watch_limit_per_user:
+        raise PermissionError(fa.WATCH_LIMIT)
+    watch = Watch(
+        user_id=user_id,
+        date_from=spec.date_from,
+        date_to=spec.date_to,
+        meal_type=spec.meal_type,
+        max_price=spec.max_price,
+        dish_query=spec.dish_query,
+    )
+    session.add(watch)
+    await session.flush()
+    logger.info("Watch %s created by user %s", watch.id, user_id)
+    return watch
+
+
+async def list_watches(session: AsyncSession, user_id: int) -> List[Watch]:
+    result = await session.execute(
+        select(Watch).where(Watch.user_id == user_id, Watch.date_to >= date.today()).order_by(Watch.id),
+    )
+    return list(result.scalars().all())
+
+
+async def delete_watch(session: AsyncSession, user_id: int, watch_id: int) -> bool:
+    owned = select(Watch.id).where(Watch.id == watch_id, Watch.user_id == user_id)
+    await session.execute(delete(WatchNotification).where(WatchNotification.watch_id.in_(owned)))
+    result = await session.execute(delete(Watch).where(Watch.id == watch_id, Watch.user_id == user_id))
+    return result.rowcount > 0
+
+
+async def prune_expired_watches(session: AsyncSession) -> int:
+    expired = select(Watch.id).where(Watch.date_to < date.today())
+    await session.execute(delete(WatchNotification).where(WatchNotification.watch_id.in_(expired)))
+    result = await session.execute(delete(Watch).where(Watch.date_to < date.today()))
+    return result.rowcount
+
+
+async def forget_announcements(session: AsyncSession, listing_ids: Sequence[int]) -> None:
+    """Lets the watches hear about these listings again, as they are going back on the market."""
+    if listing_ids:
+        await session.execute(delete(WatchNotification).where(WatchNotification.listing_id.in_(listing_ids)))
+
+
+async def match_watchers(session: AsyncSession, listings: Sequence[ListingRecord]) -> List[Tuple[int, int, ListingRecord]]:
+    """``(watch_id, user_id, listing)`` for every watch that accepts one of ``listings``.
+
+    One index range probe on the watch dates covers the whole batch; the remaining criteria
+    are checked per listing.
+    """
+    if not listings:
+        return []
+    meals = {listing.meal_type for listing in listings}
+    result = await session.execute(
+        select(Watch.id, Watch.user_id, Watch.date_from, Watch.date_to, Watch.meal_type, Watch.max_price, Watch.dish_query)
+        .where(
+            Watch.date_to >= min(listing.date for listing in listings),
+            Watch.date_from <= max(listing.date for listing in listings),
+            or_(Watch.meal_type.is_(None), Watch.meal_type.in_(meals)),
+            or_(Watch.max_price.is_(None), Watch.max_price >= min(listing.price for listing in listings)),
+        )
+        .order_by(Watch.id),
+    )
+    watches = result.all()
+    matches = []
+    for listing in listings:
+        dish = normalize_text(listing.dish_name)
+        matches.extend(
+            (watch.id, watch.user_id, listing)
+            for watch in watches
+            if watch.date_from <= listing.date <= watch.date_to
+            and watch.meal_type in (None, listing.meal_type)
+            and (watch.max_price is None or watch.max_price >= listing.price)
+            and (not watch.dish_query or watch.dish_query in dish)
+            and watch.user_id != listing.seller_id
+        )
+    return matches
+
+
+async def notify_watchers(session: AsyncSession, listings: Iterable[ListingRecord]) -> int:
+    """Queues one notification per interested buyer covering every listing that matched them.
+
+    Each watch is told about a listing once per time it goes on the market: a listing back after
+    a cancelled, rejected or expired reservation is announced again once
+    :func:`forget_announcements` has cleared its earlier round. The caller has just moved the
+    listings to active under a compare-and-set, so no other transaction announces them meanwhile.
+    """
+    matched = await match_watchers(session, list(listings))
+    if not matched:
+        return 0
+    notified = set(
+        (
+            await session.execute(
+                select(WatchNotification.watch_id, WatchNotification.listing_id).where(
+                    WatchNotification.watch_id.in_({watch_id for watch_id, _, _ in matched}),
+                    WatchNotification.listing_id.in_({listing.id for _, _, listing in matched}),
+                ),
+            )
+        ).all(),
+    )
+    fresh = [(watch_id, user_id, listing) for watch_id, user_id, listing in matched if (watch_id, listing.id) not in notified]
+    if not fresh:
+        return 0
+    await session.execute(
+        insert(WatchNotification),
+        [{"watch_id": watch_id, "listing_id": listing.id} for watch_id, _, listing in fresh],
+    )
+    matches: Dict[int, Dict[int, ListingRecord]] = {}
+    for _, user_id, listing in fresh:
+        # A buyer whose several watches match one listing hears about it once.
+        matches.setdefault(user_id, {})[listing.id] = listing
+    chats = dict((await session.execute(select(User.id, User.tg_id).where(User.id.in_(matches)))).all())
+    queued = await outbox_service.enqueue_batch(
+        session,
+        ((chats[user_id], _format_matches(list(found.values()))) for user_id, found in matches.items() if user_id in chats),
+    )
+    logger.debug("Queued %s watch notifications", queued)
+    return queued
+
+
+def _format_matches(listings: List[ListingRecord]) -> str:
+    lines = [
+        fa.format_listing(
+            date=listing.date.isoformat(),
+            meal="ناهار" if listing.meal_type == MealType.lunch else "شام",
+            dish=listing.dish_name,
+            price=listing.price,
+            masked=listing.masked_code,
+        )
+        for listing in listings[:NOTIFY_PREVIEW]
+    ]
+    if len(listings) > NOTIFY_PREVIEW:
+        lines.append(fa.WATCH_MATCH_MORE.format(count=len(listings) - NOTIFY_PREVIEW))
+    return fa.WATCH_MATCH.format(listings="\n".join(lines))
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
 import asyncio
-from typing import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import AsyncContextManager, AsyncIterator, Awaitable, Callable, Iterator, List
 
 import pytest
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
+from ..config import settings
 from ..db import Base
+from ..models import Listing, MealType, User
+from ..services import listing_service
+from ..services.listing_catalog import ListingCatalog, catalog
+from ..services.reservation_deadlines import DeadlineScheduler, reservation_deadlines
 
 
 @pytest.fixture(scope="session")
@@ -16,6 +23,12 @@ def event_loop() -> asyncio.AbstractEventLoop:
     loop.close()
 
 
+@pytest.fixture(autouse=True)
+def code_hash_key(monkeypatch) -> None:
+    """The code index refuses the generated per-process key, which is all the tests run with."""
+    monkeypatch.setattr(settings, "code_hash_key", "test-code-hash-key")
+
+
 @pytest.fixture
 async def session() -> AsyncIterator[AsyncSession]:
     engine = create_async_engine("sqlite+aiosqlite:///:memory:", future=True)
@@ -27,3 +40,82 @@ async def session() -> AsyncIterator[AsyncSession]:
         await session.rollback()
     await engine.dispose()
 
+
+@pytest.fixture
+async def session_factory(tmp_path) -> AsyncIterator[async_sessionmaker[AsyncSession]]:
+    """Sessions on a database file, for tests where several connections must see each other's commits."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", future=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+    await engine.dispose()
+
+
+@pytest.fixture
+def committing_scope(session_factory) -> Callable[[], AsyncContextManager[AsyncSession]]:
+    """Stands in for ``db.session_scope`` on the file database: commits when the block succeeds."""
+
+    @asynccontextmanager
+    async def scope() -> AsyncIterator[AsyncSession]:
+        async with session_factory() as session:
+            yield session
+            await session.commit()
+
+    return scope
+
+
+@pytest.fixture
+def add_users() -> Callable[..., Awaitable[List[User]]]:
+    """Adds a plain UT user per Telegram id and returns them flushed, in order."""
+
+    async def add(session: AsyncSession, *tg_ids: int) -> List[User]:
+        users = [User(tg_id=tg_id, name=f"User{tg_id}", uni="UT", email=None) for tg_id in tg_ids]
+        session.add_all(users)
+        await session.flush()
+        return users
+
+    return add
+
+
+@pytest.fixture
+def make_listing() -> Callable[..., Awaitable[Listing]]:
+    """Lists ``code`` for ``seller`` through the service; any other field can be overridden."""
+
+    async def create(
+        session: AsyncSession,
+        seller: User,
+        code: str,
+        *,
+        listing_date: date | None = None,
+        meal_type: MealType = MealType.lunch,
+        dish_name: str = "زرشک‌پلو",
+        price: int = 50000,
+    ) -> Listing:
+        return await listing_service.create_listing(
+            session=session,
+            seller_id=seller.id,
+            listing_date=listing_date or date.today(),
+            meal_type=MealType(meal_type).value,
+            dish_name=dish_name,
+            price=price,
+            code=code,
+        )
+
+    return create
+
+
+@pytest.fixture
+def fresh_catalog() -> Iterator[ListingCatalog]:
+    """The process-wide listing catalog, loaded but empty; unloaded again after the test."""
+    catalog.replace([])
+    yield catalog
+    catalog.replace([])
+    catalog.loaded = False
+
+
+@pytest.fixture
+def fresh_deadlines() -> Iterator[DeadlineScheduler]:
+    """The process-wide reservation deadlines, cleared after the test."""
+    yield reservation_deadlines
+    reservation_deadlines.replace([])
+
@@ -3,9 +3,11 @@ from __future__ import annotations
 from datetime import datetime, timedelta
 
 import pytest
+from sqlalchemy import select
 
-from ..models import ListingStatus, MealType, ReservationStatus, User
-from ..services import listing_service, payment_service, reservation_service
+from ..messages import fa
+from ..models import Listing, ListingStatus, MealType, OutboxMessage, Reservation, ReservationStatus, User
+from ..services import listing_service, payment_service, reservation_service, waitlist_service
 
 
 @pytest.mark.asyncio
@@ -77,3 +79,148 @@ async def test_payment_reject(session):
     assert reservation.status == ReservationStatus.rejected
     assert listing.status == ListingStatus.active
 
+
+@pytest.mark.asyncio
+async def test_bulk_expiry_in_chunks(session, add_users, make_listing):
+    seller, *buyers = await add_users(session, 700, 701, 702, 703)
+    listings = []
+    for index, buyer in enumerate(buyers):
+        listing = await make_listing(session, seller, f"BULK00{index}", dish_name=f"عدس‌پلو {index}", price=30000)
+        reservation = await reservation_service.create_reservation(session, listing.id, buyer.id)
+        reservation.reserved_until = datetime.utcnow() - timedelta(minutes=1)
+        listings.append(listing)
+    listings[2].status = ListingStatus.sold
+
+    first = await reservation_service.expire_overdue_reservations(session, limit=2)
+    second = await reservation_service.expire_overdue_reservations(session, limit=2)
+
+    assert first.count == 2
+    assert second.count == 1
+    assert sorted(first.buyer_ids + second.buyer_ids) == sorted(buyer.id for buyer in buyers)
+    assert sorted(first.reactivated_listing_ids + second.reactivated_listing_ids) == sorted(
+        listing.id for listing in listings[:2]
+    )
+    assert [listing.status for listing in listings] == [ListingStatus.active, ListingStatus.active, ListingStatus.sold]
+
+    listings[0].expires_at = datetime.utcnow() - timedelta(minutes=1)
+    assert await listing_service.expire_stale_listings(session) == [listings[0].id]
+    assert listings[0].status == ListingStatus.expired
+
+
+@pytest.mark.asyncio
+async def test_expiry_warning_claimed_once(session, add_users, make_listing):
+    seller, buyer = await add_users(session, 800, 801)
+    listing = await make_listing(session, seller, "MACARONI", meal_type=MealType.dinner, dish_name="ماکارونی", price=40000)
+    reservation = await reservation_service.create_reservation(session, listing.id, buyer.id)
+    reservation.reserved_until = datetime.utcnow() + timedelta(minutes=2)
+
+    first = await reservation_service.queue_expiry_warnings(session)
+    second = await reservation_service.queue_expiry_warnings(session)
+
+    assert [(warning.reservation_id, warning.buyer_tg_id) for warning in first] == [(reservation.id, 801)]
+    assert second == []
+    queued = (await session.execute(select(OutboxMessage.chat_id, OutboxMessage.text))).all()
+    assert [tuple(row) for row in queued] == [(801, fa.RESERVE_EXPIRY_WARNING)]
+
+
+@pytest.mark.asyncio
+async def test_pending_payment_queue_pages(session, add_users, make_listing):
+    payment_ids = []
+    for index in range(5):
+        seller, buyer = await add_users(session, 600 + index, 650 + index)
+        listing = await make_listing(session, seller, f"PAGE{index}000", dish_name=f"غذا {index}", price=30000)
+        reservation = await reservation_service.create_reservation(session, listing.id, buyer.id)
+        payment = await payment_service.submit_payment(session, reservation.id, "کارت", f"file6{index}")
+        payment_ids.append(payment.id)
+    await payment_service.reject_payment(session, payment_ids[1], admin_id=1)
+
+    assert await payment_service.count_pending_payments(session) == 4
+    seen = []
+    after_id = 0
+    while True:
+        page = await payment_service.list_pending_payments_page(session, after_id, limit=2)
+        seen.extend(item.payment_id for item in page.items)
+        if page.next_after is None:
+            break
+        after_id = page.next_after
+    assert seen == [payment_ids[0], *payment_ids[2:]]
+    first = (await payment_service.list_pending_payments_page(session, limit=2)).items[0]
+    assert (first.buyer_name, first.dish_name) == ("User650", "غذا 0")
+
+
+@pytest.mark.asyncio
+async def test_bulk_payment_review(session, add_users, make_listing):
+    payments = []
+    for index in range(3):
+        seller, buyer = await add_users(session, 700 + index, 750 + index)
+        listing = await make_listing(
+            session, seller, f"BULK{index}000", meal_type=MealType.dinner, dish_name=f"غذا {index}", price=30000
+        )
+        reservation = await reservation_service.create_reservation(session, listing.id, buyer.id)
+        payment = await payment_service.submit_payment(session, reservation.id, "کارت", f"file7{index}")
+        payments.append((payment.id, reservation.id, listing.id))
+
+    outcomes = await payment_service.review_payments(
+        session,
+        [payments[0][0], payments[1][0], 9999],
+        admin_id=1,
+        approve=True,
+    )
+    assert [outcome.ok for outcome in outcomes] == [True, True, False]
+    again = await payment_service.review_payments(session, [payments[0][0], payments[2][0]], admin_id=1, approve=False)
+    assert [outcome.ok for outcome in again] == [False, True]
+
+    statuses = dict(
+        (await session.execute(select(Reservation.id, Reservation.status).where(Reservation.id.in_([p[1] for p in payments])))).all(),
+    )
+    assert [statuses[p[1]] for p in payments] == [
+        ReservationStatus.approved,
+        ReservationStatus.approved,
+        ReservationStatus.rejected,
+    ]
+    listing_statuses = dict(
+        (await session.execute(select(Listing.id, Listing.status).where(Listing.id.in_([p[2] for p in payments])))).all(),
+    )
+    assert [listing_statuses[p[2]] for p in payments] == [ListingStatus.sold, ListingStatus.sold, ListingStatus.active]
+
+    queued = (await session.execute(select(OutboxMessage).order_by(OutboxMessage.id))).scalars().all()
+    assert [message.chat_id for message in queued] == [750, 751, 752]
+    assert queued[0].text is None and queued[2].text is not None
+
+
+@pytest.mark.asyncio
+async def test_waitlist_hands_off_on_cancel_and_expiry(session, add_users, make_listing):
+    seller, holder, first, second, third = await add_users(session, 800, 801, 802, 803, 804)
+    listing = await make_listing(session, seller, "WAIT0001", dish_name="دیزی", price=20000)
+    with pytest.raises(ValueError):
+        await waitlist_service.join_waitlist(session, listing.id, first.id)
+    held = await reservation_service.create_reservation(session, listing.id, holder.id)
+
+    assert await waitlist_service.join_waitlist(session, listing.id, first.id) == 1
+    assert await waitlist_service.join_waitlist(session, listing.id, second.id) == 2
+    assert await waitlist_service.join_waitlist(session, listing.id, third.id) == 3
+    with pytest.raises(ValueError):
+        await waitlist_service.join_waitlist(session, listing.id, holder.id)
+
+    await reservation_service.cancel_reservation(session, held.id)
+
+    handed = await _open_reservation(session, first.id)
+    assert handed is not None and handed.listing_id == listing.id
+    assert listing.status == ListingStatus.reserved
+
+    handed.reserved_until = datetime.utcnow() - timedelta(seconds=1)
+    await session.flush()
+    report = await reservation_service.expire_overdue_reservations(session)
+    assert report.reservation_ids == [handed.id]
+    assert (await _open_reservation(session, second.id)).listing_id == listing.id
+    assert await waitlist_service.waitlist_length(session, listing.id) == 1
+
+    notified = (await session.execute(select(OutboxMessage.chat_id).order_by(OutboxMessage.id))).scalars().all()
+    assert notified == [first.tg_id, second.tg_id]
+
+
+async def _open_reservation(session, buyer_id):
+    result = await session.execute(
+        select(Reservation).where(Reservation.buyer_id == buyer_id, Reservation.status == ReservationStatus.pending),
+    )
+    return result.scalars().first()
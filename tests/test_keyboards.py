@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+pytest.importorskip("aiogram")
+
+from ..keyboards.buyer import BrowseNext, browse_listing_keyboard, listing_card, listing_version  # noqa: E402
+from ..models import MealType  # noqa: E402
+from ..services.listing_catalog import ListingRecord  # noqa: E402
+
+
+def _record(listing_id: int, updated_at: datetime, dish_name: str = "چلوکباب") -> ListingRecord:
+    return ListingRecord(
+        id=listing_id,
+        seller_id=1,
+        date=date.today(),
+        meal_type=MealType.lunch,
+        dish_name=dish_name,
+        price=50000,
+        masked_code="AB****34",
+        created_at=updated_at,
+        updated_at=updated_at,
+    )
+
+
+def test_browse_next_carries_the_listing_version():
+    stamped = datetime(2026, 10, 18, 12, 0, 0, 123456)
+    record = _record(9001, stamped)
+    packed = browse_listing_keyboard(record).inline_keyboard[0][1].callback_data
+    next_page = BrowseNext.unpack(packed)
+    assert (next_page.item_id, next_page.version) == (9001, listing_version(record))
+
+    # Any edit bumps updated_at, down to the microsecond, and with it the version.
+    assert listing_version(_record(9001, stamped + timedelta(microseconds=1))) == next_page.version + 1
+    assert listing_version(_record(9001, stamped)) == next_page.version
+
+
+def test_listing_card_is_reused_until_the_listing_changes():
+    stamped = datetime(2026, 10, 18, 12, 0, 0)
+    card = listing_card(_record(9002, stamped))
+    # Another read of the same version, e.g. from a later catalog pass, gets the rendered card back.
+    assert listing_card(_record(9002, stamped)) is card
+
+    edited = listing_card(_record(9002, stamped + timedelta(seconds=1), dish_name="جوجه‌کباب"))
+    assert edited is not card
+    assert "جوجه‌کباب" in edited.text and "جوجه‌کباب" not in card.text
+    assert edited.reply_markup != card.reply_markup
@@ -1,11 +1,19 @@
 from __future__ import annotations
 
+import asyncio
+from contextlib import asynccontextmanager
+
 import pytest
+from cryptography.fernet import Fernet
+from sqlalchemy import delete, func, select
 
-from ..config import settings
-from ..crypto import cipher
-from ..models import MealType, User
-from ..services import listing_service, reservation_service
+from ..config import Settings, settings
+from ..crypto import FoodCodeCipher, cipher
+from ..messages import fa
+from ..models import FsmRecord, JobCheckpoint, Listing, ListingCodeHash, ListingStatus, MealType, OutboxMessage, User
+from ..ratelimit import BatchingLimiter, KeyedTokenBuckets, Limit, MemoryLimiterBackend, SqliteLimiterBackend
+from ..services import code_index, key_rotation, listing_service, reservation_service
+from ..services.fsm_store import FsmEntry, FsmStore
 
 
 @pytest.mark.asyncio
@@ -65,3 +73,278 @@ async def test_reservation_limits(session):
             await reservation_service.create_reservation(session, listing2.id, buyer.id)
     finally:
         settings.reservation_limit_per_user = original_limit
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reservations_have_single_winner(session_factory, add_users, make_listing):
+    async with session_factory() as session:
+        seller, *buyers = await add_users(session, 600, *range(610, 618))
+        listing = await make_listing(session, seller, "RACE1234")
+        await session.commit()
+
+    async def attempt(buyer_id: int) -> bool:
+        async with session_factory() as race_session:
+            try:
+                await reservation_service.create_reservation(race_session, listing.id, buyer_id)
+                await race_session.commit()
+                return True
+            except ValueError:
+                await race_session.rollback()
+                return False
+
+    outcomes = await asyncio.gather(*(attempt(buyer.id) for buyer in buyers))
+    assert outcomes.count(True) == 1
+    async with session_factory() as session:
+        assert (await listing_service.get_listing(session, listing.id)).status == ListingStatus.reserved
+
+
+@pytest.mark.asyncio
+async def test_offloaded_cipher_round_trip():
+    codes = [f"CODE{index:04d}" for index in range(600)]
+    tokens = await cipher.encrypt_many_async(codes)
+    assert len(tokens) == len(codes)
+    assert await cipher.decrypt_many_async(tokens) == codes
+    assert await cipher.decrypt_async(await cipher.encrypt_async("ASYNC123")) == "ASYNC123"
+    assert await cipher.decrypt_many_async([]) == []
+
+
+@pytest.mark.asyncio
+async def test_key_rotation_reencrypts_in_resumable_chunks(session, add_users):
+    (seller,) = await add_users(session, 420)
+    for index in range(5):
+        session.add(
+            Listing(
+                seller_id=seller.id,
+                date=listing_service.date.today(),
+                meal_type=MealType.lunch,
+                dish_name=f"غذا {index}",
+                price=10000,
+                masked_code="RO***00",
+                full_code_enc=cipher.encrypt(f"ROTATE{index}"),
+            ),
+        )
+    await session.flush()
+    before = dict((await session.execute(select(Listing.id, Listing.updated_at))).all())
+
+    queued = OutboxMessage(chat_id=420, text_enc=cipher.encrypt("کد: ROTATE9"))
+    sent = OutboxMessage(chat_id=420, text="ok", text_enc=None)
+    conversation = FsmRecord(key="1:420:420:0:default", state="SellStates:price", data_enc=cipher.encrypt('{"code":"ROTATE8"}'))
+    session.add_all([queued, sent, conversation])
+    await session.flush()
+
+    new_key = Fernet.generate_key().decode("utf-8")
+    rotating = FoodCodeCipher([new_key, *settings.encryption_keys])
+    listings, outbox, conversations = key_rotation.ENCRYPTED_COLUMNS
+    assert await key_rotation.reencrypt_chunk(session, listings, limit=2, code_cipher=rotating) == (2, min(before) + 1)
+    checkpoint = await session.get(JobCheckpoint, key_rotation.checkpoint_name(listings, rotating))
+    assert checkpoint.position == min(before) + 1
+    while (await key_rotation.reencrypt_chunk(session, listings, limit=2, code_cipher=rotating))[0]:
+        pass
+    assert checkpoint.completed_at is not None
+    assert not await key_rotation.rotation_complete(session, rotating)
+    while (await key_rotation.reencrypt_chunk(session, outbox, limit=2, code_cipher=rotating))[0]:
+        pass
+    rotated, after = await key_rotation.reencrypt_chunk(session, conversations, limit=2, code_cipher=rotating)
+    assert (rotated, after) == (1, "1:420:420:0:default")
+    assert await key_rotation.reencrypt_chunk(session, conversations, limit=2, after=after, code_cipher=rotating) == (0, None)
+    assert await key_rotation.rotation_complete(session, rotating)
+
+    new_only = FoodCodeCipher(new_key)
+    rows = (await session.execute(select(Listing.id, Listing.full_code_enc, Listing.updated_at).order_by(Listing.id))).all()
+    assert [new_only.decrypt(row.full_code_enc) for row in rows] == [f"ROTATE{index}" for index in range(5)]
+    assert all(row.updated_at == before[row.id] for row in rows)
+    texts = (await session.execute(select(OutboxMessage.text_enc).order_by(OutboxMessage.id))).scalars().all()
+    assert new_only.decrypt(texts[0]) == "کد: ROTATE9" and texts[1] is None
+    data_enc = (await session.execute(select(FsmRecord.data_enc).where(FsmRecord.key == conversation.key))).scalar_one()
+    assert new_only.decrypt(data_enc) == '{"code":"ROTATE8"}'
+
+
+@pytest.mark.asyncio
+async def test_duplicate_codes_are_rejected_and_reported(session, monkeypatch, add_users, make_listing):
+    first_seller, second_seller = await add_users(session, 430, 431)
+
+    original = await make_listing(session, first_seller, "ABCD1234")
+    for variant in ("abcd-1234", "ABCD ۱۲۳۴"):
+        with pytest.raises(ValueError):
+            await make_listing(session, second_seller, variant)
+
+    # Once the original is off the market the code may be listed again, and admins can see both.
+    await listing_service.set_listing_status(session, original.id, ListingStatus.expired)
+    relisted = await make_listing(session, second_seller, "abcd 1234")
+    shared = await code_index.listings_sharing_code(session, relisted.id)
+    assert [item.listing_id for item in shared] == [original.id, relisted.id]
+    groups = await code_index.duplicate_code_groups(session)
+    assert [[item.listing_id for item in group] for group in groups] == [[original.id, relisted.id]]
+
+    # The unique index decides even when a rival listing slipped past the up-front check.
+    async def nothing_claimed(session, hashes):
+        return set()
+
+    claimed_hashes = code_index.claimed_hashes
+    monkeypatch.setattr(code_index, "claimed_hashes", nothing_claimed)
+    drafts = [
+        (1, listing_service.ListingDraft(listing_service.date.today(), MealType.lunch.value, "کباب", 50000, "abcd1234")),
+        (2, listing_service.ListingDraft(listing_service.date.today(), MealType.lunch.value, "کباب", 50000, "EFGH5678")),
+    ]
+    raced, fresh = await listing_service.create_listings_bulk(session, first_seller.id, drafts)
+    assert raced.error == fa.SELL_CODE_DUPLICATE and fresh.ok
+    assert await session.scalar(select(func.count()).select_from(Listing)) == 3
+    monkeypatch.setattr(code_index, "claimed_hashes", claimed_hashes)
+
+    # Listings from before the index existed are picked up by the backfill.
+    await session.execute(delete(ListingCodeHash))
+    while await code_index.backfill_code_hashes_chunk(session, limit=1):
+        pass
+    assert len(await code_index.listings_sharing_code(session, original.id)) == 2
+
+
+def test_keyed_token_buckets_throttle_per_user_and_evict_idle():
+    now = [0.0]
+    buckets = KeyedTokenBuckets(rate=1.0, capacity=2, maxsize=3, clock=lambda: now[0])
+
+    assert [buckets.try_acquire(1) for _ in range(3)] == [True, True, False]
+    assert buckets.try_acquire(2)
+    now[0] += 1.0
+    assert buckets.try_acquire(1)
+    assert not buckets.try_acquire(1)
+
+    # Idle buckets lapse once they would be full again; the LRU caps how many users are tracked.
+    now[0] += 2.0
+    for user_id in range(10, 20):
+        buckets.try_acquire(user_id)
+    assert len(buckets) == 3
+    assert buckets.try_acquire(1) and buckets.try_acquire(1)
+
+
+@pytest.mark.asyncio
+async def test_sqlite_limiter_shares_buckets_across_workers(tmp_path):
+    now = [1000.0]
+    path = str(tmp_path / "ratelimit.db")
+    workers = [BatchingLimiter(SqliteLimiterBackend(path, clock=lambda: now[0])) for _ in range(2)]
+    per_user = Limit(rate=1.0, capacity=3)
+    overall = Limit(rate=1.0, capacity=4)
+    calls = []
+    original = workers[0].backend.acquire_many
+
+    async def counting(claims):
+        calls.append(len(claims))
+        return await original(claims)
+
+    workers[0].backend.acquire_many = counting
+    try:
+        # Concurrent checks on one worker coalesce into a single backend transaction.
+        first = await asyncio.gather(*(workers[0].acquire((("user:1", per_user),)) for _ in range(2)))
+        assert first == [True, True] and calls == [2]
+        # The second worker sees the same bucket: one token left for user 1.
+        assert await workers[1].acquire((("user:1", per_user),))
+        assert not await workers[1].acquire((("user:1", per_user),))
+
+        # A claim spends nothing unless every bucket in it can pay.
+        assert await workers[1].acquire((("user:2", per_user), ("global", overall)))
+        assert not await workers[1].acquire((("user:1", per_user), ("global", overall)))
+        now[0] += 1.0
+        assert await workers[0].acquire((("user:1", per_user), ("global", overall)))
+    finally:
+        for worker in workers:
+            await worker.close()
+
+    memory = BatchingLimiter(MemoryLimiterBackend(maxsize=10, clock=lambda: now[0]))
+    assert [await memory.acquire((("user:1", per_user),)) for _ in range(4)] == [True, True, True, False]
+
+
+@pytest.mark.asyncio
+async def test_fsm_store_coalesces_writes_encrypts_and_expires(session_factory, committing_scope):
+    transactions = []
+
+    @asynccontextmanager
+    async def scope():
+        async with committing_scope() as session:
+            yield session
+        transactions.append(session)
+
+    store = FsmStore(session_factory=scope, flush_interval=0.05)
+    await store.put("1:1:1:0:default", FsmEntry("SellStates:code", {"dish": "کباب"}))
+    entry = await store.get("1:1:1:0:default")
+    entry.data["code"] = "SECRET01"
+    await store.put("1:1:1:0:default", entry)
+    await store.put("1:2:2:0:default", FsmEntry("SellStates:price"))
+    await asyncio.sleep(0.2)
+    # Three quick writes reach the database as one transaction.
+    assert len(transactions) == 1
+
+    async with session_factory() as session:
+        record = await session.get(FsmRecord, "1:1:1:0:default")
+        assert b"SECRET01" not in record.data_enc
+
+    # A fresh worker (empty hot layer) resumes the conversation from the database.
+    restarted = FsmStore(session_factory=scope)
+    assert await restarted.get("1:1:1:0:default") == FsmEntry("SellStates:code", {"dish": "کباب", "code": "SECRET01"})
+
+    await store.put("1:2:2:0:default", FsmEntry())
+    await store.close()
+    async with session_factory() as session:
+        assert await session.get(FsmRecord, "1:2:2:0:default") is None
+        record = await session.get(FsmRecord, "1:1:1:0:default")
+        record.updated_at -= restarted.ttl
+        await session.commit()
+    assert await FsmStore(session_factory=scope).get("1:1:1:0:default") == FsmEntry()
+    assert await restarted.collect_garbage() == 1
+
+    # Each process drops its own expired hot entries; the leader's garbage collection does not reach them.
+    short_lived = FsmStore(session_factory=scope, cache_ttl=0.05)
+    await short_lived.get("1:2:2:0:default")
+    assert short_lived.purge_hot() == 0
+    await asyncio.sleep(0.1)
+    assert short_lived.purge_hot() == 1
+
+    # Data written under a key that has since been dropped is discarded rather than failing every update.
+    await restarted.put("1:3:3:0:default", FsmEntry("SellStates:price", {"code": "SECRET03"}))
+    assert await restarted.flush() == 1
+    rekeyed = FsmStore(session_factory=scope, code_cipher=FoodCodeCipher(Fernet.generate_key().decode()))
+    assert await rekeyed.get("1:3:3:0:default") == FsmEntry()
+    async with session_factory() as session:
+        assert await session.get(FsmRecord, "1:3:3:0:default") is None
+    await restarted.close()
+
+
+def test_runtime_refuses_generated_encryption_key(monkeypatch):
+    monkeypatch.delenv("FERNET_KEY", raising=False)
+    monkeypatch.delenv("FERNET_KEYS", raising=False)
+    monkeypatch.delenv("CODE_HASH_KEY", raising=False)
+    with pytest.raises(RuntimeError):
+        Settings(_env_file=None).require_encryption_key()
+
+    monkeypatch.setenv("FERNET_KEYS", Fernet.generate_key().decode())
+    monkeypatch.setenv("CODE_HASH_KEY", "code-hash-key")
+    Settings(_env_file=None).require_encryption_key()
+    monkeypatch.delenv("CODE_HASH_KEY")
+    monkeypatch.delenv("FERNET_KEYS")
+    monkeypatch.setenv("FERNET_KEY", Fernet.generate_key().decode())
+    Settings(_env_file=None).require_encryption_key()
+
+
+def test_code_index_needs_a_stable_key_with_fernet_keys(monkeypatch):
+    monkeypatch.delenv("FERNET_KEY", raising=False)
+    monkeypatch.delenv("CODE_HASH_KEY", raising=False)
+    monkeypatch.setenv("FERNET_KEYS", Fernet.generate_key().decode())
+    # Only FERNET_KEYS: the fallback would be the generated key, different in every process.
+    with pytest.raises(RuntimeError):
+        Settings(_env_file=None).require_encryption_key()
+    with pytest.raises(RuntimeError):
+        Settings(_env_file=None).code_hash_secret
+
+    monkeypatch.setenv("CODE_HASH_KEY", "code-hash-key")
+    first, second = Settings(_env_file=None), Settings(_env_file=None)
+    first.require_encryption_key()
+    assert first.code_hash_secret == second.code_hash_secret == b"code-hash-key"
+
+
+def test_webhook_requires_a_valid_secret(monkeypatch):
+    monkeypatch.delenv("WEBHOOK_SECRET", raising=False)
+    with pytest.raises(RuntimeError):
+        Settings(_env_file=None).require_webhook_secret()
+    monkeypatch.setenv("WEBHOOK_SECRET", "not allowed: spaces")
+    with pytest.raises(RuntimeError):
+        Settings(_env_file=None).require_webhook_secret()
+    monkeypatch.setenv("WEBHOOK_SECRET", "s3cret_Token-42")
+    Settings(_env_file=None).require_webhook_secret()
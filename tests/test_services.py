@@ -1,14 +1,30 @@
 from __future__ import annotations
 
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
 import pytest
+from sqlalchemy import select, text, update
 
-from ..models import ListingStatus, MealType, ReservationStatus, User
+from ..config import settings
+from ..db import sync_indexes
+from ..messages import fa
+from ..models import Lease, ListingStatus, MealType, OutboxMessage, ReservationStatus, User
+from ..services.leader_lease import LeaderElector
+from ..services.listing_catalog import ListingRecord, catalog
+from ..services.reservation_deadlines import DeadlineScheduler, reservation_deadlines
+from ..webhook import IngestOutcome, OverflowPolicy, UpdateIngestor, shard_key
 from ..services import (
     dispute_service,
     listing_service,
+    outbox_service,
     payment_service,
     rating_service,
     reservation_service,
+    user_service,
+    watch_service,
 )
 
 
@@ -101,3 +117,471 @@ async def test_dispute_creation(session):
     assert dispute.reason == "کد اشتباه بود"
     assert dispute.evidence_file_id == "file456"
 
+
+@pytest.mark.asyncio
+async def test_user_snapshot_cache_invalidation(session):
+    user = await user_service.ensure_user_exists(session, tg_id=30, name="Nima", uni="UT")
+
+    snapshot = await user_service.get_user_snapshot(session, 30)
+    assert snapshot.id == user.id
+    assert not snapshot.is_banned
+    assert user_service.user_cache.get(30) is snapshot
+
+    await user_service.set_ban_status(session, user.id, True)
+    # Dropped only once the ban is committed, so nothing can re-cache the old row meanwhile.
+    assert user_service.user_cache.get(30) is snapshot
+    await session.commit()
+    assert user_service.user_cache.get(30) is None
+    snapshot = await user_service.get_user_snapshot(session, 30)
+    assert snapshot.is_banned
+
+    await user_service.update_user_email(session, user, "nima@ut.ac.ir", False)
+    await session.rollback()
+    assert user_service.user_cache.get(30) is snapshot
+    await user_service.update_user_email(session, user, "nima@ut.ac.ir", False)
+    await session.commit()
+    assert user_service.user_cache.get(30) is None
+
+
+@pytest.mark.asyncio
+async def test_active_listings_keyset_pagination(session, monkeypatch, add_users, make_listing):
+    (seller,) = await add_users(session, 40)
+    monkeypatch.setattr(settings, "daily_listing_limit", 10)
+    for index, meal in enumerate(["lunch", "dinner", "lunch", "dinner", "lunch"]):
+        await make_listing(session, seller, f"PAGE00{index}", meal_type=meal, dish_name=f"غذای {index}")
+
+    everything = await listing_service.list_active_listings(session, limit=10)
+    paged = []
+    cursor = None
+    while True:
+        page = await listing_service.list_active_listings(session, limit=2, after=cursor)
+        if not page:
+            break
+        paged.extend(page)
+        cursor = listing_service.ListingCursor.decode(listing_service.ListingCursor.from_listing(page[-1]).encode())
+
+    assert [listing.id for listing in paged] == [listing.id for listing in everything]
+    assert len(paged) == 5
+
+
+@pytest.mark.asyncio
+async def test_existing_database_gets_new_indexes(session):
+    conn = await session.connection()
+
+    async def indexes():
+        result = await conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))
+        return set(result.scalars().all())
+
+    # A database created before the keyset indexes: the old ones in place, the new ones missing.
+    await conn.execute(text("DROP INDEX idx_listings_status_date_meal_created"))
+    await conn.execute(text("DROP INDEX idx_payments_status_id"))
+    await conn.execute(text("CREATE INDEX idx_listings_seller_id ON listings (seller_id)"))
+    await conn.execute(text("CREATE INDEX idx_payments_status ON payments (status)"))
+
+    await conn.run_sync(sync_indexes)
+    await conn.run_sync(sync_indexes)
+    present = await indexes()
+    assert {"idx_listings_status_date_meal_created", "idx_payments_status_id", "uq_listing_code_hashes_claimed"} <= present
+    assert not {"idx_listings_seller_id", "idx_payments_status"} & present
+
+
+@pytest.mark.asyncio
+async def test_listing_catalog_follows_committed_transitions(session, fresh_catalog, add_users, make_listing):
+    seller, buyer = await add_users(session, 50, 51)
+    buyer_id = buyer.id
+    listing = await make_listing(session, seller, "KOFTE123", meal_type=MealType.dinner, dish_name="کوفته")
+    listing_id = listing.id
+    assert catalog.get(listing_id) is None
+    await session.commit()
+    assert [record.id for record in catalog.after(meal=MealType.dinner)] == [listing_id]
+    assert catalog.after(meal=MealType.lunch) == []
+
+    reservation = await reservation_service.create_reservation(session, listing_id, buyer_id)
+    await session.rollback()
+    assert catalog.get(listing_id) is not None
+
+    reservation = await reservation_service.create_reservation(session, listing_id, buyer_id)
+    await session.commit()
+    assert catalog.get(listing_id) is None
+
+    await reservation_service.cancel_reservation(session, reservation.id)
+    await session.commit()
+    assert catalog.get(listing_id).dish_name == "کوفته"
+
+
+@pytest.mark.asyncio
+async def test_browse_filters_narrow_and_sort(session):
+    today = listing_service.date.today()
+    trusted = User(tg_id=60, name="Parsa", uni="UT", email=None, rating_avg=4.6, rating_cnt=12)
+    fresh = User(tg_id=61, name="Nika", uni="SUT", email=None)
+    session.add_all([trusted, fresh])
+    await session.flush()
+    rows = [
+        (trusted, 0, "lunch", 60000),
+        (trusted, 1, "dinner", 30000),
+        (fresh, 1, "lunch", 20000),
+        (fresh, 3, "dinner", 90000),
+        (trusted, 8, "lunch", 45000),
+    ]
+    ids = []
+    for index, (seller, days, meal, price) in enumerate(rows):
+        listing = await listing_service.create_listing(
+            session=session,
+            seller_id=seller.id,
+            listing_date=today + timedelta(days=days),
+            meal_type=meal,
+            dish_name=f"فیلتر {index}",
+            price=price,
+            code=f"FILTER0{index}",
+        )
+        ids.append(listing.id)
+
+    async def browse(raw, limit=10, after=None):
+        filters = listing_service.parse_browse_filters(raw, today)
+        listings = await listing_service.list_active_listings(session, limit=limit, after=after, filters=filters)
+        return [listing.id for listing in listings]
+
+    assert await browse("") == ids
+    assert await browse("meal=شام") == [ids[1], ids[3]]
+    assert await browse("date=week max=50000") == [ids[1], ids[2]]
+    assert await browse("uni=UT rating=4.5") == [ids[0], ids[1], ids[4]]
+    assert await browse("rating=1 sort=price") == [ids[1], ids[4], ids[0]]
+
+    first = await browse("sort=price", limit=2)
+    assert first == [ids[2], ids[1]]
+    cursor = listing_service.ListingCursor.decode(
+        listing_service.ListingCursor.from_listing(await session.get(listing_service.Listing, first[-1])).encode(),
+    )
+    assert await browse("sort=price", after=cursor) == [ids[4], ids[0], ids[3]]
+
+    for raw in ("colour=red", "rating=9", "sort=name", "max=cheap"):
+        with pytest.raises(ValueError):
+            listing_service.parse_browse_filters(raw, today)
+
+
+def test_catalog_search_normalises_and_ranks_dishes(fresh_catalog):
+    today = listing_service.date.today()
+    created = datetime.utcnow()
+
+    def record(listing_id, dish, days=0):
+        return ListingRecord(listing_id, 1, today + timedelta(days=days), MealType.lunch, dish, 40000, "AB****", created, created)
+
+    catalog.replace(
+        [
+            record(1, "كباب كوبيده", days=1),
+            record(2, "جوجه‌کباب"),
+            record(3, "کباب برگ"),
+            record(4, "قورمه سبزی"),
+        ],
+    )
+    # Arabic kaf, the ZWNJ compound and a half-typed word all reach the same listings.
+    assert [item.id for item in catalog.search("کباب")] == [3, 1, 2]
+    assert [item.id for item in catalog.search("كبا")] == [3, 1]
+    assert [item.id for item in catalog.search("جوجه کباب")] == [2]
+    assert [item.id for item in catalog.search("کباب", offset=1, limit=1)] == [1]
+    assert [item.id for item in catalog.search("قرمه سبزی")] == [4]
+    assert catalog.search("پیتزا") == []
+
+    catalog.discard(3)
+    assert [item.id for item in catalog.search("کباب")] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_deadline_scheduler_fires_at_deadline():
+    deadlines = DeadlineScheduler(batch_size=2)
+    fired = []
+
+    async def fire(keys):
+        fired.append(keys)
+
+    now = datetime.utcnow()
+    deadlines.schedule(1, now + timedelta(milliseconds=50))
+    deadlines.schedule(2, now + timedelta(milliseconds=60))
+    deadlines.schedule(3, now + timedelta(milliseconds=70))
+    deadlines.schedule(4, now + timedelta(hours=1))
+    deadlines.cancel(2)
+    deadlines.start(fire)
+    try:
+        await asyncio.sleep(0.3)
+    finally:
+        await deadlines.stop()
+
+    assert [key for batch in fired for key in batch] == [1, 3]
+    assert len(deadlines) == 1
+    assert 3500 < deadlines.next_delay(datetime.utcnow()) <= 3600
+
+
+@pytest.mark.asyncio
+async def test_reservation_deadline_follows_transitions(session, fresh_deadlines, add_users, make_listing):
+    seller, buyer = await add_users(session, 60, 61)
+    listing = await make_listing(session, seller, "BAGHALI1", dish_name="باقالی‌پلو")
+    reservation = await reservation_service.create_reservation(session, listing.id, buyer.id)
+    await session.commit()
+    assert reservation_deadlines.get(reservation.id) == reservation.reserved_until
+    # A submitted receipt does not stop the clock; only the admin's decision does.
+    await reservation_service.mark_reservation_paid(session, reservation.id)
+    await session.commit()
+    assert reservation_deadlines.get(reservation.id) == reservation.reserved_until
+    await reservation_service.mark_reservation_approved(session, reservation.id)
+    await session.commit()
+    assert reservation_deadlines.get(reservation.id) is None
+
+
+@pytest.mark.asyncio
+async def test_outbox_encrypts_sensitive_messages_and_retries(session):
+    user = await user_service.ensure_user_exists(session, tg_id=60, name="Parisa", uni="UT")
+    await outbox_service.enqueue_to_user(session, user.id, "کد: SECRET42", sensitive=True)
+    await outbox_service.enqueue_many(session, [61, 62, 61], "هشدار")
+    await session.flush()
+
+    stored = (await session.execute(select(OutboxMessage).order_by(OutboxMessage.id))).scalars().all()
+    assert len(stored) == 3
+    assert stored[0].text is None
+    assert b"SECRET42" not in stored[0].text_enc
+
+    claimed = await outbox_service.claim_due(session, limit=2)
+    assert [message.chat_id for message in claimed] == [60, 61]
+    assert claimed[0].text == "کد: SECRET42"
+    assert all(message.attempts == 1 for message in claimed)
+    assert [message.chat_id for message in await outbox_service.claim_due(session, limit=10)] == [62]
+    assert await outbox_service.claim_due(session, limit=10) == []
+
+    await outbox_service.mark_sent(session, claimed[0].id)
+    await outbox_service.mark_retry(session, claimed[1].id, delay_seconds=0, error="timeout")
+    retried = await outbox_service.claim_due(session, limit=10, now=datetime.utcnow() + timedelta(seconds=1))
+    assert [(message.id, message.attempts) for message in retried] == [(claimed[1].id, 2)]
+    # Handing a message back to pace its chat does not use up an attempt.
+    await outbox_service.defer(session, retried[0].id, delay_seconds=0)
+    again = await outbox_service.claim_due(session, limit=10, now=datetime.utcnow() + timedelta(seconds=1))
+    assert [(message.id, message.attempts) for message in again] == [(claimed[1].id, 2)]
+
+    # A lease that ran out hands the message to the next sender.
+    later = datetime.utcnow() + outbox_service.CLAIM_LEASE + timedelta(seconds=1)
+    assert len(await outbox_service.claim_due(session, limit=10, now=later)) == 2
+
+
+@pytest.mark.asyncio
+async def test_bulk_listing_upload_reports_each_row(session, monkeypatch, add_users):
+    (seller,) = await add_users(session, 70)
+    tomorrow = (listing_service.date.today() + timedelta(days=1)).isoformat()
+    raw = "\n".join(
+        [
+            "date,meal,dish,price,code",
+            f"{tomorrow},ناهار,خورشت قیمه,50000,BULK0001",
+            f'{tomorrow},dinner,"کباب, برگ",90000,BULK0002',
+            f"{tomorrow},صبحانه,نان,1000,BULK0003",
+            "",
+            f"{tomorrow}،شام،جوجه،70000،BULK0004",
+            "not-a-date,lunch,پلو,1000,BULK0005",
+            f"{tomorrow},lunch,عدس‌پلو,40000",
+        ],
+    )
+    rows = listing_service.parse_bulk_listings(raw)
+    assert [line for line, _ in rows] == [2, 3, 4, 6, 7, 8]
+
+    monkeypatch.setattr(settings, "daily_listing_limit", 2)
+    results = await listing_service.create_listings_bulk(session, seller.id, rows)
+
+    assert [result.ok for result in results] == [True, True, False, False, False, False]
+    assert results[2].error == "وعده نامعتبر است."
+    assert results[3].error == fa.SELL_LIMIT_REACHED
+    listings = await listing_service.list_active_listings(session, limit=10)
+    assert {listing.id for listing in listings} == {results[0].listing_id, results[1].listing_id}
+    assert {listing.dish_name for listing in listings} == {"خورشت قیمه", "کباب, برگ"}
+    assert all(listing.masked_code.startswith("BU") for listing in listings)
+
+
+def test_watch_spec_parsing():
+    today = listing_service.date(2026, 10, 18)
+    spec = watch_service.parse_watch_spec("meal=شام date=2026-10-20 max=80000", today=today)
+    assert (spec.meal_type, spec.date_from, spec.date_to, spec.max_price) == (
+        MealType.dinner,
+        listing_service.date(2026, 10, 20),
+        listing_service.date(2026, 10, 20),
+        80000,
+    )
+    week = watch_service.parse_watch_spec("meal=lunch date=week", today=today)
+    assert (week.date_from, week.date_to) == (today, listing_service.date(2026, 10, 24))
+    assert watch_service.parse_watch_spec("dish=كباب برگ", today=today).dish_query == "کباب برگ"
+    for bad in ("meal=صبحانه", "date=2026-10-01", "max=ارزان", "price=1", "کباب"):
+        with pytest.raises(ValueError):
+            watch_service.parse_watch_spec(bad, today=today)
+
+
+@pytest.mark.asyncio
+async def test_watchers_notified_when_listing_becomes_active(session, add_users, make_listing):
+    seller, cheap, kebab, lunch = await add_users(session, 80, 81, 82, 83)
+    await watch_service.create_watch(session, cheap.id, watch_service.parse_watch_spec("meal=dinner max=80000"))
+    await watch_service.create_watch(session, kebab.id, watch_service.parse_watch_spec("dish=کباب"))
+    await watch_service.create_watch(session, lunch.id, watch_service.parse_watch_spec("meal=ناهار date=week"))
+    await watch_service.create_watch(session, seller.id, watch_service.parse_watch_spec("meal=dinner"))
+
+    listing = await make_listing(session, seller, "WATCH001", meal_type=MealType.dinner, dish_name="چلو كباب", price=75000)
+
+    async def notified_chats():
+        result = await session.execute(select(OutboxMessage.chat_id).order_by(OutboxMessage.id))
+        return result.scalars().all()
+
+    assert sorted(await notified_chats()) == [81, 82]
+
+    # The same round is announced once, however often it is passed in.
+    assert await watch_service.notify_watchers(session, [ListingRecord.from_listing(listing)]) == 0
+
+    # Back on the market after a cancelled reservation: every matching watch hears of it again.
+    reservation = await reservation_service.create_reservation(session, listing.id, lunch.id)
+    await watch_service.create_watch(session, lunch.id, watch_service.parse_watch_spec("meal=شام"))
+    await reservation_service.cancel_reservation(session, reservation.id)
+    assert sorted(await notified_chats()) == [81, 81, 82, 82, 83]
+    reservation = await reservation_service.create_reservation(session, listing.id, cheap.id)
+    await reservation_service.cancel_reservation(session, reservation.id)
+    assert sorted(await notified_chats()) == [81, 81, 81, 82, 82, 82, 83, 83]
+
+
+@pytest.mark.asyncio
+async def test_webhook_ingestor_dedupes_and_sheds_by_policy():
+    handled = []
+    release = asyncio.Event()
+
+    async def dispatch(update):
+        await release.wait()
+        handled.append(update["update_id"])
+
+    ingestor = UpdateIngestor(dispatch, workers=1, maxsize=2, policy=OverflowPolicy.retry)
+    assert ingestor.offer({"update_id": 1}) is IngestOutcome.queued
+    assert ingestor.offer({"update_id": 1}) is IngestOutcome.duplicate
+    assert ingestor.offer({"update_id": 2}) is IngestOutcome.queued
+    # Full: ask Telegram to redeliver, and do not remember the id so the redelivery is accepted.
+    assert ingestor.offer({"update_id": 3}) is IngestOutcome.retry
+    ingestor.start()
+    release.set()
+    await ingestor.stop()
+    assert handled == [1, 2]
+    assert ingestor.offer({"update_id": 3}) is IngestOutcome.queued
+
+    newest_first = UpdateIngestor(dispatch, workers=1, maxsize=1, policy=OverflowPolicy.drop_oldest)
+    newest_first.offer({"update_id": 10})
+    assert newest_first.offer({"update_id": 11}) is IngestOutcome.queued
+    newest_first.start()
+    await newest_first.stop()
+    assert handled[-1] == 11 and 10 not in handled
+    assert newest_first.stats.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_ingestor_keeps_each_users_updates_in_order():
+    handled = {}
+
+    async def dispatch(update):
+        user_id = update["message"]["from"]["id"]
+        await asyncio.sleep(0.001 * (update["update_id"] % 3))
+        handled.setdefault(user_id, []).append(update["update_id"])
+
+    ingestor = UpdateIngestor(dispatch, workers=4, maxsize=100)
+    ingestor.start()
+    for update_id in range(60):
+        await ingestor.put({"update_id": update_id, "message": {"from": {"id": update_id % 6}, "chat": {"id": 1}}})
+    await ingestor.stop()
+    assert handled == {user_id: list(range(user_id, 60, 6)) for user_id in range(6)}
+
+    message = {"update_id": 1, "message": {"from": {"id": 42}, "chat": {"id": -100}}}
+    callback = {"update_id": 2, "callback_query": {"from": {"id": 42}, "message": {"chat": {"id": -100}}}}
+    channel_post = {"update_id": 3, "channel_post": {"chat": {"id": -100}}}
+    assert shard_key(message) == shard_key(callback) != shard_key(channel_post)
+
+
+@pytest.mark.asyncio
+async def test_leader_lease_elects_one_holder_and_fails_over(committing_scope):
+    events = []
+
+    def elector(holder):
+        async def elected():
+            events.append(("elected", holder))
+
+        async def demoted():
+            events.append(("demoted", holder))
+
+        return LeaderElector(
+            elected,
+            demoted,
+            holder=holder,
+            ttl=timedelta(seconds=30),
+            session_factory=committing_scope,
+        )
+
+    first, second = elector("a"), elector("b")
+    assert await first.tick() is True
+    assert await second.tick() is False
+    assert await first.tick() is True
+    assert events == [("elected", "a")]
+
+    # "a" stops heartbeating; once its lease lapses "b" takes over and "a" steps down.
+    async with committing_scope() as session:
+        await session.execute(update(Lease).values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    assert await second.tick() is True
+    assert await first.tick() is False
+    assert events[1:] == [("elected", "b"), ("demoted", "a")]
+
+    # A clean stop hands the lease back at once.
+    await second.stop()
+    assert await first.tick() is True
+    assert events[3:] == [("demoted", "b"), ("elected", "a")]
+
+    # A renewal that hangs is abandoned after a heartbeat, and the leader steps down while
+    # its last confirmed lease still runs; a follower that hangs is never elected.
+    stalled = asyncio.Event()
+
+    @asynccontextmanager
+    async def stalling_scope():
+        if stalled.is_set():
+            await asyncio.sleep(1)
+        async with committing_scope() as session:
+            yield session
+
+    def prober(holder):
+        async def noted():
+            events.append(holder)
+
+        return LeaderElector(
+            noted,
+            noted,
+            name="probe",
+            holder=holder,
+            ttl=timedelta(seconds=0.3),
+            heartbeat=0.05,
+            session_factory=stalling_scope,
+        )
+
+    probe, follower = prober("c"), prober("d")
+    elected_at = time.monotonic()
+    assert await probe.tick() is True
+    stalled.set()
+    while await probe.tick():
+        pass
+    assert time.monotonic() < elected_at + 0.3
+    assert await follower.tick() is False
+    assert events[5:] == ["c", "c"]
+
+
+@pytest.mark.asyncio
+async def test_catalog_sync_picks_up_changes_committed_elsewhere(session, fresh_catalog, add_users, make_listing):
+    seller, buyer = await add_users(session, 70, 71)
+    await session.commit()
+    await catalog.load(session)
+    # Another process's commits never reach this catalog's commit hooks.
+    catalog.loaded = False
+    listing = await make_listing(session, seller, "ADAS1234", dish_name="عدس پلو")
+    listing_id = listing.id
+    await session.commit()
+    catalog.loaded = True
+    assert catalog.get(listing_id) is None
+
+    assert await catalog.sync(session) == 1
+    assert catalog.get(listing_id).dish_name == "عدس پلو"
+    assert await catalog.sync(session) == 0
+
+    catalog.loaded = False
+    await reservation_service.create_reservation(session, listing_id, buyer.id)
+    await session.commit()
+    catalog.loaded = True
+    assert await catalog.sync(session) == 1
+    assert catalog.get(listing_id) is None
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import asyncio
+import enum
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .cache import TTLCache
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+RawUpdate = Dict[str, Any]
+
+_MIX = 0x9E3779B97F4A7C15
+_MASK = (1 << 64) - 1
+
+
+def update_user_id(update: RawUpdate) -> Optional[int]:
+    """The user an update comes from, else its chat; ``None`` for updates with neither."""
+    for field, payload in update.items():
+        if field == "update_id" or not isinstance(payload, dict):
+            continue
+        user = payload.get("from") or payload.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+def shard_key(update: RawUpdate) -> int:
+    """A well-mixed 64-bit key that is the same for every update of one user.
+
+    Routing on it keeps each user's updates in order, which the FSM relies on. Worker
+    processes are chosen by the high 32 bits and ingestor lanes by the low 32 bits, so the
+    lanes inside one process stay evenly used.
+    """
+    ident = update_user_id(update)
+    if ident is None:
+        ident = update.get("update_id", 0)
+    return (ident * _MIX) & _MASK
+
+
+class OverflowPolicy(str, enum.Enum):
+    # Answer 503 so Telegram redelivers later; nothing is lost, delivery is delayed.
+    retry = "retry"
+    # Accept the new update and discard the oldest queued one.
+    drop_oldest = "drop_oldest"
+    # Acknowledge the new update and discard it.
+    drop_newest = "drop_newest"
+
+
+class IngestOutcome(str, enum.Enum):
+    queued = "queued"
+    duplicate = "duplicate"
+    retry = "retry"
+    dropped = "dropped"
+
+
+@dataclass
+class IngestStats:
+    queued: int = 0
+    duplicates: int = 0
+    retried: int = 0
+    dropped: int = 0
+    failed: int = 0
+
+
+class UpdateIngestor:
+    """Acknowledges webhook updates immediately and processes them on a bounded worker pool.
+
+    :meth:`offer` never awaits: it filters redelivered ``update_id``s, puts the update on a bounded
+    queue and returns, so the HTTP response goes out before any handler runs. When the queue is
+    full the :class:`OverflowPolicy` decides what is shed. Each worker drains its own lane and a
+    user's updates always land in the same lane, so they are handled one at a time and in order.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[RawUpdate], Awaitable[Any]],
+        workers: int = settings.webhook_workers,
+        maxsize: int = settings.webhook_queue_size,
+        policy: OverflowPolicy = OverflowPolicy(settings.webhook_overflow),
+        dedupe_window: float = 600.0,
+    ) -> None:
+        self._dispatch = dispatch
+        self._lanes: List[asyncio.Queue[RawUpdate]] = [
+            asyncio.Queue(maxsize=max(maxsize // workers, 1)) for _ in range(workers)
+        ]
+        self._policy = policy
+        # Telegram redelivers an update until it is acknowledged; ids are monotonic per bot.
+        self._seen: TTLCache[int, bool] = TTLCache(maxsize=max(maxsize * 4, 10_000), ttl=dedupe_window)
+        self._tasks: List[asyncio.Task] = []
+        self.stats = IngestStats()
+
+    def _lane(self, update: RawUpdate) -> asyncio.Queue[RawUpdate]:
+        return self._lanes[(shard_key(update) & 0xFFFFFFFF) % len(self._lanes)]
+
+    def _is_duplicate(self, update_id: Optional[int]) -> bool:
+        if update_id is not None and update_id in self._seen:
+            self.stats.duplicates += 1
+            return True
+        return False
+
+    def offer(self, update: RawUpdate) -> IngestOutcome:
+        update_id: Optional[int] = update.get("update_id")
+        if self._is_duplicate(update_id):
+            return IngestOutcome.duplicate
+        lane = self._lane(update)
+        if lane.full():
+            if self._policy is OverflowPolicy.retry:
+                self.stats.retried += 1
+                return IngestOutcome.retry
+            self.stats.dropped += 1
+            if self._policy is OverflowPolicy.drop_newest:
+                logger.warning("Webhook queue full; dropped update %s", update_id)
+                self._remember(update_id)
+                return IngestOutcome.dropped
+            dropped = lane.get_nowait()
+            lane.task_done()
+            logger.warning("Webhook queue full; dropped oldest update %s", dropped.get("update_id"))
+        lane.put_nowait(update)
+        self._remember(update_id)
+        self.stats.queued += 1
+        return IngestOutcome.queued
+
+    async def put(self, update: RawUpdate) -> IngestOutcome:
+        """Like :meth:`offer`, but waits for room instead of shedding; for sources that can be slowed down."""
+        update_id: Optional[int] = update.get("update_id")
+        if self._is_duplicate(update_id):
+            return IngestOutcome.duplicate
+        self._remember(update_id)
+        await self._lane(update).put(update)
+        self.stats.queued += 1
+        return IngestOutcome.queued
+
+    def _remember(self, update_id: Optional[int]) -> None:
+        if update_id is not None:
+            self._seen.set(update_id, True)
+
+    async def _work(self, lane: asyncio.Queue[RawUpdate]) -> None:
+        while True:
+            update = await lane.get()
+            try:
+                await self._dispatch(update)
+            except Exception:  # noqa: BLE001 - one bad update must not kill the worker
+                self.stats.failed += 1
+                logger.exception("Webhook update %s failed", update.get("update_id"))
+            finally:
+                lane.task_done()
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work(lane)) for lane in self._lanes]
+            logger.info("Update ingestion started with %s workers", len(self._lanes))
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Lets the workers finish what is queued, up to ``drain_timeout`` seconds, then stops them."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(lane.join() for lane in self._lanes)), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Update queue not drained; %s updates abandoned", self.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def qsize(self) -> int:
+        return sum(lane.qsize() for lane in self._lanes)
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.process import BaseProcess
+from typing import Any, List, Optional
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.methods import GetUpdates
+from aiogram.utils.backoff import Backoff, BackoffConfig
+
+from .config import settings
+from .webhook import RawUpdate, UpdateIngestor, shard_key
+
+logger = logging.getLogger(__name__)
+
+# Spawned workers import the package afresh; a forked one would inherit the parent's loop and DB engine.
+_context = multiprocessing.get_context("spawn")
+POLLING_TIMEOUT = 30
+POLLING_BACKOFF = BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1)
+# How often a worker blocked on its queue looks up to notice it should exit.
+QUEUE_POLL_SECONDS = 1.0
+SUPERVISE_SECONDS = 5.0
+
+
+class WorkerPool:
+    """Handler processes, each owning the users whose :func:`shard_key` maps to it.
+
+    :meth:`submit` hands an update to its user's process, so one user's updates are handled in
+    order and their FSM hot cache lives in a single process. The queues are bounded: a full one
+    makes :meth:`submit` wait, which pushes back on whatever feeds the pool. A worker that dies
+    is restarted on the same queue.
+    """
+
+    def __init__(self, count: int = settings.workers, queue_size: int = settings.worker_queue_size) -> None:
+        self._queues = [_context.Queue(maxsize=queue_size) for _ in range(count)]
+        # One thread per queue keeps submissions to a process in order and a full queue from blocking the others.
+        self._executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"worker-{index}") for index in range(count)]
+        self._processes: List[Optional[BaseProcess]] = [None] * count
+        self._supervisor: Optional[asyncio.Task] = None
+
+    def _spawn(self, index: int) -> None:
+        process = _context.Process(target=run_worker, args=(index, self._queues[index]), name=f"bot-worker-{index}")
+        process.start()
+        self._processes[index] = process
+
+    def start(self) -> None:
+        if self._supervisor is not None:
+            return
+        for index in range(len(self._queues)):
+            self._spawn(index)
+        self._supervisor = asyncio.create_task(self._supervise())
+        logger.info("Started %s worker processes", len(self._queues))
+
+    async def _supervise(self) -> None:
+        while True:
+            await asyncio.sleep(SUPERVISE_SECONDS)
+            for index, process in enumerate(self._processes):
+                if process is not None and not process.is_alive():
+                    logger.error("Worker %s exited with %s; restarting", index, process.exitcode)
+                    self._spawn(index)
+
+    async def submit(self, update: RawUpdate) -> None:
+        index = (shard_key(update) >> 32) % len(self._queues)
+        await asyncio.get_running_loop().run_in_executor(self._executors[index], self._queues[index].put, update)
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Asks every worker to finish its queue and exit; stragglers are terminated after ``timeout``."""
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+            self._supervisor = None
+        loop = asyncio.get_running_loop()
+        for index, worker_queue in enumerate(self._queues):
+            # Behind everything already submitted, so queued updates are still handled.
+            await loop.run_in_executor(self._executors[index], worker_queue.put, None)
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in %ss; terminating", index, timeout)
+                process.terminate()
+            self._processes[index] = None
+        for executor in self._executors:
+            executor.shutdown(wait=False)
+
+
+async def poll_updates(bot: Bot, ingestor: UpdateIngestor, allowed_updates: List[str]) -> None:
+    """Long-polls Telegram and feeds raw updates to ``ingestor`` without handling them here.
+
+    An update is confirmed (by the next offset) only once the ingestor has taken it, so a full
+    pipeline slows polling down instead of losing updates.
+    """
+    backoff = Backoff(config=POLLING_BACKOFF)
+    get_updates = GetUpdates(timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates)
+    while True:
+        try:
+            updates = await bot(get_updates, request_timeout=int(bot.session.timeout + POLLING_TIMEOUT))
+        except Exception as exc:  # noqa: BLE001 - the Bot API being unreachable must not stop polling
+            logger.error("Failed to fetch updates - %s: %s", type(exc).__name__, exc)
+            await backoff.asleep()
+            continue
+        backoff.reset()
+        for update in updates:
+            await ingestor.put(update.model_dump(mode="json", by_alias=True, exclude_unset=True))
+            get_updates.offset = update.update_id + 1
+
+
+def run_worker(index: int, updates: Any) -> None:
+    """Entry point of a worker process."""
+    from .app import setup_logging  # noqa: WPS433 - app imports this module
+
+    # Ctrl+C reaches the whole process group; workers wait for the router to stop them in order.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging()
+    # The router checked too, but a worker re-reads the environment and must agree with its peers.
+    settings.require_encryption_key()
+    asyncio.run(_serve(index, updates))
+
+
+async def _serve(index: int, updates: Any) -> None:
+    from .app import build_dispatcher, prepare_runtime, shutdown_runtime, start_background  # noqa: WPS433
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    await prepare_runtime()
+    bot = Bot(token=settings.bot_token, parse_mode=ParseMode.HTML)
+    dp = build_dispatcher()
+    stop_background = await start_background(bot)
+    ingestor = UpdateIngestor(
+        lambda update: dp.feed_raw_update(bot, update),
+        workers=settings.worker_concurrency,
+        maxsize=settings.worker_queue_size,
+    )
+    ingestor.start()
+    logger.info("Worker %s ready", index)
+    try:
+        while True:
+            try:
+                update = await loop.run_in_executor(None, updates.get, True, QUEUE_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if update is None:
+                break
+            await ingestor.put(update)
+    finally:
+        await ingestor.stop()
+        await stop_background()
+        await shutdown_runtime()
+        await bot.session.close()
+        logger.info("Worker %s stopped", index)